@@ -0,0 +1,165 @@
+"""iCalendar feeds, rendered once per schedule snapshot version instead of per request.
+
+Every lesson's weekly VEVENTs are rendered once per snapshot and kept as one text block.
+The public feed is those blocks joined. A personal feed (favorite subjects + the user's
+exams) reuses the same blocks and is cached per (user, data version); a user's favorites and
+reminders are versioned per user, so one user's edit leaves everyone else's feed (and ETag) alone.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+
+from cachetools import LRUCache
+
+from app.config import DAY_MAPPING, PAIR_TIMES, SEMESTER_START
+from app.database import database
+from app.schedule_store import ScheduleSnapshot, get_snapshot
+from utils.cache import data_version, user_tag
+
+# Exams have no end time in the table
+EXAM_DURATION = timedelta(hours=2)
+
+_HEADER = (
+    "BEGIN:VCALENDAR",
+    "VERSION:2.0",
+    "PRODID:-//MXT-223//Schedule//RU",
+    "CALSCALE:GREGORIAN",
+    "METHOD:PUBLISH",
+)
+_TIME_RE = re.compile(r"^(\d{1,2}):(\d{2})")
+
+
+def _hhmmss(value: str) -> str:
+    hours, minutes = value.split(":")
+    return f"{int(hours):02d}{int(minutes):02d}00"
+
+
+# "08:00" -> "080000", parsed once at import instead of per event
+_PAIR_STAMPS = {pair: (_hhmmss(start), _hhmmss(end)) for pair, (start, end) in PAIR_TIMES.items()}
+
+
+def _ymd(d) -> str:
+    return f"{d.year:04d}{d.month:02d}{d.day:02d}"
+
+
+def _lesson_events(lesson) -> str:
+    """All weekly VEVENTs of one lesson as a single text block ("" if it has no slot)."""
+    day_idx = DAY_MAPPING.get(lesson.day)
+    stamps = _PAIR_STAMPS.get(lesson.pair)
+    if day_idx is None or not stamps:
+        return ""
+    start, end = stamps
+    first = SEMESTER_START.date() + timedelta(days=day_idx)
+    summary = f"SUMMARY:{lesson.subject} ({lesson.type})"
+    description = f"DESCRIPTION:Преподаватель: {lesson.teacher}"
+    location = f"LOCATION:{lesson.room}"
+    lines = []
+    for week_num in range(lesson.week_start, lesson.week_end + 1):
+        day = _ymd(first + timedelta(weeks=week_num - 1))
+        lines.extend((
+            "BEGIN:VEVENT",
+            f"DTSTART:{day}T{start}",
+            f"DTEND:{day}T{end}",
+            summary,
+            description,
+            location,
+            f"UID:{lesson.id}-{week_num}@mxt223.com",
+            "END:VEVENT",
+        ))
+    return "\n".join(lines)
+
+
+def _exam_events(exam) -> str:
+    exam_date = str(exam["exam_date"] or "")[:10].replace("-", "")
+    if len(exam_date) != 8:
+        return ""
+    match = _TIME_RE.match(exam["exam_time"] or "")
+    if match:
+        try:
+            day = datetime.strptime(exam_date, "%Y%m%d")
+        except ValueError:
+            return ""
+        # Through datetime, so a late exam ends on the next day instead of wrapping
+        begins = day + timedelta(hours=int(match.group(1)), minutes=int(match.group(2)))
+        ends = begins + EXAM_DURATION
+        start = [f"DTSTART:{begins:%Y%m%dT%H%M%S}", f"DTEND:{ends:%Y%m%dT%H%M%S}"]
+    else:
+        start = [f"DTSTART;VALUE=DATE:{exam_date}"]
+    kind = f" ({exam['exam_type']})" if exam["exam_type"] else ""
+    return "\n".join((
+        "BEGIN:VEVENT",
+        *start,
+        f"SUMMARY:Экзамен: {exam['subject']}{kind}",
+        f"DESCRIPTION:Преподаватель: {exam['teacher'] or ''}",
+        f"LOCATION:{exam['room'] or ''}",
+        f"UID:exam-{exam['id']}@mxt223.com",
+        "END:VEVENT",
+    ))
+
+
+class _Rendered:
+    __slots__ = ("version", "blocks", "feed")
+
+    def __init__(self, snapshot: ScheduleSnapshot):
+        self.version = snapshot.version
+        # (subject, VEVENT block) per lesson, in snapshot order
+        self.blocks = [(lesson.subject, _lesson_events(lesson)) for lesson in snapshot.lessons]
+        self.feed = _join("Расписание МХТ-223", (block for _, block in self.blocks))
+
+
+def _join(name: str, blocks) -> bytes:
+    parts = [*_HEADER, f"X-WR-CALNAME:{name}", "X-WR-TIMEZONE:Asia/Tashkent"]
+    parts.extend(block for block in blocks if block)
+    parts.append("END:VCALENDAR")
+    return "\n".join(parts).encode("utf-8")
+
+
+_rendered: Optional[_Rendered] = None
+# (user, data version) -> personal feed bytes
+_user_feeds: LRUCache = LRUCache(maxsize=256)
+
+
+def _rendered_for(snapshot: ScheduleSnapshot) -> _Rendered:
+    global _rendered
+    rendered = _rendered
+    if rendered is None or rendered.version != snapshot.version:
+        rendered = _rendered = _Rendered(snapshot)
+    return rendered
+
+
+async def schedule_feed() -> bytes:
+    """Whole-group feed; rendered once per schedule snapshot."""
+    return _rendered_for(await get_snapshot()).feed
+
+
+def user_feed_tags(user_id: str) -> tuple:
+    """Tags whose invalidation changes this user's personal feed."""
+    return ("schedule", "exams", user_tag("favorites", user_id), user_tag("reminders", user_id))
+
+
+async def user_feed(user_id: str) -> bytes:
+    """Favorite subjects' lessons + the user's exams (reminders or favorite subjects)."""
+    version, _ = await data_version(user_feed_tags(user_id))
+    snapshot = await get_snapshot()
+    key = (user_id, version, snapshot.version)
+    body = _user_feeds.get(key)
+    if body is not None:
+        return body
+    favorites = {
+        r["subject_name"]
+        for r in await database.fetch_all(
+            "SELECT subject_name FROM user_favorites WHERE student_id = :sid", {"sid": user_id}
+        )
+    }
+    exams = await database.fetch_all(
+        """SELECT e.* FROM exams e
+           WHERE e.id IN (SELECT exam_id FROM exam_reminders WHERE student_id = :sid)
+              OR e.subject IN (SELECT subject_name FROM user_favorites WHERE student_id = :sid)
+           ORDER BY e.exam_date""",
+        {"sid": user_id},
+    )
+    rendered = _rendered_for(snapshot)
+    blocks = [block for subject, block in rendered.blocks if subject in favorites]
+    blocks.extend(_exam_events(exam) for exam in exams)
+    body = _user_feeds[key] = _join("Моё расписание МХТ-223", blocks)
+    return body
@@ -33,6 +33,8 @@ DATABASE_CONNECT_TIMEOUT = int(os.getenv("DATABASE_CONNECT_TIMEOUT", "10"))
 
 # Cache TTL for schedule/subjects/ratings (seconds)
 CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+# Soft TTL: older cached values are served while being recomputed in background (0 = off)
+CACHE_SOFT_TTL_SECONDS = int(os.getenv("CACHE_SOFT_TTL_SECONDS", "60"))
 
 # Rate limit: max requests per window for login/refresh
 RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "5"))
@@ -43,11 +45,22 @@ API_RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("API_RATE_LIMIT_WINDOW_SECONDS", "
 
 # Redis (optional): for schedule cache and health
 REDIS_URL = os.getenv("REDIS_URL", "").strip()
+# Cache backend: memory | redis | tiered (in-process L1 + Redis L2). Default: redis if REDIS_URL else memory
+CACHE_MODE = os.getenv("CACHE_MODE", "").strip().lower()
+# L1 TTL in tiered mode (0 = same as CACHE_TTL_SECONDS); invalidations arrive over pub/sub anyway
+CACHE_L1_TTL_SECONDS = int(os.getenv("CACHE_L1_TTL_SECONDS", "0"))
+# Connection pool size per worker for the Redis cache client
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
 
 # JWT expiry (minutes / days)
 JWT_ACCESS_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_EXPIRE_MINUTES", "15"))
 JWT_REFRESH_EXPIRE_DAYS = int(os.getenv("JWT_REFRESH_EXPIRE_DAYS", "7"))
 REMEMBER_ME_REFRESH_DAYS = int(os.getenv("REMEMBER_ME_REFRESH_DAYS", "30"))
+# Authenticated principals (name, avatar, is_admin) kept per worker; writes invalidate them at once
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "300"))
+# Without CACHE_MODE=tiered other workers' changes cannot reach the cache: entries live this long at most
+PRINCIPAL_CACHE_LOCAL_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_LOCAL_TTL_SECONDS", "15"))
 PASSWORD_RESET_EXPIRE_MINUTES = int(os.getenv("PASSWORD_RESET_EXPIRE_MINUTES", "60"))
 NOTIFY_BEFORE_LESSON_MINUTES = int(os.getenv("NOTIFY_BEFORE_LESSON_MINUTES", "10"))
 
@@ -69,6 +82,32 @@ VAPID_PRIVATE_KEY = os.getenv("VAPID_PRIVATE_KEY")
 VAPID_PUBLIC_KEY = os.getenv("VAPID_PUBLIC_KEY")
 VAPID_CLAIM_EMAIL = os.getenv("VAPID_CLAIM_EMAIL", "mailto:admin@mxt223.com")
 
+# Web Push delivery: parallel requests per push service (FCM, Mozilla, Apple...), request timeout, pool size
+PUSH_CONCURRENCY_PER_ORIGIN = int(os.getenv("PUSH_CONCURRENCY_PER_ORIGIN", "20"))
+PUSH_TIMEOUT_SECONDS = float(os.getenv("PUSH_TIMEOUT_SECONDS", "10"))
+PUSH_MAX_CONNECTIONS = int(os.getenv("PUSH_MAX_CONNECTIONS", "100"))
+# Payload encryption in worker processes for audiences >= PUSH_ENCRYPT_POOL_MIN (0 workers = always in process)
+PUSH_ENCRYPT_WORKERS = int(os.getenv("PUSH_ENCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PUSH_ENCRYPT_POOL_MIN = int(os.getenv("PUSH_ENCRYPT_POOL_MIN", "200"))
+PUSH_ENCRYPT_CHUNK = int(os.getenv("PUSH_ENCRYPT_CHUNK", "100"))
+# Push outbox worker: rows per batch, idle poll interval, claim lease, how long finished rows are kept
+PUSH_OUTBOX_BATCH = int(os.getenv("PUSH_OUTBOX_BATCH", "500"))
+PUSH_OUTBOX_POLL_SECONDS = float(os.getenv("PUSH_OUTBOX_POLL_SECONDS", "2"))
+PUSH_OUTBOX_LEASE_SECONDS = int(os.getenv("PUSH_OUTBOX_LEASE_SECONDS", "120"))
+PUSH_OUTBOX_RETENTION_HOURS = int(os.getenv("PUSH_OUTBOX_RETENTION_HOURS", "72"))
+# Retries of 429/5xx/network failures: exponential backoff from BASE up to MAX (Retry-After wins if longer)
+PUSH_MAX_ATTEMPTS = int(os.getenv("PUSH_MAX_ATTEMPTS", "6"))
+PUSH_RETRY_BASE_SECONDS = float(os.getenv("PUSH_RETRY_BASE_SECONDS", "5"))
+PUSH_RETRY_MAX_SECONDS = float(os.getenv("PUSH_RETRY_MAX_SECONDS", "3600"))
+# "Расписание обновилось": edits this close together become one push, sent at most MAX_DELAY after the first
+SCHEDULE_PUSH_DEBOUNCE_SECONDS = float(os.getenv("SCHEDULE_PUSH_DEBOUNCE_SECONDS", "30"))
+SCHEDULE_PUSH_MAX_DELAY_SECONDS = float(os.getenv("SCHEDULE_PUSH_MAX_DELAY_SECONDS", "300"))
+
+# Leader election for scheduled jobs: only the leader plans and fires reminders
+LEADER_ELECTION = os.getenv("LEADER_ELECTION", "1").lower() in ("1", "true", "yes")
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+LEADER_HEARTBEAT_SECONDS = float(os.getenv("LEADER_HEARTBEAT_SECONDS", "5"))
+
 # Sentry DSN
 SENTRY_DSN = os.getenv("SENTRY_DSN")
 
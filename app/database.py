@@ -10,10 +10,46 @@ if "postgresql" in _url and "connect_timeout" not in _url:
     _url = f"{_url}{sep}connect_timeout={DATABASE_CONNECT_TIMEOUT}"
 database = databases.Database(_url)
 
+async def _migrate_push_subscriptions(ddl: str, is_postgres: bool) -> None:
+    """Rebuild the old (student_id UNIQUE, subscription_data JSON) table, keeping ids."""
+    import json
+
+    from app.push_registry import origin_of, parse_subscription_info
+
+    async with database.transaction():
+        await database.execute("ALTER TABLE push_subscriptions RENAME TO push_subscriptions_legacy")
+        await database.execute(ddl)
+        rows = await database.fetch_all(
+            "SELECT id, student_id, subscription_data, created_at FROM push_subscriptions_legacy ORDER BY id DESC"
+        )
+        seen = set()
+        for row in rows:
+            try:
+                endpoint, p256dh, auth = parse_subscription_info(json.loads(row["subscription_data"] or "{}"))
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if endpoint in seen:
+                continue
+            seen.add(endpoint)
+            await database.execute(
+                """INSERT INTO push_subscriptions (id, student_id, endpoint, p256dh, auth, origin, created_at)
+                   VALUES (:id, :sid, :endpoint, :p256dh, :auth, :origin, :created_at)""",
+                {"id": row["id"], "sid": row["student_id"], "endpoint": endpoint, "p256dh": p256dh,
+                 "auth": auth, "origin": origin_of(endpoint), "created_at": row["created_at"]},
+            )
+        await database.execute("DROP TABLE push_subscriptions_legacy")
+        if is_postgres:
+            await database.execute(
+                "SELECT setval(pg_get_serial_sequence('push_subscriptions', 'id'), "
+                "COALESCE((SELECT MAX(id) FROM push_subscriptions), 0) + 1, false)"
+            )
+
+
 async def init_db():
     """Initialize database tables if they don't exist"""
     is_postgres = "postgresql" in DATABASE_URL
     id_type = "SERIAL PRIMARY KEY" if is_postgres else "INTEGER PRIMARY KEY AUTOINCREMENT"
+    float_type = "DOUBLE PRECISION" if is_postgres else "REAL"
     
     # Students table
     query = f"""
@@ -123,17 +159,28 @@ async def init_db():
         )
     """)
     
-    # Push subscriptions table
-    query = f"""
+    # Push subscriptions: one row per device endpoint (a student can have several)
+    push_subscriptions_ddl = f"""
         CREATE TABLE IF NOT EXISTS push_subscriptions (
             id {id_type},
             student_id TEXT NOT NULL,
-            subscription_data TEXT NOT NULL,
+            endpoint TEXT NOT NULL UNIQUE,
+            p256dh TEXT NOT NULL,
+            auth TEXT NOT NULL,
+            origin TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(student_id)
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """
-    await database.execute(query)
+    await database.execute(push_subscriptions_ddl)
+    try:
+        await database.fetch_one("SELECT endpoint FROM push_subscriptions LIMIT 1")
+    except Exception:
+        logger.info("Migrating: push_subscriptions JSON blobs -> endpoint/p256dh/auth/origin columns...")
+        try:
+            await _migrate_push_subscriptions(push_subscriptions_ddl, is_postgres)
+        except Exception as e:
+            logger.warning("Migration warning (push_subscriptions): %s", e)
     
     # Schedule table
     query = f"""
@@ -305,6 +352,58 @@ async def init_db():
         )
     """)
 
+    # Push outbox: one row per (subscription, message) until delivered; times are unix seconds
+    await database.execute(f"""
+        CREATE TABLE IF NOT EXISTS push_outbox (
+            id {id_type},
+            subscription_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            ttl INTEGER NOT NULL DEFAULT 0,
+            headers_json TEXT,
+            topic TEXT,
+            job_id TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at {float_type} NOT NULL,
+            expires_at {float_type},
+            claim_token TEXT,
+            locked_until {float_type},
+            last_status INTEGER,
+            last_error TEXT,
+            error_class TEXT,
+            origin TEXT,
+            latency {float_type},
+            finished_at {float_type},
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    for column in ("topic TEXT", "job_id TEXT", "error_class TEXT", "origin TEXT", f"latency {float_type}"):
+        try:
+            await database.execute(f"ALTER TABLE push_outbox ADD COLUMN {column}")
+        except Exception:
+            pass
+
+    # One row per broadcast; its outbox rows carry job_id (see app/push_jobs.py)
+    await database.execute(f"""
+        CREATE TABLE IF NOT EXISTS push_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            audience TEXT,
+            total INTEGER NOT NULL DEFAULT 0,
+            encrypt_seconds {float_type} NOT NULL DEFAULT 0,
+            created_at {float_type} NOT NULL
+        )
+    """)
+
+    # Leader election lease (SQLite; PostgreSQL uses an advisory lock), see app/leader.py
+    await database.execute(f"""
+        CREATE TABLE IF NOT EXISTS leader_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at {float_type} NOT NULL
+        )
+    """)
+
     # Achievements definition + user unlocks
     await database.execute(f"""
         CREATE TABLE IF NOT EXISTS achievements (
@@ -529,6 +628,56 @@ async def init_db():
             ON subject_reviews(subject_name, moderated)
         """)
 
+        # Keyset pagination indexes: ORDER BY (created_at, id) with a row-value cursor
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_announcement_comments_keyset
+            ON announcement_comments(announcement_id, created_at, id)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_subject_materials_keyset
+            ON subject_materials(subject_name, created_at, id)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_subject_materials_created
+            ON subject_materials(created_at, id)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_polls_created
+            ON polls(created_at, id)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_schedule_change_log_created
+            ON schedule_change_log(created_at, id)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_subject_reviews_created
+            ON subject_reviews(created_at, id)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_push_subscriptions_student
+            ON push_subscriptions(student_id)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_push_subscriptions_origin
+            ON push_subscriptions(origin)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_push_outbox_due
+            ON push_outbox(status, next_attempt_at)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_push_outbox_claim
+            ON push_outbox(claim_token)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_push_outbox_topic
+            ON push_outbox(topic, subscription_id, status)
+        """)
+        await database.execute("""
+            CREATE INDEX IF NOT EXISTS idx_push_outbox_job
+            ON push_outbox(job_id)
+        """)
+
         logger.info("Database indexes created")
     except Exception as e:
         logger.warning("Could not create indexes: %s", e)
@@ -1,41 +1,51 @@
-from fastapi import Header, HTTPException
+from typing import Optional
+
+from fastapi import Header, HTTPException, Request
 
-from app.database import database
 from app.logging_config import logger
+from app.principal import RequestAuth, load_principal, resolve_auth
+from utils.cache import cross_worker_invalidation
+
 
+def request_auth(request: Optional[Request], authorization: Optional[str]) -> Optional[RequestAuth]:
+    """What PrincipalMiddleware decoded for this request (decoded here when called directly)."""
+    if request is not None and hasattr(request.state, "auth"):
+        return request.state.auth
+    return resolve_auth(authorization)
 
-async def get_current_user(authorization: str = Header(None)):
-    """Get current user info from token"""
-    if not authorization:
+
+def _token_subject(auth: Optional[RequestAuth]) -> str:
+    """telegram_id of an authenticated request; 401 otherwise."""
+    if auth is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    
+    if not auth.verified:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return auth.user_id
+
+
+async def get_optional_user_id(request: Request) -> Optional[str]:
+    """telegram_id from a valid access token, or None for anonymous callers (invalid tokens too)."""
+    auth = request_auth(request, None)
+    return auth.user_id if auth is not None and auth.verified else None
+
+
+async def get_current_user(authorization: str = Header(None), request: Request = None):
+    """
+    Get current user info from token. Resolved from the principal cache or the token's
+    claims; students is only read for tokens without claims on a cache miss.
+    """
     try:
-        from utils.jwt import is_jwt_token, verify_token
-        
-        # Extract token from Bearer header
-        token = authorization.replace("Bearer ", "")
-        
-        # Try to verify as JWT first
-        if is_jwt_token(token):
-            payload = verify_token(token, "access")
-            if payload:
-                telegram_id = payload.get("sub")
-            else:
-                raise HTTPException(status_code=401, detail="Invalid or expired token")
-        else:
-            # Fallback: old format (plain telegram_id for backward compatibility)
-            telegram_id = token
-        
-        # Get user from database
-        query = "SELECT telegram_id, name FROM students WHERE telegram_id = :telegram_id"
-        student = await database.fetch_one(query=query, values={"telegram_id": telegram_id})
-        
-        if not student:
+        auth = request_auth(request, authorization)
+        telegram_id = _token_subject(auth)
+        principal = auth.principal or await load_principal(telegram_id)
+
+        if not principal:
             raise HTTPException(status_code=401, detail="User not found")
-        
+
         return {
-            "telegram_id": student["telegram_id"],
-            "name": student["name"]
+            "telegram_id": principal["telegram_id"],
+            "name": principal["name"],
+            "is_admin": principal["is_admin"],
         }
     except HTTPException:
         raise
@@ -43,35 +53,22 @@ async def get_current_user(authorization: str = Header(None)):
         logger.exception("Get user error")
         raise HTTPException(status_code=500, detail="Server error") from e
 
-async def require_admin(authorization: str = Header(None)):
-    """Dependency to check if user is admin"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
+async def require_admin(authorization: str = Header(None), request: Request = None):
+    """
+    Dependency to check if user is admin. The admin flag never comes from token claims.
+    It comes from the principal cache only when changes reach every worker's cache (tiered
+    mode), otherwise from students: either way, revoking it takes effect at once.
+    """
     try:
-        from utils.jwt import is_jwt_token, verify_token
-        
-        token = authorization.replace("Bearer ", "")
-        
-        if is_jwt_token(token):
-            payload = verify_token(token, "access")
-            if not payload:
-                raise HTTPException(status_code=401, detail="Invalid token")
-            telegram_id = payload.get("sub")
-        else:
-            telegram_id = token
-            
-        student = await database.fetch_one(
-            "SELECT * FROM students WHERE telegram_id = :tid", 
-            {"tid": telegram_id}
-        )
-        
+        telegram_id = _token_subject(request_auth(request, authorization))
+        student = await load_principal(telegram_id, fresh=not cross_worker_invalidation())
+
         if not student:
             raise HTTPException(status_code=401, detail="User not found")
-            
+
         if not student["is_admin"]:
             raise HTTPException(status_code=403, detail="Admin privileges required")
-            
+
         return student
     except HTTPException:
         raise
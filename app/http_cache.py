@@ -0,0 +1,121 @@
+"""Conditional GET: ETag / Last-Modified from cache tag versions, 304 without touching the data.
+
+@conditional(tags=...) goes between @router.get and the endpoint (above @cached). The ETag
+is computed from data_version(tags) and the request URL alone, so a matching If-None-Match
+is answered before the endpoint runs: no DB query, no serialization. Responses carry
+Cache-Control: no-cache, so browsers (and the service worker's fetch) keep the body and
+revalidate every time.
+
+An endpoint that cannot read its data raises Fallback(body) instead of returning a stand-in:
+the body is sent without validators and with Cache-Control: no-store, and @cached does not
+store it (it only keeps returned values).
+"""
+import hashlib
+import inspect
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from functools import wraps
+from typing import Callable, Optional, Union
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.config import APP_VERSION, CACHE_TTL_SECONDS
+from app.logging_config import logger
+from utils.cache import data_version
+
+
+class Fallback(Exception):
+    """Degraded body (e.g. [] while the DB is down): sent as is, never cached or revalidated."""
+
+    def __init__(self, body=None, status_code: int = 200):
+        super().__init__("fallback response")
+        self.body = body
+        self.status_code = status_code
+
+
+def fallback_response(exc: Fallback) -> Response:
+    """Exception handler body for Fallback (registered in app.main)."""
+    if isinstance(exc.body, Response):
+        response = exc.body
+    else:
+        response = JSONResponse(jsonable_encoder(exc.body), status_code=exc.status_code)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/"x" matches "x"
+    if header.strip() == "*":
+        return True
+    candidates = (c.strip() for c in header.split(","))
+    return any((c[2:] if c.startswith("W/") else c) == etag for c in candidates)
+
+
+def _not_modified_since(header: str, last_modified: float) -> bool:
+    try:
+        return int(last_modified) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def conditional(tags: Union[tuple, Callable] = (), salt: str = ""):
+    """
+    Add ETag/Last-Modified to a GET endpoint and answer If-None-Match/If-Modified-Since with 304.
+
+    tags: cache tags whose invalidation changes the response, or a function of the endpoint's
+    arguments returning them (for per-user tags; None sends no validators). salt: anything else the body
+    depends on that is not tagged (e.g. config). The ETag covers the path and query string
+    and also rolls over every CACHE_TTL_SECONDS, which bounds staleness for changes made
+    without invalidate() (same bound as the response cache); Last-Modified, sent only when
+    an invalidation time is known, never lags that window either.
+    """
+    def decorator(func: Callable):
+        sig = inspect.signature(func)
+        wants_request = "request" in sig.parameters
+
+        @wraps(func)
+        async def wrapper(*args, request: Request, **kwargs):
+            scope = tags(*args, **kwargs) if callable(tags) else tags
+            if wants_request:
+                kwargs["request"] = request
+            if scope is None:
+                return await func(*args, **kwargs)
+            try:
+                version, last_modified = await data_version(scope)
+            except Exception as e:
+                logger.warning("data_version failed for %s: %s", func.__name__, e)
+                return await func(*args, **kwargs)
+            period = max(CACHE_TTL_SECONDS, 1)
+            window = int(time.time() // period)
+            digest = hashlib.blake2b(
+                f"{APP_VERSION}|{salt}|{window}|{version}|{request.url.path}?{request.url.query}".encode(),
+                digest_size=12,
+            ).hexdigest()
+            headers = {"ETag": f'"{digest}"', "Cache-Control": "no-cache"}
+            if last_modified is not None:
+                last_modified = max(last_modified, window * period)
+                headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+            if_none_match: Optional[str] = request.headers.get("if-none-match")
+            if if_none_match is not None:
+                if _etag_matches(if_none_match, headers["ETag"]):
+                    return Response(status_code=304, headers=headers)
+            elif last_modified is not None and _not_modified_since(
+                request.headers.get("if-modified-since"), last_modified
+            ):
+                return Response(status_code=304, headers=headers)
+
+            result = await func(*args, **kwargs)
+            response = result if isinstance(result, Response) else JSONResponse(jsonable_encoder(result))
+            if response.status_code == 200:
+                response.headers.update(headers)
+            return response
+
+        params = [p for p in sig.parameters.values() if p.name != "request"]
+        params.append(inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+        # Keyword-only parameters must come after positional ones in a valid signature
+        params.sort(key=lambda p: p.kind)
+        wrapper.__signature__ = sig.replace(parameters=params)
+        return wrapper
+    return decorator
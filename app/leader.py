@@ -0,0 +1,145 @@
+"""Leader election: one process (across workers and hosts) runs the scheduled jobs.
+
+PostgreSQL: a session advisory lock held on a dedicated connection. The server drops it
+when that connection dies, so another instance takes over on its next attempt.
+SQLite (and anything else): a lease row in leader_leases, renewed every
+LEADER_HEARTBEAT_SECONDS; when the holder stops renewing, the lease expires after
+LEADER_LEASE_SECONDS and the next candidate acquires it.
+
+Every process runs a LeaderElector; on_elected / on_demoted start and stop the work.
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import time
+import uuid
+from collections.abc import Awaitable
+from typing import Callable, Optional
+
+from app.config import DATABASE_URL, LEADER_HEARTBEAT_SECONDS, LEADER_LEASE_SECONDS
+from app.database import database
+from app.logging_config import logger
+
+
+def _advisory_key(name: str) -> int:
+    """Stable signed 64-bit key for pg_advisory_lock."""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class LeaderElector:
+    def __init__(self, name: str, on_elected: Callable[[], Awaitable[None]],
+                 on_demoted: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._task: Optional[asyncio.Task] = None
+        self._postgres = "postgresql" in DATABASE_URL
+
+    # ----- SQLite / generic: lease row -----
+    async def try_acquire(self) -> bool:
+        """Take or renew the lease; True if this process holds it afterwards."""
+        now = time.time()
+        await database.execute(
+            """INSERT INTO leader_leases (name, holder, expires_at) VALUES (:name, '', 0)
+               ON CONFLICT (name) DO NOTHING""",
+            {"name": self.name},
+        )
+        await database.execute(
+            """UPDATE leader_leases SET holder = :holder, expires_at = :expires
+               WHERE name = :name AND (holder = :holder OR expires_at < :now)""",
+            {"name": self.name, "holder": self.holder, "expires": now + LEADER_LEASE_SECONDS, "now": now},
+        )
+        holder = await database.fetch_val(
+            "SELECT holder FROM leader_leases WHERE name = :name", {"name": self.name}
+        )
+        return holder == self.holder
+
+    async def release(self) -> None:
+        """Give the lease up at once, so a successor does not wait for it to expire."""
+        await database.execute(
+            "UPDATE leader_leases SET expires_at = 0 WHERE name = :name AND holder = :holder",
+            {"name": self.name, "holder": self.holder},
+        )
+
+    async def _run_lease(self) -> None:
+        while True:
+            try:
+                leader = await self.try_acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Cannot prove we still hold the lease: stop acting as leader
+                logger.warning("leader %s: lease check failed: %s", self.name, e)
+                leader = False
+            await self._set_leader(leader)
+            await asyncio.sleep(LEADER_HEARTBEAT_SECONDS)
+
+    # ----- PostgreSQL: advisory lock on a dedicated connection -----
+    async def _run_advisory(self) -> None:
+        key = _advisory_key(self.name)
+        while True:
+            try:
+                async with database.connection() as conn:
+                    held = False
+                    try:
+                        while True:
+                            if not held:
+                                held = bool(await conn.fetch_val("SELECT pg_try_advisory_lock(:key)", {"key": key}))
+                                await self._set_leader(held)
+                            else:
+                                # Heartbeat: the lock lives as long as this connection's session
+                                await conn.fetch_val("SELECT 1")
+                            await asyncio.sleep(LEADER_HEARTBEAT_SECONDS)
+                    finally:
+                        # The connection goes back to the pool, not closed: unlock explicitly
+                        if held:
+                            try:
+                                await conn.execute("SELECT pg_advisory_unlock(:key)", {"key": key})
+                            except Exception:
+                                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("leader %s: advisory lock connection lost: %s", self.name, e)
+                await self._set_leader(False)
+                await asyncio.sleep(LEADER_HEARTBEAT_SECONDS)
+
+    async def _set_leader(self, leader: bool) -> None:
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        if leader:
+            logger.info("leader %s: elected (%s)", self.name, self.holder)
+            callback = self._on_elected
+        else:
+            logger.warning("leader %s: lost leadership (%s)", self.name, self.holder)
+            callback = self._on_demoted
+        try:
+            await callback()
+        except Exception:
+            logger.exception("leader %s: %s callback failed", self.name, "elected" if leader else "demoted")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_advisory() if self._postgres else self._run_lease())
+
+    async def stop(self) -> None:
+        """Stop campaigning; if leader, run on_demoted and hand leadership over."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # The advisory lock (PostgreSQL) was unlocked when the task exited
+        was_leader = self.is_leader
+        await self._set_leader(False)
+        if was_leader and not self._postgres:
+            try:
+                await self.release()
+            except Exception as e:
+                logger.warning("leader %s: release failed: %s", self.name, e)
@@ -12,10 +12,12 @@ from starlette.middleware.gzip import GZipMiddleware
 
 from app.config import APP_VERSION, BASE_DIR, CORS_ORIGINS, ENV, IS_PRODUCTION, LOG_JSON, SENTRY_DSN
 from app.database import database, init_db
+from app.http_cache import Fallback, fallback_response
 from app.logging_config import logger, setup_logging
 from app.middleware import (
     ApiRateLimitMiddleware,
     HTTPSRedirectMiddleware,
+    PrincipalMiddleware,
     RequestIDMiddleware,
     RequestLoggingMiddleware,
     SecurityHeadersMiddleware,
@@ -51,13 +53,33 @@ async def lifespan(app: FastAPI):
     await database.connect()
     try:
         await init_db()
+        from utils.cache import start_invalidation_listener
+        start_invalidation_listener()
+        from app.push_delivery import load_vapid_key
+        load_vapid_key()
+        from app.push_outbox import start_worker as start_push_worker
+        start_push_worker()
         from app.scheduler import start_scheduler
-        start_scheduler()
+        await start_scheduler()
+        from utils.auth import password_hasher
+        rounds = await password_hasher.calibrate()
+        logger.info("bcrypt cost: %s rounds%s", rounds, " (BCRYPT_ROUNDS)" if password_hasher.pinned else "")
     except Exception as e:
         logger.critical("Startup failed: %s", e, exc_info=True)
     yield
     from app.scheduler import shutdown_scheduler
     await shutdown_scheduler()
+    # Edits still inside the debounce window: queue their push before the process exits
+    from app.routers.push import flush_schedule_changes
+    await flush_schedule_changes()
+    from app.push_outbox import stop_worker as stop_push_worker
+    await stop_push_worker()
+    from app.push_delivery import aclose as close_push_client
+    await close_push_client()
+    from utils.auth import password_hasher
+    password_hasher.shutdown()
+    from utils.cache import stop_invalidation_listener
+    await stop_invalidation_listener()
     await database.disconnect()
 
 
@@ -101,6 +123,11 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 
+@app.exception_handler(Fallback)
+async def fallback_exception_handler(request: Request, exc: Fallback):
+    return fallback_response(exc)
+
+
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
     logger.exception("Unhandled exception")
@@ -118,6 +145,8 @@ async def generic_exception_handler(request: Request, exc: Exception):
 app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
 app.add_middleware(ApiRateLimitMiddleware)
+# Before the rate limiter: it keys signed-in callers by user
+app.add_middleware(PrincipalMiddleware)
 app.add_middleware(GZipMiddleware, minimum_size=256)
 app.add_middleware(HTTPSRedirectMiddleware)
 app.add_middleware(RequestIDMiddleware)
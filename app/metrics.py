@@ -1,9 +1,19 @@
 """Simple in-memory counters for Prometheus /metrics endpoint."""
 from threading import Lock
+from typing import Optional
 
 _lock = Lock()
 _request_total = 0
 _request_errors_total = 0
+# Scheduler, per job: runs, misfires, summed/max lag behind the planned time, summed run time
+_scheduler_jobs: dict = {}
+_scheduler_plan_entries = 0
+# Web Push: round-trip histogram per push-service origin, results per (origin, class), encryption time
+PUSH_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_push_latency: dict = {}
+_push_results: dict = {}
+_push_encrypt = {"seconds": 0.0, "count": 0}
+_push_jobs: dict = {}
 
 
 def inc_request_total():
@@ -18,6 +28,138 @@ def inc_request_errors_total():
         _request_errors_total += 1
 
 
+def _job(name: str) -> dict:
+    job = _scheduler_jobs.get(name)
+    if job is None:
+        job = _scheduler_jobs[name] = {"runs": 0, "misfires": 0, "lag_sum": 0.0, "lag_max": 0.0, "duration_sum": 0.0}
+    return job
+
+
+def observe_scheduler_run(name: str, lag_seconds: float, duration_seconds: float):
+    """A planned job ran lag_seconds after its planned time and took duration_seconds."""
+    with _lock:
+        job = _job(name)
+        job["runs"] += 1
+        job["lag_sum"] += lag_seconds
+        job["lag_max"] = max(job["lag_max"], lag_seconds)
+        job["duration_sum"] += duration_seconds
+
+
+def inc_scheduler_misfire(name: str):
+    """A planned job was skipped: its time passed by more than the grace period."""
+    with _lock:
+        _job(name)["misfires"] += 1
+
+
+def set_scheduler_plan_entries(count: int):
+    with _lock:
+        global _scheduler_plan_entries
+        _scheduler_plan_entries = count
+
+
+def get_scheduler_stats() -> dict:
+    with _lock:
+        return {
+            "plan_entries": _scheduler_plan_entries,
+            "jobs": {name: dict(job) for name, job in _scheduler_jobs.items()},
+        }
+
+
+def observe_push_send(origin: str, latency_seconds: Optional[float], error_class: str):
+    """One push request: its HTTP round trip (None if no request was made) and outcome class."""
+    with _lock:
+        key = (origin, error_class)
+        _push_results[key] = _push_results.get(key, 0) + 1
+        if latency_seconds is None:
+            return
+        hist = _push_latency.get(origin)
+        if hist is None:
+            hist = _push_latency[origin] = {"buckets": [0] * len(PUSH_LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(PUSH_LATENCY_BUCKETS):
+            if latency_seconds <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += latency_seconds
+        hist["count"] += 1
+
+
+def observe_push_encrypt(seconds: float, count: int):
+    """count payloads encrypted in `seconds` (CPU spent per broadcast, in process or in the pool)."""
+    with _lock:
+        _push_encrypt["seconds"] += seconds
+        _push_encrypt["count"] += count
+
+
+def inc_push_job(kind: str, queued: int):
+    with _lock:
+        job = _push_jobs.setdefault(kind, {"jobs": 0, "queued": 0})
+        job["jobs"] += 1
+        job["queued"] += queued
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _push_export() -> str:
+    lines = [
+        "# HELP push_send_duration_seconds Push service HTTP round trip.",
+        "# TYPE push_send_duration_seconds histogram",
+    ]
+    for origin, hist in sorted(_push_latency.items()):
+        labels = f'origin="{_label(origin)}"'
+        for bound, n in zip(PUSH_LATENCY_BUCKETS, hist["buckets"]):
+            lines.append(f'push_send_duration_seconds_bucket{{{labels},le="{bound}"}} {n}')
+        lines.append(f'push_send_duration_seconds_bucket{{{labels},le="+Inf"}} {hist["count"]}')
+        lines.append(f"push_send_duration_seconds_sum{{{labels}}} {hist['sum']}")
+        lines.append(f"push_send_duration_seconds_count{{{labels}}} {hist['count']}")
+    lines += [
+        "# HELP push_results_total Push sends by push service and outcome class.",
+        "# TYPE push_results_total counter",
+    ]
+    for (origin, error_class), n in sorted(_push_results.items()):
+        lines.append(f'push_results_total{{origin="{_label(origin)}",class="{error_class}"}} {n}')
+    lines += [
+        "# HELP push_encrypt_seconds_total CPU time spent encrypting payloads.",
+        "# TYPE push_encrypt_seconds_total counter",
+        f"push_encrypt_seconds_total {_push_encrypt['seconds']}",
+        "# HELP push_encrypted_total Payloads encrypted.",
+        "# TYPE push_encrypted_total counter",
+        f"push_encrypted_total {_push_encrypt['count']}",
+        "# HELP push_jobs_total Broadcasts queued, by kind.",
+        "# TYPE push_jobs_total counter",
+    ]
+    for kind, job in sorted(_push_jobs.items()):
+        lines.append(f'push_jobs_total{{kind="{kind}"}} {job["jobs"]}')
+    lines += [
+        "# HELP push_queued_total Pushes queued (one per device), by broadcast kind.",
+        "# TYPE push_queued_total counter",
+    ]
+    for kind, job in sorted(_push_jobs.items()):
+        lines.append(f'push_queued_total{{kind="{kind}"}} {job["queued"]}')
+    return "\n".join(lines) + "\n"
+
+
+def _scheduler_export() -> str:
+    lines = [
+        "# HELP scheduler_plan_entries Reminders left in today's plan.",
+        "# TYPE scheduler_plan_entries gauge",
+        f"scheduler_plan_entries {_scheduler_plan_entries}",
+    ]
+    families = (
+        ("scheduler_runs_total", "counter", "Planned jobs run.", "runs"),
+        ("scheduler_misfires_total", "counter", "Planned jobs skipped as too late.", "misfires"),
+        ("scheduler_lag_seconds_sum", "counter", "Total delay behind the planned time.", "lag_sum"),
+        ("scheduler_lag_seconds_max", "gauge", "Largest delay behind the planned time.", "lag_max"),
+        ("scheduler_run_duration_seconds_sum", "counter", "Total job run time.", "duration_sum"),
+    )
+    for metric, kind, help_text, key in families:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, job in sorted(_scheduler_jobs.items()):
+            lines.append(f'{metric}{{job="{name}"}} {job[key]}')
+    return "\n".join(lines) + "\n"
+
+
 def get_prometheus_export() -> str:
     with _lock:
         return (
@@ -27,4 +169,4 @@ def get_prometheus_export() -> str:
             "# HELP http_request_errors_total Total HTTP 5xx errors.\n"
             "# TYPE http_request_errors_total counter\n"
             f"http_request_errors_total {_request_errors_total}\n"
-        )
+        ) + _scheduler_export() + _push_export()
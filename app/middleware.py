@@ -2,6 +2,7 @@
 import time
 import uuid
 
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import RedirectResponse, Response
@@ -70,6 +71,22 @@ class RequestIDMiddleware(BaseHTTPMiddleware):
         return response
 
 
+class PrincipalMiddleware:
+    """Decode the bearer token once per request into request.state.auth (see app.principal).
+
+    Plain ASGI: it only reads a header, so it does not need BaseHTTPMiddleware's response wrapping.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            from app.principal import resolve_auth
+            scope.setdefault("state", {})["auth"] = resolve_auth(Headers(scope=scope).get("authorization"))
+        await self.app(scope, receive, send)
+
+
 class ApiRateLimitMiddleware(BaseHTTPMiddleware):
     """Apply global rate limit to all /api/* requests. Returns 429 if exceeded."""
 
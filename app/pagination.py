@@ -0,0 +1,103 @@
+"""LIMIT/OFFSET and keyset (cursor) pagination pushed down to SQL for list endpoints.
+
+A page is {items, next_cursor[, total]}. next_cursor is an opaque token holding the
+sort key (e.g. created_at, id) of the last returned row; passing it back continues
+strictly after that row, so deep pages cost the same as the first one. total is a
+separate COUNT(*) and runs only when the client asks for it (with_total=true).
+"""
+import base64
+import json
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+
+from app.database import database
+
+MAX_LIMIT = 200
+# Calls without pagination params keep returning a plain array, capped at this many rows
+# (a cap those lists did not have before; documented in the README)
+UNPAGED_LIMIT = 500
+
+
+def is_paged(limit: Optional[int], cursor: Optional[str], with_total: bool) -> bool:
+    """True if the client asked for the {items, next_cursor} shape."""
+    return limit is not None or cursor is not None or with_total
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    data = [{"dt": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if not isinstance(data, list) or len(data) != size:
+            raise ValueError("cursor size")
+        # PostgreSQL returns datetimes, SQLite returns the stored text; compare like with like
+        return [datetime.fromisoformat(v["dt"]) if isinstance(v, dict) else v for v in data]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from None
+
+
+async def fetch_page(
+    columns: str,
+    table: str,
+    *,
+    where: Sequence[str] = (),
+    values: Optional[dict] = None,
+    order: Sequence[str] = ("created_at", "id"),
+    descending: bool = True,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+    row_to_item: Callable[[Any], Any] = dict,
+) -> dict:
+    """
+    SELECT columns FROM table WHERE where... ORDER BY order, one page of it.
+
+    order must be unique (end it with the primary key) and be returned by columns.
+    With a cursor the offset is ignored: the page starts right after the cursor row.
+    """
+    limit = limit or MAX_LIMIT
+    values = dict(values or {})
+    conditions = list(where)
+    total = None
+    if with_total:
+        count_sql = f"SELECT COUNT(*) FROM {table}"
+        if conditions:
+            count_sql += " WHERE " + " AND ".join(conditions)
+        total = await database.fetch_val(count_sql, values)
+
+    if cursor is not None:
+        key = decode_cursor(cursor, len(order))
+        names = [f"_cursor{i}" for i in range(len(order))]
+        values.update(zip(names, key))
+        op = "<" if descending else ">"
+        # Row-value comparison: one index range scan on (created_at, id) in SQLite and PostgreSQL
+        conditions.append(f"({', '.join(order)}) {op} ({', '.join(':' + n for n in names)})")
+        offset = 0
+
+    direction = "DESC" if descending else "ASC"
+    sql = f"SELECT {columns} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(f"{col} {direction}" for col in order)
+    # One extra row tells whether there is a next page without a COUNT
+    sql += " LIMIT :_limit OFFSET :_offset"
+    values.update(_limit=limit + 1, _offset=offset)
+    rows = await database.fetch_all(sql, values)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][col] for col in order])
+    page = {"items": [row_to_item(r) for r in rows], "next_cursor": next_cursor}
+    if total is not None:
+        page["total"] = total
+    return page
@@ -0,0 +1,145 @@
+"""Request principal: who is calling, resolved without a students query on the hot path.
+
+Access tokens carry name and is_admin claims (access_claims). The principal cache
+(telegram_id -> principal dict, bounded LRU with a TTL) holds what the students row said
+when it was last read; every write to a student's name, avatar, admin flag or password
+calls invalidate_principal(), which drops the entry here and, in tiered cache mode,
+through the "principals" cache tag in the other workers. Claims of tokens issued before
+such a change are not trusted: that principal is read from students again.
+Other cache modes cannot reach the other workers, so there entries live at most
+PRINCIPAL_CACHE_LOCAL_TTL_SECONDS and require_admin reads the admin flag from students.
+
+PrincipalMiddleware decodes the bearer token once per request (resolve_auth) and keeps
+the result on request.state.auth, where the auth dependencies and the API rate limiter
+read it instead of parsing the Authorization header again.
+"""
+import time
+from typing import Optional
+
+from cachetools import TTLCache
+
+from app.config import (
+    JWT_ACCESS_EXPIRE_MINUTES,
+    PRINCIPAL_CACHE_LOCAL_TTL_SECONDS,
+    PRINCIPAL_CACHE_SIZE,
+    PRINCIPAL_CACHE_TTL_SECONDS,
+)
+from app.database import database
+from utils.cache import add_invalidation_listener, cross_worker_invalidation, invalidate
+
+# Created on first use: its TTL depends on the cache mode
+_principals: Optional[TTLCache] = None
+# telegram_id -> when it last changed here; kept as long as an access token can live
+_changed_at: TTLCache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=JWT_ACCESS_EXPIRE_MINUTES * 60)
+# Some student changed in another worker (id unknown): claims issued before this are not trusted
+_claims_not_before = 0.0
+
+
+def access_claims(student) -> dict:
+    """Claims for create_access_token from a students row (telegram_id, name, is_admin)."""
+    return {"sub": student["telegram_id"], "name": student["name"], "is_admin": bool(student["is_admin"])}
+
+
+def principal_from_claims(payload: dict) -> Optional[dict]:
+    """Principal carried by an access token; None for tokens issued before the claims existed
+    or before the student last changed."""
+    if "name" not in payload or "is_admin" not in payload:
+        return None
+    issued_at = payload.get("iat") or 0
+    if issued_at < max(_claims_not_before, _changed_at.get(payload.get("sub"), 0.0)):
+        return None
+    return {"telegram_id": payload.get("sub"), "name": payload["name"], "is_admin": bool(payload["is_admin"])}
+
+
+def _cache() -> TTLCache:
+    global _principals
+    if _principals is None:
+        ttl = PRINCIPAL_CACHE_TTL_SECONDS
+        if not cross_worker_invalidation():
+            ttl = min(ttl, PRINCIPAL_CACHE_LOCAL_TTL_SECONDS)
+        _principals = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=ttl)
+    return _principals
+
+
+class RequestAuth:
+    """Bearer token of one request, decoded once."""
+
+    __slots__ = ("user_id", "payload", "principal")
+
+    def __init__(self, user_id: Optional[str], payload: Optional[dict] = None):
+        self.user_id = user_id  # None if the token is invalid or expired
+        self.payload = payload  # access token payload
+        principal = cached_principal(user_id) if user_id else None
+        if principal is None and payload is not None:
+            principal = principal_from_claims(payload)
+        self.principal = principal  # None: load_principal() has to read students
+
+    @property
+    def verified(self) -> bool:
+        """A valid signed access token."""
+        return self.payload is not None
+
+
+def resolve_auth(authorization: Optional[str]) -> Optional[RequestAuth]:
+    """Decode an Authorization header (None if there is none). Anything but a valid access
+    token, including the old plain telegram_id format (which anyone could forge), is invalid."""
+    from utils.jwt import is_jwt_token, verify_token
+
+    token = (authorization or "").replace("Bearer ", "")
+    if not token:
+        return None
+    if not is_jwt_token(token):
+        return RequestAuth(None)
+    payload = verify_token(token, "access")
+    if not payload or not payload.get("sub"):
+        return RequestAuth(None)
+    return RequestAuth(payload["sub"], payload)
+
+
+def cached_principal(telegram_id: str) -> Optional[dict]:
+    return _cache().get(telegram_id)
+
+
+async def load_principal(telegram_id: str, fresh: bool = False) -> Optional[dict]:
+    """Principal from the cache, or read from students (always with fresh=True; None if the
+    student does not exist)."""
+    if not fresh:
+        principal = _cache().get(telegram_id)
+        if principal is not None:
+            return principal
+    row = await database.fetch_one(
+        "SELECT telegram_id, name, avatar, is_admin FROM students WHERE telegram_id = :tid", {"tid": telegram_id}
+    )
+    if row is None:
+        return None
+    principal = {
+        "telegram_id": row["telegram_id"],
+        "name": row["name"],
+        "avatar": row["avatar"],
+        "is_admin": bool(row["is_admin"]),
+    }
+    _cache()[telegram_id] = principal
+    return principal
+
+
+async def invalidate_principal(telegram_id: Optional[str] = None) -> None:
+    """Call after changing a student's name, avatar, admin flag or password (None: every student)."""
+    global _claims_not_before
+    if telegram_id is None:
+        _cache().clear()
+        _claims_not_before = time.time()
+    else:
+        _cache().pop(telegram_id, None)
+        _changed_at[telegram_id] = time.time()
+    await invalidate("principals")
+
+
+def _on_remote_invalidate(tags: tuple) -> None:
+    # Another worker changed some student: its id is not in the message, so drop them all
+    global _claims_not_before
+    if "principals" in tags or "*" in tags:
+        _cache().clear()
+        _claims_not_before = time.time()
+
+
+add_invalidation_listener(_on_remote_invalidate)
@@ -0,0 +1,72 @@
+"""Push audiences: who receives a message, resolved to subscription ids in one query.
+
+An audience is (kind, value): "all", "exam_reminder" (value: exam id), "favorite_subject"
+(value: subject name) or "admins". Each kind is a single JOIN against push_subscriptions,
+never a query per student or per reminder, and the result goes straight to the outbox.
+"""
+from typing import Optional
+
+from app.database import database
+from app.push_registry import get_registry
+
+AUDIENCES = ("all", "exam_reminder", "favorite_subject", "admins")
+
+_QUERIES = {
+    "exam_reminder": """
+        SELECT DISTINCT p.id FROM push_subscriptions p
+        JOIN exam_reminders r ON r.student_id = p.student_id
+        WHERE r.exam_id = :value
+    """,
+    "favorite_subject": """
+        SELECT DISTINCT p.id FROM push_subscriptions p
+        JOIN user_favorites f ON f.student_id = p.student_id
+        WHERE f.subject_name = :value
+    """,
+    "admins": """
+        SELECT p.id FROM push_subscriptions p
+        JOIN students s ON s.telegram_id = p.student_id
+        WHERE s.is_admin = :value
+    """,
+}
+
+
+def parse_audience(kind: Optional[str], value=None) -> tuple:
+    """Validated (kind, value) from request input; ValueError with a user-facing message."""
+    kind = kind or "all"
+    if kind not in AUDIENCES:
+        raise ValueError(f"Неизвестная аудитория: {kind}")
+    if kind == "exam_reminder":
+        try:
+            return kind, int(value)
+        except (TypeError, ValueError):
+            raise ValueError("Для exam_reminder нужен id экзамена") from None
+    if kind == "favorite_subject":
+        if not value or not str(value).strip():
+            raise ValueError("Для favorite_subject нужно название предмета")
+        return kind, str(value).strip()
+    return kind, None
+
+
+async def resolve_audience(kind: str, value=None) -> list:
+    """Subscription ids of every device in the audience."""
+    if kind == "all":
+        return (await get_registry()).ids()
+    if kind == "admins":
+        value = True
+    rows = await database.fetch_all(_QUERIES[kind], {"value": value})
+    return [r["id"] for r in rows]
+
+
+async def exam_reminder_audiences(exam_date) -> dict:
+    """{exam_id: [subscription ids]} for all exams on exam_date, in one query."""
+    rows = await database.fetch_all(
+        """SELECT DISTINCT e.id AS exam_id, p.id FROM exams e
+           JOIN exam_reminders r ON r.exam_id = e.id
+           JOIN push_subscriptions p ON p.student_id = r.student_id
+           WHERE e.exam_date = :d""",
+        {"d": exam_date},
+    )
+    out: dict = {}
+    for r in rows:
+        out.setdefault(r["exam_id"], []).append(r["id"])
+    return out
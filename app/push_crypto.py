@@ -0,0 +1,24 @@
+"""Web Push payload encryption (ECDH + AES-128-GCM, RFC 8291), usable in worker processes.
+
+Kept free of app imports: ProcessPoolExecutor workers are spawned and import only this.
+"""
+from typing import Optional
+
+CONTENT_ENCODING = "aes128gcm"
+
+
+def encrypt(subscription: dict, data: bytes) -> bytes:
+    """Encrypt data for one subscription (fresh ephemeral key per call)."""
+    from pywebpush import WebPusher
+    return WebPusher(subscription).encode(data, CONTENT_ENCODING)["body"]
+
+
+def encrypt_chunk(subscriptions: list, data: bytes) -> list:
+    """[(body or None, error or None)] for each subscription, in order. Never raises per item."""
+    out: list[tuple[Optional[bytes], Optional[str]]] = []
+    for subscription in subscriptions:
+        try:
+            out.append((encrypt(subscription, data), None))
+        except Exception as e:
+            out.append((None, f"bad subscription: {e}"))
+    return out
@@ -0,0 +1,359 @@
+"""Async Web Push delivery engine.
+
+Sends go through one pooled httpx.AsyncClient (HTTP/2 when the h2 package is installed),
+so a broadcast never blocks the event loop on a push-service round trip. Concurrency is
+capped per push-service origin (FCM, Mozilla autopush, Apple...), every request has a
+timeout, and a broadcast serializes its payload once for all subscribers. Large
+broadcasts encrypt in a process pool (see deliver) while the sends stay async here.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from app.config import (
+    PUSH_CONCURRENCY_PER_ORIGIN,
+    PUSH_ENCRYPT_CHUNK,
+    PUSH_ENCRYPT_POOL_MIN,
+    PUSH_ENCRYPT_WORKERS,
+    PUSH_MAX_CONNECTIONS,
+    PUSH_TIMEOUT_SECONDS,
+    VAPID_CLAIM_EMAIL,
+    VAPID_PRIVATE_KEY,
+)
+from app.logging_config import logger
+from app.metrics import observe_push_encrypt, observe_push_send
+from app.push_crypto import CONTENT_ENCODING, encrypt, encrypt_chunk
+from app.push_registry import origin_of, remove
+
+ICON = "/static/icons/icon-192x192.png"
+
+_client = None
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+class PushResult:
+    """Outcome of one send. status_code is None when no HTTP response was received."""
+
+    __slots__ = ("subscription_id", "status_code", "retry_after", "error", "transient", "timeout",
+                 "origin", "latency", "encrypt_seconds")
+
+    def __init__(self, subscription_id=None, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None, error: Optional[str] = None,
+                 transient: bool = False, timeout: bool = False):
+        self.subscription_id = subscription_id
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.error = error
+        # Network error / timeout: the push service never answered
+        self.transient = transient
+        self.timeout = timeout
+        # Push-service origin, HTTP round trip and this payload's encryption time (seconds)
+        self.origin: Optional[str] = None
+        self.latency: Optional[float] = None
+        self.encrypt_seconds = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code is not None and 200 <= self.status_code < 300
+
+    @property
+    def gone(self) -> bool:
+        """Endpoint expired or unsubscribed: the subscription should be deleted."""
+        return self.status_code in (404, 410)
+
+    @property
+    def retryable(self) -> bool:
+        """Throttled (429), push-service error (5xx) or no response: worth sending again later."""
+        if self.status_code is None:
+            return self.transient
+        return self.status_code == 429 or self.status_code >= 500
+
+    @property
+    def error_class(self) -> str:
+        """ok | gone | throttled | server_error | rejected | timeout | network | bad_subscription."""
+        if self.status_code is None:
+            if self.timeout:
+                return "timeout"
+            return "network" if self.transient else "bad_subscription"
+        if self.ok:
+            return "ok"
+        if self.gone:
+            return "gone"
+        if self.status_code == 429:
+            return "throttled"
+        return "server_error" if self.status_code >= 500 else "rejected"
+
+
+def build_payload(title: str, body: str, url: str = "/") -> bytes:
+    """The JSON the service worker's push handler expects; build once per broadcast."""
+    return json.dumps({"title": title, "body": body, "url": url, "icon": ICON}).encode("utf-8")
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(PUSH_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=PUSH_MAX_CONNECTIONS, max_keepalive_connections=PUSH_MAX_CONNECTIONS),
+        )
+    return _client
+
+
+async def aclose() -> None:
+    """Close pooled connections and the encryption pool (app shutdown)."""
+    global _client
+    _shutdown_pool()
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+def _semaphore(origin: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(origin)
+    if sem is None:
+        sem = _semaphores[origin] = asyncio.Semaphore(PUSH_CONCURRENCY_PER_ORIGIN)
+    return sem
+
+
+# VAPID JWTs: valid for 12 h, re-signed 10 min before they expire
+VAPID_EXPIRY_SECONDS = 12 * 3600
+VAPID_REFRESH_MARGIN_SECONDS = 600
+_vapid = None
+# Set once VAPID_PRIVATE_KEY was parsed, successfully or not: a bad key is not retried per send
+_vapid_loaded = False
+# audience origin -> (headers, exp): every subscription on one push service shares a signature
+_vapid_headers_cache: dict[str, tuple[dict, int]] = {}
+
+
+def _load_vapid(private_key: str):
+    """VAPID key from a PEM (as printed by scripts/generate_vapid_keys.py), a key file, or raw/DER base64."""
+    from py_vapid import Vapid
+    if "-----BEGIN" in private_key:
+        return Vapid.from_pem(private_key.replace("\\n", "\n").encode("utf-8"))
+    if os.path.isfile(private_key):
+        return Vapid.from_file(private_key_file=private_key)
+    return Vapid.from_string(private_key=private_key)
+
+
+def load_vapid_key() -> None:
+    """Parse VAPID_PRIVATE_KEY once (app startup). An invalid key is logged, not fatal."""
+    global _vapid, _vapid_loaded
+    _vapid_loaded = True
+    _vapid_headers_cache.clear()
+    if not VAPID_PRIVATE_KEY:
+        _vapid = None
+        return
+    try:
+        _vapid = _load_vapid(VAPID_PRIVATE_KEY)
+    except Exception as e:
+        _vapid = None
+        logger.error("VAPID_PRIVATE_KEY could not be parsed, push disabled: %s", e)
+
+
+def _vapid_headers(origin: str) -> dict:
+    """Authorization header for an audience; signed once per origin until shortly before exp."""
+    now = time.time()
+    cached = _vapid_headers_cache.get(origin)
+    if cached is not None and cached[1] - VAPID_REFRESH_MARGIN_SECONDS > now:
+        return cached[0]
+    if _vapid is None:
+        if not _vapid_loaded:
+            load_vapid_key()
+        if _vapid is None:
+            raise RuntimeError("VAPID key not configured")
+    exp = int(now) + VAPID_EXPIRY_SECONDS
+    headers = dict(_vapid.sign({"sub": VAPID_CLAIM_EMAIL, "aud": origin, "exp": exp}))
+    _vapid_headers_cache[origin] = (headers, exp)
+    return headers
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as seconds from now (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def _post(subscription: dict, body: bytes, *, ttl: int, headers: Optional[dict],
+                subscription_id) -> PushResult:
+    """POST an already encrypted body to the subscription's push service."""
+    try:
+        endpoint = subscription["endpoint"]
+        origin = origin_of(endpoint)
+        request_headers = {
+            **_vapid_headers(origin),
+            "Content-Encoding": CONTENT_ENCODING,
+            "TTL": str(ttl),
+            **(headers or {}),
+        }
+    except Exception as e:
+        result = PushResult(subscription_id, error=f"bad subscription: {e}")
+        observe_push_send("unknown", None, result.error_class)
+        return result
+    async with _semaphore(origin):
+        # Timed inside the semaphore: waiting for our own concurrency cap is not the push service
+        started = time.perf_counter()
+        try:
+            response = await _get_client().post(endpoint, content=body, headers=request_headers)
+        except Exception as e:
+            result = PushResult(subscription_id, error=f"{type(e).__name__}: {e}", transient=True,
+                                timeout=isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)))
+        else:
+            result = PushResult(
+                subscription_id,
+                status_code=response.status_code,
+                retry_after=_retry_after(response.headers.get("Retry-After")),
+                error=None if response.is_success else response.text[:200],
+            )
+        result.latency = time.perf_counter() - started
+    result.origin = origin
+    observe_push_send(origin, result.latency, result.error_class)
+    return result
+
+
+async def send(subscription: dict, data: bytes, *, ttl: int = 0, headers: Optional[dict] = None,
+               subscription_id=None) -> PushResult:
+    """Encrypt data for one subscription (in process) and POST it to its push service."""
+    started = time.perf_counter()
+    try:
+        body = encrypt(subscription, data)
+    except Exception as e:
+        return _bad(subscription_id, f"bad subscription: {e}")
+    spent = time.perf_counter() - started
+    observe_push_encrypt(spent, 1)
+    result = await _post(subscription, body, ttl=ttl, headers=headers, subscription_id=subscription_id)
+    result.encrypt_seconds = spent
+    return result
+
+
+# ----- Process pool for encryption of large broadcasts -----
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn: forking a process that runs an event loop and threads is not safe
+        _pool = ProcessPoolExecutor(
+            max_workers=PUSH_ENCRYPT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def _shutdown_pool(cancel_futures: bool = True) -> None:
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=cancel_futures)
+
+
+async def _encrypt_in_pool(targets: list, data: bytes, sends: list, ttl: int, headers: Optional[dict]) -> None:
+    """Encrypt chunks of targets in worker processes; start each chunk's sends as soon as it is ready."""
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    chunks = [targets[i : i + PUSH_ENCRYPT_CHUNK] for i in range(0, len(targets), PUSH_ENCRYPT_CHUNK)]
+    futures = {
+        loop.run_in_executor(pool, encrypt_chunk, [sub for _, sub in chunk], data): chunk for chunk in chunks
+    }
+    last_done = time.perf_counter()
+    pending = set(futures)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for fut in done:
+            chunk = futures[fut]
+            try:
+                encrypted = fut.result()
+            except (Exception, asyncio.CancelledError) as e:
+                # Broken pool (worker killed, ...) or a chunk cancelled by a shutdown: this chunk
+                # is encrypted here instead. The other chunks keep running in the old pool (a
+                # broken one fails them too, and each falls back the same way)
+                logger.warning("push: encryption pool failed (%r); encrypting %d in process", e, len(chunk))
+                _shutdown_pool(cancel_futures=False)
+                encrypted = encrypt_chunk([sub for _, sub in chunk], data)
+            # Wall time since the previous chunk came back: summed, the time the broadcast waited on
+            # encryption (our CPU), pool queueing included
+            now = time.perf_counter()
+            spent, last_done = now - last_done, now
+            observe_push_encrypt(spent, len(chunk))
+            per_target = spent / len(chunk)
+            for (sid, sub), (body, error) in zip(chunk, encrypted):
+                if body is None:
+                    sends.append(asyncio.ensure_future(_failed(sid, error)))
+                else:
+                    sends.append(asyncio.ensure_future(
+                        _timed_post(sub, body, per_target, ttl=ttl, headers=headers, subscription_id=sid)
+                    ))
+
+
+def _bad(subscription_id, error: Optional[str]) -> PushResult:
+    result = PushResult(subscription_id, error=error)
+    observe_push_send("unknown", None, result.error_class)
+    return result
+
+
+async def _failed(subscription_id, error: Optional[str]) -> PushResult:
+    return _bad(subscription_id, error)
+
+
+async def _timed_post(subscription: dict, body: bytes, encrypt_seconds: float, **kwargs) -> PushResult:
+    result = await _post(subscription, body, **kwargs)
+    result.encrypt_seconds = encrypt_seconds
+    return result
+
+
+async def deliver(targets: list, data: bytes, *, ttl: int = 0, headers: Optional[dict] = None) -> list:
+    """
+    Send data to targets [(id, subscription_info)] concurrently; one PushResult per target,
+    in order, with subscription_id set to the target's id. Audiences of PUSH_ENCRYPT_POOL_MIN
+    or more are encrypted in a process pool (PUSH_ENCRYPT_WORKERS > 0), so the CPU work
+    stays off the event loop.
+    """
+    if not targets:
+        return []
+    if PUSH_ENCRYPT_WORKERS > 0 and len(targets) >= PUSH_ENCRYPT_POOL_MIN:
+        sends: list = []
+        try:
+            await _encrypt_in_pool(targets, data, sends, ttl, headers)
+        except Exception:
+            for task in sends:
+                task.cancel()
+            raise
+        return list(await asyncio.gather(*sends))
+    return list(await asyncio.gather(*(
+        send(sub, data, ttl=ttl, headers=headers, subscription_id=sid) for sid, sub in targets
+    )))
+
+
+async def broadcast(targets: list, data: bytes, *, ttl: int = 0, headers: Optional[dict] = None) -> dict:
+    """
+    Send data to targets [(subscription_id, subscription_info)] once, without retries.
+    Gone endpoints are deleted afterwards in one batch. Returns {"sent", "failed", "removed"}.
+    """
+    if not VAPID_PRIVATE_KEY or not targets:
+        return {"sent": 0, "failed": 0, "removed": 0}
+    results = await deliver(targets, data, ttl=ttl, headers=headers)
+    gone = [r.subscription_id for r in results if r.gone]
+    if gone:
+        try:
+            await remove(gone)
+        except Exception:
+            logger.exception("push: deleting gone subscriptions failed")
+    sent = sum(1 for r in results if r.ok)
+    return {"sent": sent, "failed": len(results) - sent - len(gone), "removed": len(gone)}
+
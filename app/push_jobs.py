@@ -0,0 +1,102 @@
+"""Push jobs: every broadcast gets an id, and its outbox rows carry it.
+
+queue() records the job and queues its rows. As the outbox worker sends them it stores each
+row's push-service origin, HTTP round trip and error class, and adds the encryption time to
+the job, so report() can tell a slow broadcast apart: our CPU (encrypt_seconds), the network
+(latency per push service, timeouts) or push-service throttling (throttled / Retry-After).
+"""
+import time
+import uuid
+from typing import Optional
+
+from app.config import VAPID_PRIVATE_KEY
+from app.database import database
+from app.logging_config import logger
+from app.metrics import inc_push_job
+from app.push_outbox import enqueue, wake
+
+
+async def queue(kind: str, subscription_ids, data: bytes, *, audience: Optional[str] = None, **options) -> tuple:
+    """
+    Queue data for the subscriptions as one job; returns (job_id, queued), job_id None if
+    nothing was queued. options (ttl, headers, topic) go to push_outbox.enqueue.
+    """
+    ids = list(dict.fromkeys(i for i in subscription_ids if i is not None))
+    if not VAPID_PRIVATE_KEY or not ids:
+        return None, 0
+    job_id = uuid.uuid4().hex
+    # One transaction: a failed enqueue must not leave a job that reports "done" with no rows
+    async with database.transaction():
+        await database.execute(
+            "INSERT INTO push_jobs (id, kind, audience, total, created_at) VALUES (:id, :kind, :audience, :total, :now)",
+            {"id": job_id, "kind": kind, "audience": audience, "total": len(ids), "now": time.time()},
+        )
+        queued = await enqueue(ids, data, job_id=job_id, **options)
+    # enqueue's wake-up ran before the commit, when the worker could not see the rows yet
+    wake()
+    inc_push_job(kind, queued)
+    logger.info("push_job_queued", extra={"job_id": job_id, "kind": kind, "audience": audience, "queued": queued})
+    return job_id, queued
+
+
+def _percentile(values: list, q: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+async def report(job_id: str) -> Optional[dict]:
+    """Progress and timings of one job, None if unknown (or purged after the retention period)."""
+    job = await database.fetch_one("SELECT * FROM push_jobs WHERE id = :id", {"id": job_id})
+    if job is None:
+        return None
+    # Counts are aggregated in SQL; only latencies (for the percentiles) come back per row
+    by_status = await database.fetch_all(
+        """SELECT status, COUNT(*) AS n, SUM(attempts) AS attempts, MAX(finished_at) AS last_finished
+           FROM push_outbox WHERE job_id = :id GROUP BY status""",
+        {"id": job_id},
+    )
+    by_origin = await database.fetch_all(
+        """SELECT origin, error_class, COUNT(*) AS n, SUM(attempts) AS attempts
+           FROM push_outbox WHERE job_id = :id AND origin IS NOT NULL GROUP BY origin, error_class""",
+        {"id": job_id},
+    )
+    latency_rows = await database.fetch_all(
+        """SELECT origin, latency FROM push_outbox
+           WHERE job_id = :id AND origin IS NOT NULL AND latency IS NOT NULL ORDER BY origin, latency""",
+        {"id": job_id},
+    )
+    counts = {row["status"]: row["n"] for row in by_status}
+    finished = [row["last_finished"] for row in by_status if row["last_finished"] is not None]
+    last_finished = max(finished) if finished else None
+    origins: dict[str, dict] = {}
+    for row in by_origin:
+        stats = origins.setdefault(row["origin"], {"pushes": 0, "attempts": 0, "errors": {}})
+        stats["pushes"] += row["n"]
+        stats["attempts"] += row["attempts"] or 0
+        if row["error_class"] and row["error_class"] != "ok":
+            stats["errors"][row["error_class"]] = stats["errors"].get(row["error_class"], 0) + row["n"]
+    latencies: dict[str, list] = {}
+    for row in latency_rows:
+        latencies.setdefault(row["origin"], []).append(row["latency"])
+    for origin, values in latencies.items():
+        origins[origin].update({
+            "latency_p50": _percentile(values, 0.5),
+            "latency_p95": _percentile(values, 0.95),
+            "latency_max": values[-1],
+        })
+    done = not counts.get("pending") and not counts.get("sending")
+    end = (last_finished or job["created_at"]) if done else time.time()
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "audience": job["audience"],
+        "state": "done" if done else "sending",
+        "total": job["total"],
+        "counts": counts,
+        "attempts": sum(row["attempts"] or 0 for row in by_status),
+        "duration_seconds": round(max(0.0, end - job["created_at"]), 3),
+        "encrypt_seconds": round(job["encrypt_seconds"], 3),
+        "origins": origins,
+    }
@@ -0,0 +1,335 @@
+"""Durable push outbox: every push is a row in push_outbox until it is delivered.
+
+enqueue() writes one row per (subscription, message) and returns at once. The worker claims
+due rows in batches under a lease, sends them through push_delivery and records the outcome.
+A batch is sent in chunks of CHUNK_SIZE: the lease on the batch's unsent rows is renewed
+before each chunk and the chunk's outcomes are written right after it, so a long broadcast
+keeps its rows, and outcomes are only written by the worker still holding the lease.
+429 / 5xx / network failures go back to 'pending' with exponential backoff (never sooner
+than the push service's Retry-After) until PUSH_MAX_ATTEMPTS. Rows left 'sending' by a
+stopped or crashed process are claimed again once their lease expires, so a restart resumes
+a broadcast where it stopped (delivery is at-least-once).
+
+Messages with a topic collapse: queuing a new one supersedes rows of the same topic still
+pending for those subscriptions, and the Web Push Topic header makes the push service
+replace an earlier message it has not delivered yet (device offline).
+
+Statuses: pending -> sending -> sent | gone (endpoint removed) | failed | expired (TTL passed);
+pending -> superseded (a newer message with the same topic was queued).
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Optional
+
+from app.config import (
+    PUSH_CONCURRENCY_PER_ORIGIN,
+    PUSH_MAX_ATTEMPTS,
+    PUSH_OUTBOX_BATCH,
+    PUSH_OUTBOX_LEASE_SECONDS,
+    PUSH_OUTBOX_POLL_SECONDS,
+    PUSH_OUTBOX_RETENTION_HOURS,
+    PUSH_RETRY_BASE_SECONDS,
+    PUSH_RETRY_MAX_SECONDS,
+    PUSH_TIMEOUT_SECONDS,
+    VAPID_PRIVATE_KEY,
+)
+from app.database import database
+from app.logging_config import logger
+from app.push_delivery import deliver
+from app.push_registry import remove, resolve
+
+PURGE_INTERVAL_SECONDS = 3600
+# Rows sent between lease renewals: even when they all go to one push service, a chunk takes
+# about CHUNK_ROUNDS request timeouts at PUSH_CONCURRENCY_PER_ORIGIN
+CHUNK_ROUNDS = 4
+CHUNK_SIZE = PUSH_CONCURRENCY_PER_ORIGIN * CHUNK_ROUNDS
+# Long enough for one chunk with room to spare
+LEASE_SECONDS = max(PUSH_OUTBOX_LEASE_SECONDS, 2 * CHUNK_ROUNDS * PUSH_TIMEOUT_SECONDS)
+
+_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+_last_purge = 0.0
+# push-service origin -> unix time before which nothing is sent to it (429 Retry-After)
+_paused_until: dict[str, float] = {}
+
+
+def wake() -> None:
+    """Make the worker drain now (after queueing inside a caller's transaction, call on commit)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def enqueue(subscription_ids, data: bytes, *, ttl: int = 0, headers: Optional[dict] = None,
+                  topic: Optional[str] = None, job_id: Optional[str] = None) -> int:
+    """
+    Queue data for each subscription id; returns the number of rows queued.
+    ttl > 0 is also the deadline in the outbox: rows not delivered within ttl seconds expire.
+    topic (up to 32 URL-safe base64 characters) replaces pending messages with the same topic.
+    job_id tags the rows with their broadcast (see push_jobs).
+    """
+    if not VAPID_PRIVATE_KEY:
+        return 0
+    ids = list(dict.fromkeys(i for i in subscription_ids if i is not None))
+    if not ids:
+        return 0
+    if topic:
+        headers = {**(headers or {}), "Topic": topic}
+    now = time.time()
+    common = {
+        "payload": data.decode("utf-8"),
+        "ttl": ttl,
+        "headers": json.dumps(headers, sort_keys=True) if headers else None,
+        "due": now,
+        "expires": now + ttl if ttl > 0 else None,
+        "topic": topic,
+        "job": job_id,
+    }
+    async with database.transaction():
+        if topic:
+            await database.execute_many(
+                """UPDATE push_outbox SET status = 'superseded', finished_at = :now
+                   WHERE topic = :topic AND subscription_id = :sid AND status = 'pending'""",
+                [{"sid": sid, "topic": topic, "now": now} for sid in ids],
+            )
+        await database.execute_many(
+            """INSERT INTO push_outbox
+                   (subscription_id, payload, ttl, headers_json, topic, job_id, next_attempt_at, expires_at)
+               VALUES (:sid, :payload, :ttl, :headers, :topic, :job, :due, :expires)""",
+            [{"sid": sid, **common} for sid in ids],
+        )
+    wake()
+    return len(ids)
+
+
+def _backoff(attempts: int, retry_after: Optional[float]) -> float:
+    """Seconds until the next try after `attempts` failed ones: capped exponential with jitter."""
+    delay = min(PUSH_RETRY_MAX_SECONDS, PUSH_RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+    delay = random.uniform(delay / 2, delay)
+    return max(delay, retry_after or 0.0)
+
+
+async def _claim(limit: int) -> tuple:
+    """Lease up to `limit` due rows (and rows whose lease expired) to this worker.
+    Returns (claim token, rows)."""
+    now = time.time()
+    token = uuid.uuid4().hex
+    # The outer status/lease check makes a concurrent claimer skip rows it lost the race for
+    await database.execute(
+        """UPDATE push_outbox SET status = 'sending', claim_token = :token, locked_until = :lease
+           WHERE id IN (
+               SELECT id FROM push_outbox
+               WHERE (status = 'pending' AND next_attempt_at <= :now)
+                  OR (status = 'sending' AND locked_until < :now)
+               ORDER BY next_attempt_at, id
+               LIMIT :limit
+           )
+           AND (status = 'pending' OR locked_until < :now)""",
+        {"token": token, "lease": now + LEASE_SECONDS, "now": now, "limit": limit},
+    )
+    rows = await database.fetch_all(
+        """SELECT id, subscription_id, payload, ttl, headers_json, job_id, attempts, expires_at
+           FROM push_outbox WHERE claim_token = :token""",
+        {"token": token},
+    )
+    return token, rows
+
+
+async def _renew(token: str) -> set:
+    """Extend the lease on the batch's unfinished rows; returns the ids this worker still holds."""
+    rows = await database.fetch_all(
+        """UPDATE push_outbox SET locked_until = :lease
+           WHERE claim_token = :token AND status = 'sending'
+           RETURNING id""",
+        {"token": token, "lease": time.time() + LEASE_SECONDS},
+    )
+    return {row["id"] for row in rows}
+
+
+async def _finish(updates: list, token: str) -> None:
+    """Write outcomes (see _update) in one transaction. Rows not sent this time keep their last
+    attempt's origin / latency / error class. Fenced on the claim token: rows whose lease
+    expired and were claimed by another worker are left to it."""
+    if not updates:
+        return
+    now = time.time()
+    async with database.transaction():
+        await database.execute_many(
+            """UPDATE push_outbox
+               SET status = :status, attempts = :attempts, next_attempt_at = :due,
+                   last_status = :code, last_error = :error, claim_token = NULL, locked_until = NULL,
+                   origin = COALESCE(:origin, origin), latency = COALESCE(:latency, latency),
+                   error_class = COALESCE(:error_class, error_class), finished_at = :finished
+               WHERE id = :id AND claim_token = :token""",
+            [{**u, "token": token, "finished": None if u["status"] == "pending" else now} for u in updates],
+        )
+
+
+def _update(row, status: str, *, attempts: Optional[int] = None, due: Optional[float] = None,
+            code: Optional[int] = None, error: Optional[str] = None, result=None) -> dict:
+    return {
+        "id": row["id"],
+        "status": status,
+        "attempts": row["attempts"] if attempts is None else attempts,
+        "due": time.time() if due is None else due,
+        "code": code,
+        "error": error[:200] if error else None,
+        "origin": result.origin if result is not None else None,
+        "latency": result.latency if result is not None else None,
+        "error_class": result.error_class if result is not None else None,
+    }
+
+
+def _record(targets: list, results: list, by_id: dict, updates: list, gone_subscriptions: list,
+            encrypt_time: dict) -> None:
+    """Turn one chunk's PushResults into outcome updates (appended to updates)."""
+    for (_, sub), result in zip(targets, results):
+        row = by_id[result.subscription_id]
+        attempts = row["attempts"] + 1
+        if row["job_id"]:
+            encrypt_time[row["job_id"]] = encrypt_time.get(row["job_id"], 0.0) + result.encrypt_seconds
+        outcome = {"attempts": attempts, "code": result.status_code, "error": result.error, "result": result}
+        if result.ok:
+            updates.append(_update(row, "sent", **outcome))
+        elif result.gone:
+            gone_subscriptions.append(row["subscription_id"])
+            updates.append(_update(row, "gone", **outcome))
+        elif result.retryable and attempts < PUSH_MAX_ATTEMPTS:
+            if result.status_code == 429 and result.retry_after:
+                _paused_until[sub.origin] = max(_paused_until.get(sub.origin, 0.0), time.time() + result.retry_after)
+            due = time.time() + _backoff(attempts, result.retry_after)
+            updates.append(_update(row, "pending", due=due, **outcome))
+        else:
+            updates.append(_update(row, "failed", **outcome))
+
+
+async def _process(rows: list, token: str) -> dict:
+    """Send one claimed batch and record every row's outcome. Returns counts per status."""
+    now = time.time()
+    updates: list = []
+    gone_subscriptions: list = []
+    # job id -> seconds spent encrypting its payloads in this batch
+    encrypt_time: dict[str, float] = {}
+    # (payload, ttl, headers) -> [(outbox id, PushSubscription)]: one deliver() call per message
+    groups: dict[tuple, list] = {}
+    by_id = {row["id"]: row for row in rows}
+    subscriptions = await resolve([row["subscription_id"] for row in rows])
+    for row in rows:
+        if row["expires_at"] is not None and row["expires_at"] <= now:
+            updates.append(_update(row, "expired"))
+            continue
+        sub = subscriptions.get(row["subscription_id"])
+        if sub is None:
+            # Unsubscribed (or removed as gone by an earlier row) since it was queued
+            updates.append(_update(row, "gone"))
+            continue
+        paused = _paused_until.get(sub.origin, 0.0)
+        if paused > now:
+            # The push service asked us to back off: wait without spending an attempt
+            updates.append(_update(row, "pending", due=paused))
+            continue
+        ttl = row["ttl"] or 0
+        if row["expires_at"] is not None:
+            ttl = max(1, int(row["expires_at"] - now))
+        groups.setdefault((row["payload"], ttl, row["headers_json"]), []).append((row["id"], sub))
+
+    await _finish(updates, token)
+    finished = len(updates)
+
+    for (payload, ttl, headers_json), group in groups.items():
+        headers = json.loads(headers_json) if headers_json else None
+        for start in range(0, len(group), CHUNK_SIZE):
+            held = await _renew(token)
+            # Rows missing from held outlived the lease and belong to another worker now
+            targets = [(oid, sub) for oid, sub in group[start:start + CHUNK_SIZE] if oid in held]
+            results = await deliver([(oid, sub.info) for oid, sub in targets], payload.encode("utf-8"),
+                                    ttl=ttl, headers=headers)
+            _record(targets, results, by_id, updates, gone_subscriptions, encrypt_time)
+            await _finish(updates[finished:], token)
+            finished = len(updates)
+
+    if gone_subscriptions:
+        try:
+            await remove(gone_subscriptions)
+        except Exception:
+            logger.exception("push outbox: deleting gone subscriptions failed")
+    if encrypt_time:
+        await database.execute_many(
+            "UPDATE push_jobs SET encrypt_seconds = encrypt_seconds + :seconds WHERE id = :id",
+            [{"id": job_id, "seconds": seconds} for job_id, seconds in encrypt_time.items()],
+        )
+    counts: dict[str, int] = {}
+    for u in updates:
+        counts[u["status"]] = counts.get(u["status"], 0) + 1
+    return counts
+
+
+async def drain_once(limit: int = PUSH_OUTBOX_BATCH) -> int:
+    """Claim and process one batch of due rows; returns how many rows were claimed."""
+    token, rows = await _claim(limit)
+    if rows:
+        counts = await _process(rows, token)
+        logger.info("push outbox batch: %s", counts)
+    return len(rows)
+
+
+async def _purge() -> None:
+    """Drop finished rows and jobs older than PUSH_OUTBOX_RETENTION_HOURS."""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    before = now - PUSH_OUTBOX_RETENTION_HOURS * 3600
+    await database.execute(
+        "DELETE FROM push_outbox WHERE status NOT IN ('pending', 'sending') AND finished_at < :before",
+        {"before": before},
+    )
+    await database.execute(
+        """DELETE FROM push_jobs WHERE created_at < :before
+           AND NOT EXISTS (SELECT 1 FROM push_outbox o WHERE o.job_id = push_jobs.id)""",
+        {"before": before},
+    )
+
+
+async def _run() -> None:
+    while True:
+        # Cleared before draining: an enqueue() during the batch makes the wait below return at once
+        _wakeup.clear()
+        try:
+            if await drain_once() > 0:
+                continue
+            await _purge()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("push outbox worker error")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=PUSH_OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_worker() -> None:
+    """Start draining the outbox in this process (app startup). No-op without a VAPID key."""
+    global _task, _wakeup
+    if not VAPID_PRIVATE_KEY or (_task is not None and not _task.done()):
+        return
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run())
+    logger.info("Push outbox worker started")
+
+
+async def stop_worker() -> None:
+    """Stop the worker. Rows it had claimed are picked up again after their lease expires."""
+    global _task
+    task, _task = _task, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
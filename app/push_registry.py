@@ -0,0 +1,203 @@
+"""Push subscriptions: normalized rows plus a warm in-process registry.
+
+push_subscriptions keeps endpoint, keys and push-service origin as columns, one row per
+endpoint, so a student can have several devices. The registry holds every subscription
+as a slotted record with its subscription_info built once, so broadcasts pick targets by
+id without parsing JSON. subscribe() / unsubscribe() / remove() update it in place; other
+workers drop theirs via the "subscriptions" cache tag and reload on next use.
+"""
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from app.config import CACHE_TTL_SECONDS
+from app.database import database
+from app.logging_config import logger
+from utils.cache import add_invalidation_listener, invalidate, single_flight
+
+# ids per ... WHERE id IN (...), below SQLite's bound-parameter limit
+ID_BATCH = 500
+
+
+def _id_chunks(ids: list):
+    """({"id0": .., ...}, ":id0, :id1, ...") per ID_BATCH ids."""
+    for start in range(0, len(ids), ID_BATCH):
+        params = {f"id{n}": v for n, v in enumerate(ids[start : start + ID_BATCH])}
+        yield params, ", ".join(f":{k}" for k in params)
+
+
+def origin_of(endpoint: str) -> str:
+    """Push-service origin (VAPID audience): scheme://host[:port]."""
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+def parse_subscription_info(data: dict) -> tuple:
+    """(endpoint, p256dh, auth) from a browser PushSubscription.toJSON(); ValueError if incomplete."""
+    endpoint = (data or {}).get("endpoint")
+    keys = (data or {}).get("keys") or {}
+    if not isinstance(endpoint, str) or urlparse(endpoint).scheme != "https":
+        raise ValueError("endpoint must be an https URL")
+    p256dh, auth = keys.get("p256dh"), keys.get("auth")
+    if not p256dh or not auth:
+        raise ValueError("keys.p256dh and keys.auth are required")
+    return endpoint, str(p256dh), str(auth)
+
+
+class PushSubscription:
+    """One device. Slotted: the registry keeps every subscription for the whole process."""
+
+    __slots__ = ("id", "student_id", "endpoint", "origin", "info")
+
+    def __init__(self, id, student_id, endpoint, p256dh, auth, origin):
+        self.id = id
+        self.student_id = student_id
+        self.endpoint = endpoint
+        self.origin = origin
+        # What pywebpush / push_crypto expect
+        self.info = {"endpoint": endpoint, "keys": {"p256dh": p256dh, "auth": auth}}
+
+    @classmethod
+    def from_row(cls, row) -> "PushSubscription":
+        return cls(row["id"], row["student_id"], row["endpoint"], row["p256dh"], row["auth"], row["origin"])
+
+
+class Registry:
+    __slots__ = ("loaded_at", "by_id", "by_student")
+
+    def __init__(self, subscriptions=()):
+        self.loaded_at = time.time()
+        self.by_id: dict[int, PushSubscription] = {}
+        self.by_student: dict[str, set] = {}
+        for sub in subscriptions:
+            self.put(sub)
+
+    def put(self, sub: PushSubscription) -> None:
+        self.discard(sub.id)
+        self.by_id[sub.id] = sub
+        self.by_student.setdefault(sub.student_id, set()).add(sub.id)
+
+    def discard(self, subscription_id) -> None:
+        sub = self.by_id.pop(subscription_id, None)
+        if sub is None:
+            return
+        ids = self.by_student.get(sub.student_id)
+        if ids is not None:
+            ids.discard(subscription_id)
+            if not ids:
+                del self.by_student[sub.student_id]
+
+    def ids(self) -> list:
+        return list(self.by_id)
+
+    def for_students(self, student_ids) -> list:
+        """Subscription ids of all devices of the given students."""
+        out: list = []
+        for student_id in student_ids:
+            out.extend(self.by_student.get(student_id, ()))
+        return out
+
+
+_registry: Optional[Registry] = None
+_generation = 0
+
+_COLUMNS = "id, student_id, endpoint, p256dh, auth, origin"
+
+
+async def _load() -> Registry:
+    global _registry
+    generation = _generation
+    rows = await database.fetch_all(f"SELECT {_COLUMNS} FROM push_subscriptions")
+    registry = Registry(PushSubscription.from_row(r) for r in rows)
+    if generation == _generation:
+        _registry = registry
+        logger.info("push registry loaded (%d subscriptions)", len(registry.by_id))
+    return registry
+
+
+async def get_registry() -> Registry:
+    """Warm registry; loaded on first use, re-read after CACHE_TTL_SECONDS like the schedule snapshot."""
+    registry = _registry
+    if registry is not None and time.time() - registry.loaded_at < CACHE_TTL_SECONDS:
+        return registry
+    try:
+        return await single_flight(f"push:registry:{_generation}", _load)
+    except Exception:
+        logger.exception("push registry load failed")
+        return registry or Registry()
+
+
+def _drop() -> None:
+    global _registry, _generation
+    _registry = None
+    _generation += 1
+
+
+def _on_remote_invalidate(tags: tuple) -> None:
+    if "subscriptions" in tags or "*" in tags:
+        _drop()
+
+
+add_invalidation_listener(_on_remote_invalidate)
+
+
+async def resolve(ids) -> dict:
+    """id -> PushSubscription for the ids that still exist. Ids this worker has not seen
+    yet (subscribed through another process) are read from the DB in one query."""
+    ids = list(ids)
+    registry = await get_registry()
+    found = {i: registry.by_id[i] for i in ids if i in registry.by_id}
+    missing = [i for i in dict.fromkeys(ids) if i not in found]
+    for params, placeholders in _id_chunks(missing):
+        rows = await database.fetch_all(
+            f"SELECT {_COLUMNS} FROM push_subscriptions WHERE id IN ({placeholders})", params
+        )
+        for row in rows:
+            sub = PushSubscription.from_row(row)
+            registry.put(sub)
+            found[sub.id] = sub
+    return found
+
+
+async def subscribe(student_id: str, data: dict) -> int:
+    """Store (or move to student_id) the device's subscription; returns its id."""
+    endpoint, p256dh, auth = parse_subscription_info(data)
+    values = {"sid": student_id, "endpoint": endpoint, "p256dh": p256dh, "auth": auth, "origin": origin_of(endpoint)}
+    await database.execute(
+        """INSERT INTO push_subscriptions (student_id, endpoint, p256dh, auth, origin)
+           VALUES (:sid, :endpoint, :p256dh, :auth, :origin)
+           ON CONFLICT (endpoint) DO UPDATE SET
+               student_id = excluded.student_id, p256dh = excluded.p256dh, auth = excluded.auth,
+               updated_at = CURRENT_TIMESTAMP""",
+        values,
+    )
+    row = await database.fetch_one(
+        f"SELECT {_COLUMNS} FROM push_subscriptions WHERE endpoint = :endpoint", {"endpoint": endpoint}
+    )
+    sub = PushSubscription.from_row(row)
+    if _registry is not None:
+        _registry.put(sub)
+    await invalidate("subscriptions")
+    return sub.id
+
+
+async def unsubscribe(endpoint: str) -> bool:
+    """Forget the device with this endpoint. Returns whether it was subscribed."""
+    row = await database.fetch_one("SELECT id FROM push_subscriptions WHERE endpoint = :e", {"e": endpoint})
+    if row is None:
+        return False
+    await remove([row["id"]])
+    return True
+
+
+async def remove(ids) -> None:
+    """Delete subscriptions (e.g. endpoints the push service reported gone) in batched DELETEs."""
+    ids = list(dict.fromkeys(i for i in ids if i is not None))
+    if not ids:
+        return
+    for params, placeholders in _id_chunks(ids):
+        await database.execute(f"DELETE FROM push_subscriptions WHERE id IN ({placeholders})", params)
+    if _registry is not None:
+        for i in ids:
+            _registry.discard(i)
+    await invalidate("subscriptions")
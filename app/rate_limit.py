@@ -24,6 +24,16 @@ def _client_key(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
+def _api_client_key(request: Request) -> str:
+    # Signed-in callers get one bucket per user wherever they connect from (a shared NAT does not
+    # throttle a whole class); the token was already checked by PrincipalMiddleware. Anonymous
+    # callers and invalid tokens fall back to the address, so junk tokens get no own bucket
+    auth = getattr(request.state, "auth", None)
+    if auth is not None and auth.verified:
+        return f"user:{auth.user_id}"
+    return _client_key(request)
+
+
 def check_rate_limit(request: Request) -> None:
     """Raise 429 if client exceeded rate limit. Call from login/refresh endpoints."""
     key = f"ratelimit:{_client_key(request)}"
@@ -42,11 +52,11 @@ def check_rate_limit(request: Request) -> None:
 
 
 def check_api_rate_limit(request: Request) -> None:
-    """Global rate limit for all /api/* endpoints. Raise 429 if exceeded."""
+    """Global rate limit for all /api/* endpoints, per user or client address. Raise 429 if exceeded."""
     path = request.scope.get("path") or ""
     if not path.startswith("/api"):
         return
-    key = f"api:{_client_key(request)}"
+    key = f"api:{_api_client_key(request)}"
     now = time.monotonic()
     count, window_start = _api_store[key]
     if now - window_start >= API_RATE_LIMIT_WINDOW_SECONDS:
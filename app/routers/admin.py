@@ -1,19 +1,17 @@
 import json
+from typing import Optional
 
-from fastapi import APIRouter, BackgroundTasks, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
 
 from app.database import database
 from app.dependencies import require_admin
 from app.logging_config import logger
 from app.models import AnnouncementUpdate, ScheduleItemCreate, TeacherCreate
+from app.pagination import MAX_LIMIT, UNPAGED_LIMIT, fetch_page, is_paged
 from app.sanitize import sanitize_text
-
-# Import get_schedule_nocache from schedule router to reuse logic if needed, 
-# or just re-implement/import helper. Since routers are separate, we might import the helper.
-# Ideally we move get_schedule_data logic to a crud/service layer, but for now we'll duplicate or cross-import.
-# For simplicity in this refactor step, we'll re-implement the query or import the router function if possible.
-# Actually, calling router functions directly is not best practice. Let's duplicate the simple select query for now to decouple.
+from app.schedule_store import get_snapshot, refresh_schedule
+from utils.cache import invalidate
 
 router = APIRouter(tags=["Admin"])
 
@@ -46,28 +44,14 @@ async def get_admin_stats(user = Depends(require_admin)):
 @router.get("/admin/schedule")
 async def get_admin_schedule(user = Depends(require_admin)):
     """Get full schedule for admin"""
-    # Simple query implementation to avoid circular imports
     try:
-        query = "SELECT * FROM schedule ORDER BY pair_number"
-        rows = await database.fetch_all(query=query)
-        schedule = []
-        for row in rows:
-            schedule.append({
-                "id": row["id"],
-                "day": row["day_of_week"],
-                "pair": row["pair_number"],
-                "subject": row["subject"],
-                "type": row["lesson_type"],
-                "teacher": row["teacher"],
-                "room": row["room"],
-                "weeks": [row["week_start"], row["week_end"]]
-            })
-        return schedule
+        snapshot = await get_snapshot()
+        return Response(content=snapshot.json_bytes, media_type="application/json")
     except Exception:
         return []
 
 @router.post("/admin/schedule")
-async def add_schedule_item(item: ScheduleItemCreate, background_tasks: BackgroundTasks, user=Depends(require_admin)):
+async def add_schedule_item(item: ScheduleItemCreate, user=Depends(require_admin)):
     """Add new lesson to schedule"""
     try:
         insert_query = """
@@ -82,17 +66,18 @@ async def add_schedule_item(item: ScheduleItemCreate, background_tasks: Backgrou
             "INSERT INTO schedule_change_log (action, payload_json, changed_by) VALUES ('add', :p, :by)",
             {"p": json.dumps({"lesson_id": lid, **values}), "by": user.get("telegram_id", "")},
         )
-        from utils.cache import clear_cache
-        clear_cache()
+        # Snapshot first, then the tag: a read in between must not pair the new ETag with the old body
+        await refresh_schedule()
+        await invalidate("schedule")
         from app.routers.push import notify_schedule_changed
-        background_tasks.add_task(notify_schedule_changed)
+        await notify_schedule_changed("add", values["subject"])
         logger.info("schedule_updated", extra={"action": "add", "admin": user.get("telegram_id")})
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @router.delete("/admin/schedule/{lesson_id}")
-async def delete_schedule_item(lesson_id: int, background_tasks: BackgroundTasks, user=Depends(require_admin)):
+async def delete_schedule_item(lesson_id: int, user=Depends(require_admin)):
     """Delete lesson from schedule"""
     try:
         row = await database.fetch_one("SELECT * FROM schedule WHERE id = :id", {"id": lesson_id})
@@ -101,23 +86,33 @@ async def delete_schedule_item(lesson_id: int, background_tasks: BackgroundTasks
             "INSERT INTO schedule_change_log (action, payload_json, changed_by) VALUES ('delete', :p, :by)",
             {"p": json.dumps(dict(row)) if row else "{}", "by": user.get("telegram_id", "")},
         )
-        from utils.cache import clear_cache
-        clear_cache()
+        # Snapshot first, then the tag: a read in between must not pair the new ETag with the old body
+        await refresh_schedule()
+        await invalidate("schedule")
         from app.routers.push import notify_schedule_changed
-        background_tasks.add_task(notify_schedule_changed)
+        await notify_schedule_changed("delete", row["subject"] if row else None)
         logger.info("schedule_updated", extra={"action": "delete", "lesson_id": lesson_id, "admin": user.get("telegram_id")})
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @router.get("/admin/schedule-history")
-async def get_schedule_history(user=Depends(require_admin), limit: int = 50):
-    """List recent schedule changes (add/delete)."""
-    rows = await database.fetch_all(
-        "SELECT id, action, payload_json, changed_by, created_at FROM schedule_change_log ORDER BY created_at DESC LIMIT :lim",
-        {"lim": limit},
+async def get_schedule_history(
+    user=Depends(require_admin),
+    limit: int = Query(50, ge=1),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+):
+    """List recent schedule changes (add/delete): an array of the latest limit changes (at most
+    UNPAGED_LIMIT), as always. With cursor/with_total — {items, next_cursor[, total]} pages of at most
+    MAX_LIMIT (limit predates pagination here, so it alone keeps the array)."""
+    paged = is_paged(None, cursor, with_total)
+    page = await fetch_page(
+        "id, action, payload_json, changed_by, created_at", "schedule_change_log",
+        limit=min(limit, MAX_LIMIT if paged else UNPAGED_LIMIT), offset=offset, cursor=cursor, with_total=with_total,
     )
-    return [dict(r) for r in rows]
+    return page if paged else page["items"]
 
 class PollCreateBody(BaseModel):
     question: str
@@ -132,14 +127,25 @@ async def create_poll(body: PollCreateBody, user=Depends(require_admin)):
             "INSERT INTO polls (question, options_json, created_by) VALUES (:q, :opts, :by)",
             {"q": body.question[:500], "opts": json.dumps(opts), "by": user.get("telegram_id", "")},
         )
+        await invalidate("polls")
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @router.get("/admin/polls")
-async def list_admin_polls(user=Depends(require_admin)):
-    rows = await database.fetch_all("SELECT id, question, options_json, active, created_at FROM polls ORDER BY created_at DESC")
-    return [dict(r) for r in rows]
+async def list_admin_polls(
+    user=Depends(require_admin),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+):
+    paged = is_paged(limit, cursor, with_total)
+    page = await fetch_page(
+        "id, question, options_json, active, created_at", "polls",
+        limit=limit if paged else UNPAGED_LIMIT, offset=offset, cursor=cursor, with_total=with_total,
+    )
+    return page if paged else page["items"]
 
 class MaterialCreateBody(BaseModel):
     subject_name: str
@@ -153,6 +159,7 @@ async def add_material(body: MaterialCreateBody, user=Depends(require_admin)):
             "INSERT INTO subject_materials (subject_name, title, url, uploaded_by) VALUES (:s, :t, :u, :by)",
             {"s": body.subject_name[:200], "t": body.title[:200], "u": body.url[:2000], "by": user.get("telegram_id", "")},
         )
+        await invalidate("materials")
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -161,15 +168,26 @@ async def add_material(body: MaterialCreateBody, user=Depends(require_admin)):
 async def delete_material(material_id: int, user=Depends(require_admin)):
     try:
         await database.execute("DELETE FROM subject_materials WHERE id = :id", {"id": material_id})
+        await invalidate("materials")
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @router.get("/admin/teachers")
-async def get_admin_teachers(user = Depends(require_admin)):
-    """Get teacher list for admin"""
-    query = "SELECT * FROM teachers ORDER BY name"
-    return await database.fetch_all(query=query)
+async def get_admin_teachers(
+    user=Depends(require_admin),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+):
+    """Get teacher list for admin (by name). With limit/cursor/with_total — {items, next_cursor[, total]}."""
+    paged = is_paged(limit, cursor, with_total)
+    page = await fetch_page(
+        "*", "teachers", order=("name", "id"), descending=False,
+        limit=limit if paged else UNPAGED_LIMIT, offset=offset, cursor=cursor, with_total=with_total,
+    )
+    return page if paged else page["items"]
 
 @router.post("/admin/teachers")
 async def add_teacher(item: TeacherCreate, user=Depends(require_admin)):
@@ -180,6 +198,7 @@ async def add_teacher(item: TeacherCreate, user=Depends(require_admin)):
             VALUES (:name, :subject)
         """
         await database.execute(query=query, values=item.model_dump())
+        await invalidate("ratings")
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -189,6 +208,7 @@ async def delete_teacher(teacher_id: int, user = Depends(require_admin)):
     """Delete teacher"""
     try:
         await database.execute("DELETE FROM teachers WHERE id = :id", {"id": teacher_id})
+        await invalidate("ratings")
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -211,13 +231,26 @@ async def get_announcement_stats(user=Depends(require_admin)):
 
 
 @router.get("/admin/subject-reviews")
-async def list_subject_reviews(user=Depends(require_admin)):
-    """List all subject reviews for moderation."""
+async def list_subject_reviews(
+    user=Depends(require_admin),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+):
+    """List subject reviews for moderation (newest 100 without pagination params)."""
+    paged = is_paged(limit, cursor, with_total)
     try:
-        rows = await database.fetch_all("SELECT id, subject_name, body, created_at, moderated FROM subject_reviews ORDER BY created_at DESC LIMIT 100")
-        return [dict(r) for r in rows]
+        page = await fetch_page(
+            "id, subject_name, body, created_at, moderated", "subject_reviews",
+            limit=limit if paged else 100, offset=offset, cursor=cursor, with_total=with_total,
+        )
+    except HTTPException:
+        raise
     except Exception:
-        return []
+        logger.exception("subject reviews list error")
+        return {"items": [], "next_cursor": None} if paged else []
+    return page if paged else page["items"]
 
 
 @router.post("/admin/subject-reviews/{review_id}/moderate")
@@ -225,6 +258,7 @@ async def moderate_subject_review(review_id: int, user=Depends(require_admin)):
     """Set review as moderated (visible)."""
     try:
         await database.execute("UPDATE subject_reviews SET moderated = TRUE WHERE id = :id", {"id": review_id})
+        await invalidate("ratings")
         return {"success": True}
     except Exception:
         return {"success": False}
@@ -244,6 +278,7 @@ async def update_announcement(data: AnnouncementUpdate, user=Depends(require_adm
                 "INSERT INTO announcements (message, is_active, schedule_context) VALUES (:msg, TRUE, :ctx)",
                 {"msg": message, "ctx": ctx_str}
             )
+        await invalidate("announcements")
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -1,15 +1,20 @@
+import json
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from pydantic import BaseModel
 
+from app.calendar_feed import schedule_feed, user_feed, user_feed_tags
 from app.config import APP_VERSION, DAY_MAPPING, FEATURE_FLAGS, PAIR_TIMES, SEMESTER_START
 from app.database import database
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_optional_user_id
+from app.http_cache import Fallback, conditional
 from app.logging_config import logger
 from app.models import AnnouncementReadRequest, RateTeacherRequest, SubjectReviewCreate
 from app.sanitize import sanitize_text
+from app.schedule_store import get_snapshot, refresh_schedule
+from utils.cache import cached, invalidate, user_tag
 
 router = APIRouter(tags=["API"])
 
@@ -95,10 +100,12 @@ async def set_favorites(data: FavoritesUpdate, user: dict = Depends(get_current_
                 )
             except Exception:
                 pass
+    await invalidate(user_tag("favorites", sid))
     return {"success": True, "subjects": data.subjects or []}
 
 
 @router.get("/flags", summary="Feature flags и версия для фронта")
+@conditional(salt=json.dumps(FEATURE_FLAGS, sort_keys=True))
 async def get_flags():
     """Return feature flags and app version for frontend."""
     return {**FEATURE_FLAGS, "version": APP_VERSION}
@@ -115,14 +122,10 @@ async def get_next_lesson():
         day_name = list(DAY_MAPPING.keys())[day_idx]
         delta = now.date() - SEMESTER_START.date()
         week_num = max(1, (delta.days // 7) + 1)
-        rows = await database.fetch_all("SELECT * FROM schedule ORDER BY pair_number")
+        snapshot = await get_snapshot()
         times = PAIR_TIMES
-        for row in rows:
-            if row["day_of_week"] != day_name:
-                continue
-            if not (row["week_start"] <= week_num <= row["week_end"]):
-                continue
-            t = times.get(row["pair_number"])
+        for lesson in snapshot.lessons_on(day_name, week_num):
+            t = times.get(lesson.pair)
             if not t:
                 continue
             start_h, start_m = map(int, t[0].split(":"))
@@ -131,10 +134,10 @@ async def get_next_lesson():
             if dt_start > now:
                 return {
                     "next": {
-                        "subject": row["subject"],
-                        "room": row["room"],
-                        "teacher": row["teacher"],
-                        "pair": row["pair_number"],
+                        "subject": lesson.subject,
+                        "room": lesson.room,
+                        "teacher": lesson.teacher,
+                        "pair": lesson.pair,
                         "start": t[0],
                         "in_minutes": int((dt_start - now).total_seconds() / 60),
                     },
@@ -153,51 +156,21 @@ async def post_metrics(data: dict):
 
 
 @router.get("/subjects")
+@conditional(tags=("schedule",))
 async def get_subjects():
-    """Returns aggregated subjects information with caching"""
-    # Simply using cache decorator on a helper or querying directly
-    # For now, let's query directly as simple endpoints
+    """Returns aggregated subjects information (precomputed in the schedule snapshot)"""
     try:
-        query = """
-            SELECT DISTINCT subject, lesson_type, teacher, room 
-            FROM schedule 
-            ORDER BY subject
-        """
-        rows = await database.fetch_all(query=query)
-        
-        subjects = {}
-        for row in rows:
-            name = row["subject"]
-            if name not in subjects:
-                subjects[name] = {
-                    "name": name,
-                    "types": [],
-                    "teachers": set(),
-                    "rooms": set()
-                }
-            
-            if row["lesson_type"] not in subjects[name]["types"]:
-                subjects[name]["types"].append(row["lesson_type"])
-            
-            if row["teacher"] and row["teacher"] != "Не указан":
-                subjects[name]["teachers"].add(row["teacher"])
-                
-            if row["room"] and "*" not in row["room"]:
-                subjects[name]["rooms"].add(row["room"])
-        
-        # Convert sets to lists
-        result = []
-        for _name, data in subjects.items():
-            data["teachers"] = list(data["teachers"])
-            data["rooms"] = list(data["rooms"])
-            result.append(data)
-            
-        return result
+        snapshot = await get_snapshot()
     except Exception:
         logger.exception("Subjects error")
-        return []
+        raise Fallback([]) from None
+    if not snapshot.loaded:
+        raise Fallback([])
+    return snapshot.subjects
 
 @router.get("/exams")
+@conditional(tags=("exams",))
+@cached(tags=("exams",))
 async def get_exams():
     """Get all exams"""
     try:
@@ -217,7 +190,8 @@ async def get_exams():
             for r in rows
         ]
     except Exception:
-        return []
+        logger.exception("Exams error")
+        raise Fallback([]) from None
 
 
 @router.get("/exams/reminders")
@@ -249,6 +223,7 @@ async def add_exam_reminder(exam_id: int, user: dict = Depends(get_current_user)
                 "INSERT INTO exam_reminders (student_id, exam_id) VALUES (:sid, :eid)",
                 {"sid": user["telegram_id"], "eid": exam_id},
             )
+            await invalidate(user_tag("reminders", user["telegram_id"]))
     except HTTPException:
         raise
     except Exception as e:
@@ -265,12 +240,14 @@ async def remove_exam_reminder(exam_id: int, user: dict = Depends(get_current_us
             "DELETE FROM exam_reminders WHERE student_id = :sid AND exam_id = :eid",
             {"sid": user["telegram_id"], "eid": exam_id},
         )
+        await invalidate(user_tag("reminders", user["telegram_id"]))
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to remove reminder") from e
 
 
 @router.get("/ratings")
+@cached(tags=("ratings",))
 async def get_ratings():
     """Get all teacher ratings"""
     try:
@@ -301,27 +278,16 @@ async def get_ratings():
         return result
     except Exception:
         logger.exception("Ratings error")
-        return []
+        raise Fallback([]) from None
 
 @router.post("/rate-teacher")
-async def rate_teacher(data: RateTeacherRequest, authorization: str = Header(None)):
+async def rate_teacher(data: RateTeacherRequest, user_id: Optional[str] = Depends(get_optional_user_id)):
     """Submit a teacher rating"""
-    if not authorization:
+    if not user_id:
         raise HTTPException(status_code=401, detail="Auth required")
     try:
         import hashlib
 
-        from utils.jwt import is_jwt_token, verify_token
-
-        token = authorization.replace("Bearer ", "")
-        if is_jwt_token(token):
-            payload = verify_token(token, "access")
-            if not payload:
-                raise HTTPException(status_code=401, detail="Invalid token")
-            user_id = payload.get("sub")
-        else:
-            user_id = token
-
         user_hash = hashlib.sha256(user_id.encode()).hexdigest()
         teacher_id = data.teacher_id
         rating = data.rating
@@ -359,6 +325,7 @@ async def rate_teacher(data: RateTeacherRequest, authorization: str = Header(Non
         await database.execute(update_teacher, {
             "avg": round(stats["avg"], 1), "cnt": stats["cnt"], "tid": teacher_id
         })
+        await invalidate("ratings")
         logger.info("rating_submitted", extra={"teacher_id": teacher_id})
         try:
             from app.routers.extras import _grant_achievement
@@ -372,6 +339,7 @@ async def rate_teacher(data: RateTeacherRequest, authorization: str = Header(Non
         return {"success": False, "error": str(e)}
 
 @router.get("/subject-reviews")
+@cached(tags=("ratings",))
 async def get_subject_reviews(subject: str = None):
     """Anonymous short reviews for a subject (only moderated)."""
     if not subject:
@@ -383,7 +351,8 @@ async def get_subject_reviews(subject: str = None):
         )
         return [{"id": r["id"], "body": r["body"], "created_at": str(r["created_at"])} for r in rows]
     except Exception:
-        return []
+        logger.exception("Subject reviews error")
+        raise Fallback([]) from None
 
 
 @router.post("/subject-reviews")
@@ -401,6 +370,8 @@ async def post_subject_review(data: SubjectReviewCreate):
 
 
 @router.get("/announcement")
+@conditional(tags=("announcements",))
+@cached(tags=("announcements",))
 async def get_announcement():
     """Returns active announcement if exists"""
     try:
@@ -410,7 +381,6 @@ async def get_announcement():
             out = {"id": row["id"], "message": row["message"], "created_at": str(row["created_at"])}
             if row.get("schedule_context"):
                 try:
-                    import json
                     out["schedule_context"] = json.loads(row["schedule_context"])
                 except Exception:
                     pass
@@ -418,27 +388,19 @@ async def get_announcement():
         return None
     except Exception:
         logger.exception("Announcement DB error")
-        return None
+        raise Fallback(None) from None
 
 
 @router.post("/announcement/read")
 async def mark_announcement_read(
     data: Optional[AnnouncementReadRequest] = None,
-    authorization: str = Header(None),
+    user_id: Optional[str] = Depends(get_optional_user_id),
 ):
     """Mark current announcement as read (for admin stats). Uses telegram_id if auth, else identifier from body."""
     try:
         row = await database.fetch_one("SELECT id FROM announcements WHERE is_active = TRUE ORDER BY created_at DESC LIMIT 1")
         if not row:
             return Response(status_code=204)
-        user_id = None
-        if authorization:
-            from utils.jwt import verify_token
-            token = (authorization or "").replace("Bearer ", "")
-            if token:
-                payload = verify_token(token, "access")
-                if payload:
-                    user_id = payload.get("sub")
         if not user_id and data and data.identifier:
             user_id = data.identifier
         if not user_id:
@@ -456,71 +418,46 @@ async def mark_announcement_read(
         return Response(status_code=204)
 
 @router.get("/calendar.ics")
+@conditional(tags=("schedule",))
 async def get_calendar_ics():
-    """Generate ICS file for subscription"""
+    """ICS file for subscription (rendered once per schedule version)"""
     try:
-        query = "SELECT * FROM schedule"
-        lessons = await database.fetch_all(query=query)
-        
-        cal_content = [
-            "BEGIN:VCALENDAR",
-            "VERSION:2.0",
-            "PRODID:-//MXT-223//Schedule//RU",
-            "CALSCALE:GREGORIAN",
-            "METHOD:PUBLISH",
-            "X-WR-CALNAME:Расписание МХТ-223",
-            "X-WR-TIMEZONE:Asia/Tashkent",
-        ]
-        
-        for lesson in lessons:
-            week_start_num = lesson["week_start"]
-            week_end_num = lesson["week_end"]
-            day_idx = DAY_MAPPING.get(lesson["day_of_week"])
-            
-            if day_idx is None:
-                continue
-                
-            times = PAIR_TIMES.get(lesson["pair_number"])
-            if not times:
-                continue
-                
-            # Iterate through all weeks for this lesson
-            for week_num in range(week_start_num, week_end_num + 1):
-                # Calculate actual date
-                # Week 1 starts at SEMESTER_START
-                # Add (week_num - 1) weeks
-                # Add day_idx days
-                
-                lesson_date = SEMESTER_START + timedelta(weeks=week_num-1, days=day_idx)
-                
-                # Combine with time
-                start_h, start_m = map(int, times[0].split(":"))
-                end_h, end_m = map(int, times[1].split(":"))
-                
-                dt_start = lesson_date.replace(hour=start_h, minute=start_m)
-                dt_end = lesson_date.replace(hour=end_h, minute=end_m)
-                
-                # Format for ICS
-                ts_start = dt_start.strftime("%Y%m%dT%H%M%S")
-                ts_end = dt_end.strftime("%Y%m%dT%H%M%S")
-                
-                event = [
-                    "BEGIN:VEVENT",
-                    f"DTSTART:{ts_start}",
-                    f"DTEND:{ts_end}",
-                    f"SUMMARY:{lesson['subject']} ({lesson['lesson_type']})",
-                    f"DESCRIPTION:Преподаватель: {lesson['teacher']}",
-                    f"LOCATION:{lesson['room']}",
-                    f"UID:{lesson['id']}-{week_num}@mxt223.com",
-                    "END:VEVENT"
-                ]
-                cal_content.extend(event)
-                
-        cal_content.append("END:VCALENDAR")
-        
-        return Response(content="\n".join(cal_content), media_type="text/calendar")
-        
+        return Response(content=await schedule_feed(), media_type="text/calendar")
+    except Exception as e:
+        logger.exception("calendar.ics error")
+        return Response(content=f"Error: {str(e)}", status_code=500)
+
+
+@router.get("/calendar/link")
+async def get_calendar_link(user: dict = Depends(get_current_user)):
+    """Personal subscription URL: favorite subjects + the user's exams."""
+    from utils.jwt import create_calendar_token
+    return {"url": f"/api/calendar/{create_calendar_token(user['telegram_id'])}.ics"}
+
+
+def _calendar_owner(token: str) -> Optional[str]:
+    """telegram_id a personal calendar token was issued to (None if it is invalid)."""
+    from utils.jwt import verify_token
+    payload = verify_token(token, "calendar")
+    return str(payload["sub"]) if payload and payload.get("sub") else None
+
+
+def _user_calendar_tags(token: str) -> Optional[tuple]:
+    owner = _calendar_owner(token)
+    return user_feed_tags(owner) if owner else None
+
+
+@router.get("/calendar/{token}.ics")
+@conditional(tags=_user_calendar_tags)
+async def get_user_calendar_ics(token: str):
+    """Personal ICS feed; the token from /calendar/link identifies the user."""
+    owner = _calendar_owner(token)
+    if not owner:
+        raise HTTPException(status_code=404, detail="Calendar not found")
+    try:
+        return Response(content=await user_feed(owner), media_type="text/calendar")
     except Exception as e:
+        logger.exception("personal calendar error")
         return Response(content=f"Error: {str(e)}", status_code=500)
 
 @router.get("/debug/seed")
@@ -536,9 +473,12 @@ async def debug_seed_schedule():
         # Re-create tables with correct schema and seed data
         await init_db()
         
-        # Clear cache AGGRESSIVELY
+        # Clear cache AGGRESSIVELY (after the new snapshot is in, so new ETags get new bodies)
+        await refresh_schedule()
         from utils.cache import clear_cache
-        clear_cache()
+        await clear_cache()
+        from app.principal import invalidate_principal
+        await invalidate_principal()
         
         return {"status": "ok", "seeded": 29}
     except Exception as e:
@@ -574,6 +514,8 @@ async def debug_migrate_admin():
             messages.append(f"Column creation skipped (probably exists): {e}")
 
         await database.execute("UPDATE students SET is_admin = TRUE WHERE telegram_id = '1214641616'")
+        from app.principal import invalidate_principal
+        await invalidate_principal("1214641616")
         messages.append("Promoted telegram_id 1214641616 to admin")
 
         return {"status": "ok", "messages": messages}
@@ -611,6 +553,8 @@ async def debug_promote_me(authorization: str = Header(None)):
             "UPDATE students SET is_admin = TRUE WHERE telegram_id = :tid",
             {"tid": str(telegram_id)},
         )
+        from app.principal import invalidate_principal
+        await invalidate_principal(str(telegram_id))
         row = await database.fetch_one(
             "SELECT name FROM students WHERE telegram_id = :tid",
             {"tid": str(telegram_id)},
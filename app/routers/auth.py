@@ -1,6 +1,7 @@
 import re
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
 
 from app.config import (
     AVATAR_ALLOWED_PATTERN,
@@ -20,11 +21,23 @@ from app.models import (
     ResetPasswordRequest,
     TOTPVerifyRequest,
 )
+from app.principal import access_claims, invalidate_principal
 from app.rate_limit import check_rate_limit, check_rate_limit_user
+from utils.auth import PasswordHasherBusy, is_password_hashed, password_hasher
 
 router = APIRouter(tags=["Auth"])
 
 
+def _hasher_busy() -> JSONResponse:
+    """503 when the password hashing pool is saturated (login burst): retry shortly."""
+    logger.warning("password_hasher_busy", extra={"pending": password_hasher.pending})
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "error": "Сервер перегружен, повторите через пару секунд"},
+        headers={"Retry-After": "2"},
+    )
+
+
 def _validate_avatar(avatar: str) -> None:
     if not avatar or len(avatar) > AVATAR_MAX_LENGTH:
         raise HTTPException(status_code=400, detail="Invalid avatar length")
@@ -47,6 +60,7 @@ async def update_avatar(data: dict, current_user: dict = Depends(get_current_use
             "UPDATE students SET avatar = :avatar WHERE telegram_id = :tid",
             {"avatar": avatar, "tid": current_user["telegram_id"]},
         )
+        await invalidate_principal(current_user["telegram_id"])
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -75,17 +89,65 @@ async def read_users_me(current_user: dict = Depends(get_current_user)):
     
     return response
 
+# Visit streak: same day keeps it, the day after the last visit extends it, a gap restarts it
+_RECORD_VISIT = """
+    UPDATE students SET
+        visit_streak = CASE
+            WHEN last_visit_date = :today THEN COALESCE(visit_streak, 0)
+            WHEN last_visit_date = :yesterday THEN COALESCE(visit_streak, 0) + 1
+            ELSE 1
+        END,
+        last_visit_date = :today,
+        password = COALESCE(:password, password)
+    WHERE telegram_id = :tid
+    RETURNING visit_streak
+"""
+_GRANT_ACHIEVEMENT = """
+    INSERT INTO user_achievements (user_identifier, achievement_key) VALUES (:uid, :k)
+    ON CONFLICT (user_identifier, achievement_key) DO NOTHING
+"""
+
+
+async def _record_login(student, new_hash) -> int:
+    """
+    Streak, rehashed password and achievements in one transaction (one UPDATE ... RETURNING
+    and one batched upsert). A repeat login on the same day writes nothing unless the
+    password needs rehashing. Returns the visit streak.
+    """
+    import datetime
+    today = datetime.date.today()
+    streak = student["visit_streak"] or 0
+    if student["last_visit_date"] == today.isoformat() and new_hash is None:
+        return streak
+    try:
+        async with database.transaction():
+            streak = await database.fetch_val(_RECORD_VISIT, {
+                "today": today.isoformat(),
+                "yesterday": (today - datetime.timedelta(days=1)).isoformat(),
+                "password": new_hash,
+                "tid": student["telegram_id"],
+            }) or 0
+            keys = ["first_login"] + (["streak_7"] if streak >= 7 else [])
+            await database.execute_many(_GRANT_ACHIEVEMENT, [{"uid": student["telegram_id"], "k": k} for k in keys])
+    except Exception:
+        # Gamification must not fail the login
+        logger.exception("login bookkeeping failed")
+    return streak
+
+
 @router.post("/login")
 async def login_student(http_request: Request, request: LoginRequest):
     """Authenticate student with telegram_id and password"""
     check_rate_limit(http_request)
     try:
-        from utils.auth import hash_password, is_password_hashed, verify_password
         from utils.jwt import create_access_token, create_refresh_token
         
-        # Get student with password hash
-        query = "SELECT telegram_id, name, password, totp_secret FROM students WHERE telegram_id = :telegram_id"
-        student = await database.fetch_one(query=query, values={"telegram_id": request.telegram_id})
+        # Everything login needs in one read: credentials, 2FA secret, streak
+        student = await database.fetch_one(
+            """SELECT telegram_id, name, is_admin, password, totp_secret, visit_streak, last_visit_date
+               FROM students WHERE telegram_id = :telegram_id""",
+            {"telegram_id": request.telegram_id},
+        )
         
         if not student:
             return {"success": False, "error": "Неверный ID или пароль"}
@@ -93,26 +155,15 @@ async def login_student(http_request: Request, request: LoginRequest):
         # Check if password is hashed or plain text (for backward compatibility during migration)
         if is_password_hashed(student["password"]):
             # New hashed password
-            if not verify_password(request.password, student["password"]):
+            if not await password_hasher.verify(request.password, student["password"]):
                 return {"success": False, "error": "Неверный ID или пароль"}
         else:
             # Old plain text password - check and migrate
             if student["password"] != request.password:
                 return {"success": False, "error": "Неверный ID или пароль"}
-            
-            # Migrate to hashed password
-            hashed = hash_password(request.password)
-            await database.execute(
-                "UPDATE students SET password = :password WHERE telegram_id = :telegram_id",
-                {"password": hashed, "telegram_id": request.telegram_id}
-            )
         
         # 2FA: if user has TOTP, require code in same request
-        row = await database.fetch_one(
-            "SELECT totp_secret FROM students WHERE telegram_id = :tid",
-            {"tid": request.telegram_id}
-        )
-        totp_secret = dict(row).get("totp_secret") if row else None
+        totp_secret = student["totp_secret"]
         if totp_secret:
             if not request.totp_code or len(request.totp_code.strip()) != 6:
                 return {"success": False, "error": "Введите 6-значный код из приложения", "require_totp": True}
@@ -121,49 +172,20 @@ async def login_student(http_request: Request, request: LoginRequest):
             if not totp.verify(request.totp_code.strip(), valid_window=1):
                 return {"success": False, "error": "Неверный код"}
 
+        # Plain text (old accounts) or made with another bcrypt cost: store a hash at the current cost
+        new_hash = None
+        if password_hasher.needs_rehash(student["password"]):
+            new_hash = await password_hasher.hash(request.password)
+
         refresh_days = REMEMBER_ME_REFRESH_DAYS if getattr(request, "remember_me", False) else None
-        access_token = create_access_token({"sub": student["telegram_id"]})
+        access_token = create_access_token(access_claims(student))
         refresh_token = create_refresh_token(
             {"sub": student["telegram_id"]},
             days=refresh_days,
         )
         logger.info("login_success", extra={"user_id": student["telegram_id"]})
-        
-        # Gamification: Update Visit Streak
-        import datetime
-        today_str = datetime.date.today().isoformat()
-        
-        # Fetch current streak info
-        streak_row = await database.fetch_one(
-            "SELECT visit_streak, last_visit_date FROM students WHERE telegram_id = :tid",
-            {"tid": student["telegram_id"]}
-        )
-        if streak_row:
-            current_streak = streak_row["visit_streak"] or 0
-            last_visit = streak_row["last_visit_date"]
-            
-            if last_visit != today_str:
-                if last_visit:
-                    last_visit_date = datetime.date.fromisoformat(last_visit)
-                    if (datetime.date.today() - last_visit_date).days == 1:
-                        current_streak += 1
-                    else:
-                        current_streak = 1 # Reset streak
-                else:
-                    current_streak = 1
-                
-                await database.execute(
-                    "UPDATE students SET visit_streak = :streak, last_visit_date = :today WHERE telegram_id = :tid",
-                    {"streak": current_streak, "today": today_str, "tid": student["telegram_id"]}
-                )
-
-        try:
-            from app.routers.extras import _grant_achievement
-            await _grant_achievement(student["telegram_id"], "first_login")
-            if current_streak >= 7:
-                await _grant_achievement(student["telegram_id"], "streak_7")
-        except Exception:
-            pass
+
+        current_streak = await _record_login(student, new_hash)
 
         return {
             "success": True,
@@ -174,8 +196,10 @@ async def login_student(http_request: Request, request: LoginRequest):
                 "telegram_id": student["telegram_id"],
                 "name": student["name"]
             },
-            "streak": current_streak if 'current_streak' in locals() else 0
+            "streak": current_streak
         }
+    except PasswordHasherBusy:
+        return _hasher_busy()
     except Exception as e:
         logger.exception("Login error")
         return {"success": False, "error": f"Ошибка сервера: {str(e)}"}
@@ -196,15 +220,15 @@ async def refresh_access_token(http_request: Request, request: RefreshTokenReque
         
         # Verify user still exists
         student = await database.fetch_one(
-            "SELECT telegram_id, name FROM students WHERE telegram_id = :telegram_id",
+            "SELECT telegram_id, name, is_admin FROM students WHERE telegram_id = :telegram_id",
             {"telegram_id": telegram_id}
         )
         
         if not student:
             raise HTTPException(status_code=401, detail="User not found")
         
-        # Generate new tokens
-        new_access_token = create_access_token({"sub": telegram_id})
+        # Generate new tokens (fresh name / is_admin claims)
+        new_access_token = create_access_token(access_claims(student))
         new_refresh_token = create_refresh_token({"sub": telegram_id})
         
         return {
@@ -228,9 +252,6 @@ async def change_password(
     if not authorization:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
-        from fastapi.responses import JSONResponse
-
-        from utils.auth import hash_password, is_password_hashed, verify_password
         from utils.jwt import verify_token
 
         token = authorization.replace("Bearer ", "")
@@ -257,17 +278,18 @@ async def change_password(
         
         # Verify old password (support both hashed and plain text)
         if is_password_hashed(student["password"]):
-            if not verify_password(request.old_password, student["password"]):
+            if not await password_hasher.verify(request.old_password, student["password"]):
                 return {"success": False, "error": "Неверный старый пароль"}
         else:
             if student["password"] != request.old_password:
                 return {"success": False, "error": "Неверный старый пароль"}
         
         # Hash new password
-        hashed_new_password = hash_password(request.new_password)
+        hashed_new_password = await password_hasher.hash(request.new_password)
         
         update_query = "UPDATE students SET password = :new_password WHERE telegram_id = :telegram_id"
         await database.execute(query=update_query, values={"new_password": hashed_new_password, "telegram_id": telegram_id})
+        await invalidate_principal(telegram_id)
         logger.info("password_changed", extra={"user_id": telegram_id})
 
         body = {"success": True, "message": "Пароль успешно изменён"}
@@ -276,6 +298,8 @@ async def change_password(
         return body
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        return _hasher_busy()
     except Exception as e:
         logger.exception("Password change error")
         raise HTTPException(status_code=500, detail="Server error") from e
@@ -374,18 +398,21 @@ async def reset_password(req: ResetPasswordRequest):
     """Set new password using reset token."""
     from datetime import datetime
 
-    from utils.auth import hash_password
     row = await database.fetch_one(
         "SELECT telegram_id, expires_at FROM password_reset_tokens WHERE token = :t",
         {"t": req.token}
     )
     if not row or (row["expires_at"] and row["expires_at"] < datetime.utcnow()):
         raise HTTPException(status_code=400, detail="Ссылка недействительна или истекла")
-    hashed = hash_password(req.new_password)
+    try:
+        hashed = await password_hasher.hash(req.new_password)
+    except PasswordHasherBusy:
+        return _hasher_busy()
     await database.execute(
         "UPDATE students SET password = :p WHERE telegram_id = :tid",
         {"p": hashed, "tid": row["telegram_id"]}
     )
     await database.execute("DELETE FROM password_reset_tokens WHERE token = :t", {"t": req.token})
+    await invalidate_principal(row["telegram_id"])
     logger.info("password_reset_done", extra={"telegram_id": row["telegram_id"]})
     return {"success": True, "message": "Пароль изменён. Войдите с новым паролем."}
@@ -3,13 +3,17 @@ import json
 from datetime import date
 from typing import Optional
 
-from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel
 
 from app.database import database
+from app.dependencies import get_optional_user_id
+from app.http_cache import conditional
 from app.logging_config import logger
 from app.models import DailyStatusCreate
+from app.pagination import MAX_LIMIT, UNPAGED_LIMIT, fetch_page, is_paged
 from app.sanitize import sanitize_text
+from utils.cache import cached, invalidate
 
 router = APIRouter(tags=["Extras"])
 
@@ -32,20 +36,11 @@ async def get_daily_statuses():
 @router.post("/status")
 async def post_daily_status(
     body: DailyStatusCreate,
-    authorization: str = Header(None),
+    user_id: Optional[str] = Depends(get_optional_user_id),
 ):
     """Post or update a status for today."""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    from utils.jwt import is_jwt_token, verify_token
-    token = authorization.replace("Bearer ", "")
-    user_id = None
-    if is_jwt_token(token):
-        payload = verify_token(token, "access")
-        if payload:
-            user_id = payload.get("sub")
     if not user_id:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
     today = date.today().isoformat()
     text = sanitize_text(body.status_text, max_length=100) if body.status_text else None
@@ -80,17 +75,9 @@ def _visitor_id(request: Request, auth_user_id: Optional[str]) -> str:
 @router.get("/stats/visitors")
 async def get_visitors_today(
     request: Request,
-    authorization: str = Header(None),
+    user_id: Optional[str] = Depends(get_optional_user_id),
 ):
     """Record current visitor for today and return unique count. Call once per session."""
-    user_id = None
-    if authorization:
-        from utils.jwt import is_jwt_token, verify_token
-        token = (authorization or "").replace("Bearer ", "")
-        if is_jwt_token(token):
-            payload = verify_token(token, "access")
-            if payload:
-                user_id = payload.get("sub")
     vid = _visitor_id(request, user_id)
     today = date.today().isoformat()
     try:
@@ -121,23 +108,37 @@ class PollVote(BaseModel):
     option_index: int
 
 
+def _poll_item(r) -> dict:
+    try:
+        opts = json.loads(r["options_json"]) if isinstance(r["options_json"], str) else r["options_json"]
+    except Exception:
+        opts = []
+    return {"id": r["id"], "question": r["question"], "options": opts, "created_at": str(r["created_at"])}
+
+
 @router.get("/polls")
-async def list_polls():
-    """List active polls."""
-    rows = await database.fetch_all(
-        "SELECT id, question, options_json, created_at FROM polls WHERE active = TRUE ORDER BY created_at DESC"
+@conditional(tags=("polls",))
+@cached(tags=("polls",))
+async def list_polls(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+):
+    """List active polls. With limit/cursor/with_total — {items, next_cursor[, total]}."""
+    paged = is_paged(limit, cursor, with_total)
+    page = await fetch_page(
+        "id, question, options_json, created_at", "polls",
+        where=("active = TRUE",),
+        limit=limit if paged else UNPAGED_LIMIT,
+        offset=offset, cursor=cursor, with_total=with_total, row_to_item=_poll_item,
     )
-    out = []
-    for r in rows:
-        try:
-            opts = json.loads(r["options_json"]) if isinstance(r["options_json"], str) else r["options_json"]
-        except Exception:
-            opts = []
-        out.append({"id": r["id"], "question": r["question"], "options": opts, "created_at": str(r["created_at"])})
-    return out
+    return page if paged else page["items"]
 
 
 @router.get("/polls/{poll_id}/results")
+@conditional(tags=("polls",))
+@cached(tags=("polls",))
 async def poll_results(poll_id: int):
     """Get vote counts per option for a poll."""
     poll = await database.fetch_one("SELECT id, question, options_json FROM polls WHERE id = :id", {"id": poll_id})
@@ -160,17 +161,9 @@ async def vote_poll(
     poll_id: int,
     body: PollVote,
     request: Request,
-    authorization: str = Header(None),
+    user_id: Optional[str] = Depends(get_optional_user_id),
 ):
     """Vote for an option (one vote per user/identifier per poll)."""
-    user_id = None
-    if authorization:
-        from utils.jwt import is_jwt_token, verify_token
-        token = (authorization or "").replace("Bearer ", "")
-        if is_jwt_token(token):
-            payload = verify_token(token, "access")
-            if payload:
-                user_id = payload.get("sub")
     vid = _visitor_id(request, user_id)
     poll = await database.fetch_one("SELECT id, options_json FROM polls WHERE id = :id AND active = TRUE", {"id": poll_id})
     if not poll:
@@ -185,6 +178,7 @@ async def vote_poll(
         )
     except Exception as e:
         raise HTTPException(status_code=400, detail="Already voted") from e
+    await invalidate("polls")
     return {"success": True}
 
 
@@ -194,30 +188,37 @@ class CommentCreate(BaseModel):
     body: str
 
 
+def _comment_item(r) -> dict:
+    return {"id": r["id"], "user_identifier": r["user_identifier"][:3] + "***", "body": r["body"], "created_at": str(r["created_at"])}
+
+
 @router.get("/announcement/{announcement_id}/comments")
-async def get_announcement_comments(announcement_id: int):
-    rows = await database.fetch_all(
-        """SELECT id, user_identifier, body, created_at FROM announcement_comments
-           WHERE announcement_id = :aid ORDER BY created_at ASC""",
-        {"aid": announcement_id},
+@cached(tags=("announcements",))
+async def get_announcement_comments(
+    announcement_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+):
+    """Comments oldest first. With limit/cursor/with_total — {items, next_cursor[, total]}."""
+    paged = is_paged(limit, cursor, with_total)
+    page = await fetch_page(
+        "id, user_identifier, body, created_at", "announcement_comments",
+        where=("announcement_id = :aid",), values={"aid": announcement_id}, descending=False,
+        limit=limit if paged else UNPAGED_LIMIT,
+        offset=offset, cursor=cursor, with_total=with_total, row_to_item=_comment_item,
     )
-    return [{"id": r["id"], "user_identifier": r["user_identifier"][:3] + "***", "body": r["body"], "created_at": str(r["created_at"])} for r in rows]
+    return page if paged else page["items"]
 
 
 @router.post("/announcement/comments")
 async def post_announcement_comment(
     body: CommentCreate,
     request: Request,
-    authorization: str = Header(None),
+    user_id: Optional[str] = Depends(get_optional_user_id),
 ):
-    user_id = "anonymous"
-    if authorization:
-        from utils.jwt import is_jwt_token, verify_token
-        token = (authorization or "").replace("Bearer ", "")
-        if is_jwt_token(token):
-            payload = verify_token(token, "access")
-            if payload:
-                user_id = payload.get("sub")
+    user_id = user_id or "anonymous"
     text = sanitize_text(body.body, max_length=500)
     if not text:
         raise HTTPException(status_code=400, detail="Текст комментария обязателен")
@@ -225,23 +226,30 @@ async def post_announcement_comment(
         "INSERT INTO announcement_comments (announcement_id, user_identifier, body) VALUES (:aid, :uid, :body)",
         {"aid": body.announcement_id, "uid": user_id, "body": text},
     )
+    await invalidate("announcements")
     return {"success": True}
 
 
 # ----- Materials per subject -----
 @router.get("/materials")
-async def get_materials(subject: Optional[str] = None):
-    """List materials; filter by subject if given."""
-    if subject:
-        rows = await database.fetch_all(
-            "SELECT id, subject_name, title, url, created_at FROM subject_materials WHERE subject_name = :s ORDER BY created_at DESC",
-            {"s": subject},
-        )
-    else:
-        rows = await database.fetch_all(
-            "SELECT id, subject_name, title, url, created_at FROM subject_materials ORDER BY created_at DESC"
-        )
-    return [dict(r) for r in rows]
+@cached(tags=("materials",))
+async def get_materials(
+    subject: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    with_total: bool = False,
+):
+    """List materials, newest first; filter by subject if given.
+    With limit/cursor/with_total — {items, next_cursor[, total]}."""
+    paged = is_paged(limit, cursor, with_total)
+    page = await fetch_page(
+        "id, subject_name, title, url, created_at", "subject_materials",
+        where=("subject_name = :s",) if subject else (), values={"s": subject} if subject else None,
+        limit=limit if paged else UNPAGED_LIMIT,
+        offset=offset, cursor=cursor, with_total=with_total,
+    )
+    return page if paged else page["items"]
 
 
 # ----- Achievements -----
@@ -254,16 +262,8 @@ ACHIEVEMENTS_DEF = [
 
 
 @router.get("/achievements/me")
-async def my_achievements(authorization: str = Header(None)):
+async def my_achievements(user_id: Optional[str] = Depends(get_optional_user_id)):
     """Return achievements unlocked by current user."""
-    user_id = None
-    if authorization:
-        from utils.jwt import is_jwt_token, verify_token
-        token = (authorization or "").replace("Bearer ", "")
-        if is_jwt_token(token):
-            payload = verify_token(token, "access")
-            if payload:
-                user_id = payload.get("sub")
     if not user_id:
         return {"achievements": []}
     rows = await database.fetch_all(
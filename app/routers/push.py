@@ -1,54 +1,55 @@
-import json
+import asyncio
+import time
+from typing import Optional
 
-from fastapi import APIRouter, BackgroundTasks, Depends, Header
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import JSONResponse
-from pywebpush import WebPushException, webpush
 
-from app.config import VAPID_CLAIM_EMAIL, VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY
-from app.database import database
-from app.dependencies import require_admin
+from app.config import (
+    SCHEDULE_PUSH_DEBOUNCE_SECONDS,
+    SCHEDULE_PUSH_MAX_DELAY_SECONDS,
+    VAPID_PRIVATE_KEY,
+    VAPID_PUBLIC_KEY,
+)
+from app.dependencies import get_optional_user_id, require_admin
 from app.logging_config import logger
+from app.push_audience import parse_audience, resolve_audience
+from app.push_delivery import build_payload
+from app.push_jobs import queue, report
+from app.push_registry import subscribe, unsubscribe
 
 router = APIRouter(tags=["Push"])
 
 @router.post("/subscribe")
-async def subscribe_push(data: dict, authorization: str = Header(None)):
+async def subscribe_push(data: dict, user_id: Optional[str] = Depends(get_optional_user_id)):
     """Subscribe to push notifications"""
     try:
-        # Require auth to link to student (optional, but good for tracking)
-        student_id = "anonymous"
-        if authorization:
-            from utils.jwt import is_jwt_token, verify_token
-            token = authorization.replace("Bearer ", "")
-            if is_jwt_token(token):
-                payload = verify_token(token, "access")
-                if payload:
-                    student_id = payload.get("sub")
-            else:
-                student_id = token
-
-        # Store subscription
-        subscription_json = json.dumps(data)
-        
-        check_query = "SELECT id FROM push_subscriptions WHERE student_id = :sid"
-        existing = await database.fetch_one(query=check_query, values={"sid": student_id})
-        
-        if existing:
-            await database.execute(
-                "UPDATE push_subscriptions SET subscription_data = :data WHERE student_id = :sid",
-                {"data": subscription_json, "sid": student_id}
-            )
-        else:
-            await database.execute(
-                "INSERT INTO push_subscriptions (student_id, subscription_data) VALUES (:sid, :data)",
-                {"sid": student_id, "data": subscription_json}
-            )
+        # Signed in: linked to the student (personal and group pushes), else anonymous
+        student_id = user_id or "anonymous"
+        try:
+            await subscribe(student_id, data)
+        except ValueError as e:
+            return {"success": False, "error": f"Некорректная подписка: {e}"}
         logger.info("push_subscribed", extra={"student_id": student_id})
         return {"success": True}
     except Exception as e:
         logger.exception("Subscribe error")
         return {"success": False, "error": str(e)}
 
+@router.post("/unsubscribe")
+async def unsubscribe_push(data: dict):
+    """Forget this device's subscription (the endpoint URL identifies it)."""
+    endpoint = data.get("endpoint")
+    if not endpoint:
+        return {"success": False, "error": "endpoint обязателен"}
+    try:
+        removed = await unsubscribe(endpoint)
+    except Exception as e:
+        logger.exception("Unsubscribe error")
+        return {"success": False, "error": str(e)}
+    return {"success": True, "removed": removed}
+
+
 @router.get("/push/config")
 async def get_push_config():
     """Return VAPID Public Key for frontend. If not configured, returns 200 with vapid_public_key: null."""
@@ -57,93 +58,117 @@ async def get_push_config():
         "configured": bool(VAPID_PUBLIC_KEY and VAPID_PRIVATE_KEY),
     }
 
-async def _send_push_to_all(title: str, body: str, url: str = "/"):
-    """Send one push to all subscriptions. Used by admin push and schedule-changed."""
+async def _send_push(title: str, body: str, url: str = "/", audience: str = "all", value=None,
+                     kind: str = "admin", **options):
+    """
+    Queue one push to an audience (see push_audience) as a job in the outbox.
+    Returns (job_id, queued), None on error. options (ttl, headers, topic) go to push_outbox.enqueue.
+    """
     if not VAPID_PRIVATE_KEY:
-        return
-    payload = json.dumps({
-        "title": title,
-        "body": body,
-        "url": url,
-        "icon": "/static/icons/icon-192x192.png",
-    })
+        return None
     try:
-        rows = await database.fetch_all("SELECT * FROM push_subscriptions")
-        for row in rows:
-            try:
-                sub = json.loads(row["subscription_data"])
-                webpush(
-                    subscription_info=sub,
-                    data=payload,
-                    vapid_private_key=VAPID_PRIVATE_KEY,
-                    vapid_claims={"sub": VAPID_CLAIM_EMAIL},
-                )
-            except WebPushException as ex:
-                if ex.response and ex.response.status_code in [404, 410]:
-                    await database.execute("DELETE FROM push_subscriptions WHERE id = :id", {"id": row["id"]})
-            except Exception:
-                pass
+        subscription_ids = await resolve_audience(audience, value)
+        return await queue(kind, subscription_ids, build_payload(title, body, url), audience=audience, **options)
     except Exception as e:
-        logger.exception("_send_push_to_all: %s", e)
+        logger.exception("_send_push: %s", e)
+        return None
+
+
+# Collapse key of "Расписание обновилось": a newer one replaces one not yet delivered, in the
+# outbox and at the push service (device offline). So the body must not list edits: whatever
+# it said about earlier ones would be lost with the message it replaced
+SCHEDULE_TOPIC = "schedule-changed"
+SCHEDULE_PUSH_BODY = "Расписание обновилось"
+# Still worth showing to a device that comes back online within a day
+SCHEDULE_PUSH_TTL_SECONDS = 24 * 3600
 
+# Edits waiting for the debounced push: [(action, subject)]
+_schedule_changes: list = []
+_schedule_first_at = 0.0
+_schedule_timer: Optional[asyncio.TimerHandle] = None
+_schedule_tasks: set = set()
 
-async def notify_schedule_changed():
-    """Call after schedule add/delete to push 'Расписание обновилось'."""
-    await _send_push_to_all("МХТ-223", "Расписание обновилось", "/")
+
+async def notify_schedule_changed(action: Optional[str] = None, subject: Optional[str] = None):
+    """
+    Call after schedule add/delete. Edits are collected and one "Расписание обновилось" push
+    goes out once SCHEDULE_PUSH_DEBOUNCE_SECONDS pass without another edit (at most
+    SCHEDULE_PUSH_MAX_DELAY_SECONDS after the first one).
+    """
+    global _schedule_first_at, _schedule_timer
+    if not VAPID_PRIVATE_KEY:
+        return
+    now = time.time()
+    if not _schedule_changes:
+        _schedule_first_at = now
+    _schedule_changes.append((action, subject))
+    if _schedule_timer is not None:
+        _schedule_timer.cancel()
+    delay = min(SCHEDULE_PUSH_DEBOUNCE_SECONDS, _schedule_first_at + SCHEDULE_PUSH_MAX_DELAY_SECONDS - now)
+    _schedule_timer = asyncio.get_running_loop().call_later(max(0.0, delay), _flush_schedule_soon)
+
+
+def _flush_schedule_soon() -> None:
+    task = asyncio.ensure_future(flush_schedule_changes())
+    _schedule_tasks.add(task)
+    task.add_done_callback(_schedule_tasks.discard)
+
+
+async def flush_schedule_changes() -> Optional[tuple]:
+    """Queue the collected edits as one push now (debounce timer, app shutdown). Returns (job_id, queued)."""
+    global _schedule_timer
+    if _schedule_timer is not None:
+        _schedule_timer.cancel()
+        _schedule_timer = None
+    if not _schedule_changes:
+        return None
+    subjects = sorted({subject for _, subject in _schedule_changes if subject})
+    logger.info("schedule push: %d edits (%s)", len(_schedule_changes), ", ".join(subjects) or "-")
+    _schedule_changes.clear()
+    return await _send_push(
+        "МХТ-223", SCHEDULE_PUSH_BODY, "/", kind="schedule_changed",
+        ttl=SCHEDULE_PUSH_TTL_SECONDS, headers={"Urgency": "normal"}, topic=SCHEDULE_TOPIC,
+    )
 
 
 @router.post("/admin/push")
-async def send_push_notification(
-    data: dict, background_tasks: BackgroundTasks, user: dict = Depends(require_admin)
-):
-    """Queue push to all subscribers; returns immediately (202). Sending runs in background."""
+async def send_push_notification(data: dict, user: dict = Depends(require_admin)):
+    """
+    Queue push in the outbox; returns immediately (202). The outbox worker sends.
+    audience: all (default) | exam_reminder (value: exam id) | favorite_subject (value: subject) | admins.
+    """
     if not VAPID_PRIVATE_KEY:
         return {"success": False, "error": "VAPID key not configured"}
     message = data.get("message", "Новое уведомление")
     title = data.get("title", "МХТ-223")
     url = data.get("url", "/")
-    payload = json.dumps({
-        "title": title,
-        "body": message,
-        "url": url,
-        "icon": "/static/icons/icon-192x192.png",
-    })
-    # Run sending in background so admin gets fast response
-    async def send_in_background():
-        try:
-            query = "SELECT * FROM push_subscriptions"
-            rows = await database.fetch_all(query=query)
-            sent = failed = removed = 0
-            for row in rows:
-                try:
-                    sub = json.loads(row["subscription_data"])
-                    webpush(
-                        subscription_info=sub,
-                        data=payload,
-                        vapid_private_key=VAPID_PRIVATE_KEY,
-                        vapid_claims={"sub": VAPID_CLAIM_EMAIL},
-                    )
-                    sent += 1
-                except WebPushException as ex:
-                    if ex.response and ex.response.status_code in [404, 410]:
-                        await database.execute(
-                            "DELETE FROM push_subscriptions WHERE id = :id",
-                            {"id": row["id"]},
-                        )
-                        removed += 1
-                    else:
-                        failed += 1
-                except Exception:
-                    failed += 1
-            logger.info("Push finished: sent=%s failed=%s removed=%s", sent, failed, removed)
-        except Exception as e:
-            logger.exception("Background push failed: %s", e)
-    background_tasks.add_task(send_in_background)
+    try:
+        audience, value = parse_audience(data.get("audience"), data.get("value"))
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+
+    job = await _send_push(title, message, url, audience, value)
+    if job is None:
+        return {"success": False, "error": "Не удалось поставить рассылку в очередь"}
+    job_id, queued = job
+    logger.info("Push queued: %s subscriptions (audience=%s, job=%s)", queued, audience, job_id)
     return JSONResponse(
         status_code=202,
         content={
             "success": True,
             "status": "accepted",
+            "job_id": job_id,
+            "audience": audience,
+            "queued": queued,
             "message": "Отправка запущена в фоне",
         },
     )
+
+
+@router.get("/admin/push/{job_id}")
+async def get_push_job(job_id: str, user: dict = Depends(require_admin)):
+    """Progress of a broadcast: counts per status, duration, encryption time, latency and errors per push service."""
+    job = await report(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Рассылка не найдена")
+    return job
@@ -7,6 +7,9 @@ from pydantic import BaseModel
 from app.config import SEMESTER_START
 from app.database import database
 from app.dependencies import get_current_user
+from app.http_cache import Fallback, conditional
+from app.logging_config import logger
+from utils.cache import cached, invalidate
 
 router = APIRouter(prefix="/ratings", tags=["Ratings"])
 
@@ -39,6 +42,7 @@ async def submit_rating(data: RatingRequest, user: dict = Depends(get_current_us
         "lesson_date": data.date,
     }
     await database.execute(query=query, values=values)
+    await invalidate("ratings")
     
     # Gamification: Check if user has rated 5 subjects
     try:
@@ -97,6 +101,8 @@ async def get_my_ratings(user: dict = Depends(get_current_user)):
     return {"ratings": list_out, "by_week": by_week}
 
 @router.get("/leaderboard")
+@conditional(tags=("ratings",))
+@cached(tags=("ratings",))
 async def get_leaderboard():
     # Only subjects with > 0 ratings
     query = """
@@ -117,6 +123,7 @@ async def get_leaderboard():
 
 
 @router.get("/subject-summary")
+@cached(tags=("ratings",))
 async def get_subject_summary(subject: str = None):
     """Average rating, top tags, and recent reviews for a subject."""
     if not subject or not subject.strip():
@@ -149,4 +156,5 @@ async def get_subject_summary(subject: str = None):
 
         return {"average": average, "count": count, "top_tags": top_tags, "reviews": reviews}
     except Exception:
-        return {"average": None, "count": 0, "top_tags": [], "reviews": []}
+        logger.exception("Subject summary error")
+        raise Fallback({"average": None, "count": 0, "top_tags": [], "reviews": []}) from None
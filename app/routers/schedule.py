@@ -1,53 +1,81 @@
-from fastapi import APIRouter, Query
+from datetime import date as date_type
+from typing import Optional
 
-from app.database import database
+from fastapi import APIRouter, HTTPException, Query, Response
+
+from app.config import SEMESTER_START
+from app.http_cache import Fallback, conditional
 from app.logging_config import logger
+from app.schedule_store import get_snapshot, refresh_schedule
 from app.schemas import ScheduleResponse
 
 router = APIRouter(tags=["Schedule"])
 
-def _row_to_item(row):
-    return {
-        "id": row["id"],
-        "day": row["day_of_week"],
-        "pair": row["pair_number"],
-        "subject": row["subject"],
-        "type": row["lesson_type"],
-        "teacher": row["teacher"],
-        "room": row["room"],
-        "weeks": [row["week_start"], row["week_end"]],
-    }
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+MAX_WEEK = 60
+
+
+def _resolve_window(week: Optional[int], day: Optional[str], date: Optional[str]):
+    """(week, day) to filter by; date=YYYY-MM-DD sets both (week counted from SEMESTER_START)."""
+    if day is not None:
+        day = day.lower()
+        if day not in WEEKDAYS:
+            raise HTTPException(status_code=422, detail="day: ожидается monday..sunday")
+    if date is not None:
+        try:
+            d = date_type.fromisoformat(date)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="date: ожидается YYYY-MM-DD") from None
+        week = (d - SEMESTER_START.date()).days // 7 + 1
+        day = WEEKDAYS[d.weekday()]
+    return week, day
+
 
 @router.get(
     "/schedule",
     summary="Список занятий",
-    description="С limit/offset — объект {items, total, limit, offset}. Без параметров — массив (обратная совместимость).",
+    description=(
+        "Фильтры: week (номер недели семестра), day (monday..sunday), date (YYYY-MM-DD — задаёт и неделю, и день). "
+        "С limit/offset — объект {items, total, limit, offset}. Без параметров — массив (обратная совместимость)."
+    ),
 )
+@conditional(tags=("schedule",))
 async def get_schedule(
     limit: int = Query(None, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    week: Optional[int] = Query(None, ge=1, le=MAX_WEEK),
+    day: Optional[str] = Query(None),
+    date: Optional[str] = Query(None),
 ):
+    week, day = _resolve_window(week, day, date)
     try:
-        query = "SELECT * FROM schedule ORDER BY pair_number"
-        rows = await database.fetch_all(query=query)
-        total = len(rows)
+        snapshot = await get_snapshot()
+        if not snapshot.loaded:
+            raise Fallback([] if limit is None else ScheduleResponse(items=[], total=0, limit=limit, offset=offset))
+        if week is not None and not 1 <= week <= MAX_WEEK:
+            # Date outside the semester: nothing scheduled
+            return [] if limit is None else ScheduleResponse(items=[], total=0, limit=limit, offset=offset)
         if limit is not None:
-            rows = rows[offset : offset + limit]
-            items = [_row_to_item(row) for row in rows]
+            if week is None and day is None:
+                items, total = snapshot.items[offset : offset + limit], len(snapshot.items)
+            else:
+                lessons = snapshot.filter(week, day)
+                items, total = [lesson.to_item() for lesson in lessons[offset : offset + limit]], len(lessons)
             return ScheduleResponse(items=items, total=total, limit=limit, offset=offset)
-        # Backward compat: return plain array
-        return [_row_to_item(row) for row in rows]
+        # Backward compat: return plain array (serialized once per snapshot and filter window)
+        return Response(content=snapshot.filtered_json(week, day), media_type="application/json")
+    except Fallback:
+        raise
     except Exception:
-        logger.exception("get_schedule DB error")
-        return [] if limit is None else ScheduleResponse(items=[], total=0, limit=limit, offset=offset)
+        logger.exception("get_schedule error")
+        raise Fallback([] if limit is None else ScheduleResponse(items=[], total=0, limit=limit, offset=offset)) from None
 
 @router.get("/debug/schedule-nocache")
 async def get_schedule_nocache():
-    """Returns schedule WITHOUT caching - for debugging."""
+    """Reloads the schedule snapshot from the DB and returns it - for debugging."""
     try:
-        query = "SELECT * FROM schedule ORDER BY pair_number"
-        rows = await database.fetch_all(query=query)
-        return [_row_to_item(row) for row in rows]
+        snapshot = await refresh_schedule()
+        return Response(content=snapshot.json_bytes, media_type="application/json")
     except Exception:
         logger.exception("schedule-nocache error")
         return []
@@ -0,0 +1,209 @@
+"""In-memory read model of the schedule table, shared by all schedule read paths.
+
+The table is loaded once into slotted Lesson records; derived views (API items,
+subjects aggregation, serialized JSON) are precomputed per snapshot. Writers call
+refresh_schedule() after changing the table, which swaps in a new snapshot atomically.
+"""
+import json
+import time
+from typing import Optional
+
+from app.config import CACHE_TTL_SECONDS
+from app.database import database
+from app.logging_config import logger
+from utils.cache import add_invalidation_listener, single_flight
+
+
+class Lesson:
+    """One schedule row. Slotted: the snapshot keeps every lesson for the whole process."""
+
+    __slots__ = ("id", "day", "pair", "subject", "type", "teacher", "room", "week_start", "week_end")
+
+    def __init__(self, id, day, pair, subject, type, teacher, room, week_start, week_end):
+        self.id = id
+        self.day = day
+        self.pair = pair
+        self.subject = subject
+        self.type = type
+        self.teacher = teacher
+        self.room = room
+        self.week_start = week_start
+        self.week_end = week_end
+
+    @classmethod
+    def from_row(cls, row) -> "Lesson":
+        return cls(
+            row["id"],
+            row["day_of_week"],
+            row["pair_number"],
+            row["subject"],
+            row["lesson_type"],
+            row["teacher"],
+            row["room"],
+            row["week_start"],
+            row["week_end"],
+        )
+
+    def is_active(self, week: int) -> bool:
+        return self.week_start <= week <= self.week_end
+
+    def to_item(self) -> dict:
+        return {
+            "id": self.id,
+            "day": self.day,
+            "pair": self.pair,
+            "subject": self.subject,
+            "type": self.type,
+            "teacher": self.teacher,
+            "room": self.room,
+            "weeks": [self.week_start, self.week_end],
+        }
+
+
+def _build_subjects(lessons: tuple) -> list:
+    """Aggregate lessons by subject (same shape /api/subjects always returned)."""
+    subjects = {}
+    for lesson in sorted(lessons, key=lambda x: x.subject):
+        data = subjects.get(lesson.subject)
+        if data is None:
+            data = subjects[lesson.subject] = {"name": lesson.subject, "types": [], "teachers": [], "rooms": []}
+        if lesson.type not in data["types"]:
+            data["types"].append(lesson.type)
+        if lesson.teacher and lesson.teacher != "Не указан" and lesson.teacher not in data["teachers"]:
+            data["teachers"].append(lesson.teacher)
+        if lesson.room and "*" not in lesson.room and lesson.room not in data["rooms"]:
+            data["rooms"].append(lesson.room)
+    return list(subjects.values())
+
+
+class ScheduleSnapshot:
+    """Immutable view of the schedule at one version. Never mutated after construction."""
+
+    __slots__ = (
+        "version", "loaded_at", "lessons", "by_day", "by_week", "items", "subjects", "json_bytes", "_filtered",
+    )
+
+    def __init__(self, version: int, lessons: tuple):
+        self.version = version
+        self.loaded_at = time.time()
+        self.lessons = lessons
+        by_day: dict[str, list] = {}
+        for lesson in lessons:
+            by_day.setdefault(lesson.day, []).append(lesson)
+        self.by_day = {day: tuple(items) for day, items in by_day.items()}
+        # Interval index over week_start..week_end: week -> lessons active that week (in pair order)
+        by_week: dict[int, list] = {}
+        for lesson in lessons:
+            for week in range(max(1, lesson.week_start), lesson.week_end + 1):
+                by_week.setdefault(week, []).append(lesson)
+        self.by_week = {week: tuple(items) for week, items in by_week.items()}
+        self.items = [lesson.to_item() for lesson in lessons]
+        self.subjects = _build_subjects(lessons)
+        self.json_bytes = json.dumps(self.items, ensure_ascii=False).encode("utf-8")
+        # Serialized (week, day) slices, filled lazily; derived data only, the lessons never change
+        self._filtered: dict = {}
+
+    @property
+    def loaded(self) -> bool:
+        """False for the empty stand-in returned when the schedule could not be read."""
+        return self.version > 0
+
+    def lessons_on(self, day: str, week: int) -> list:
+        """Lessons of one day active in the given semester week, ordered by pair."""
+        return [lesson for lesson in self.by_week.get(week, ()) if lesson.day == day]
+
+    def filter(self, week: Optional[int] = None, day: Optional[str] = None) -> tuple:
+        """Lessons active in a week and/or on a day; both None means the whole schedule."""
+        if week is None:
+            return self.by_day.get(day, ()) if day is not None else self.lessons
+        lessons = self.by_week.get(week, ())
+        if day is not None:
+            lessons = tuple(lesson for lesson in lessons if lesson.day == day)
+        return lessons
+
+    def filtered_json(self, week: Optional[int] = None, day: Optional[str] = None) -> bytes:
+        """JSON array for filter(week, day), serialized once per snapshot and window."""
+        if week is None and day is None:
+            return self.json_bytes
+        key = (week, day)
+        data = self._filtered.get(key)
+        if data is None:
+            items = [lesson.to_item() for lesson in self.filter(week, day)]
+            data = self._filtered[key] = json.dumps(items, ensure_ascii=False).encode("utf-8")
+        return data
+
+
+_EMPTY = ScheduleSnapshot(0, ())
+_snapshot: Optional[ScheduleSnapshot] = None
+# Every load takes the next version when it starts. A load publishes its snapshot only if
+# nothing newer was published and it started after the last invalidation (_min_version),
+# so a slow load that began before a write can never overwrite the post-write snapshot.
+_version = 0
+_min_version = 0
+# callback(snapshot) whenever a new snapshot is published (e.g. the reminder plan)
+_snapshot_listeners: list = []
+
+
+def add_snapshot_listener(callback) -> None:
+    """callback(snapshot) is called each time a newer snapshot replaces the current one."""
+    _snapshot_listeners.append(callback)
+
+
+def _invalidate() -> None:
+    global _snapshot, _min_version
+    _snapshot = None
+    _min_version = _version + 1
+
+
+async def _load() -> ScheduleSnapshot:
+    global _snapshot, _version
+    _version += 1
+    version = _version
+    rows = await database.fetch_all("SELECT * FROM schedule ORDER BY pair_number, id")
+    snapshot = ScheduleSnapshot(version, tuple(Lesson.from_row(r) for r in rows))
+    current = _snapshot
+    if version >= _min_version and (current is None or current.version < version):
+        _snapshot = snapshot
+        logger.info("schedule snapshot v%d loaded (%d lessons)", version, len(snapshot.lessons))
+        for callback in _snapshot_listeners:
+            try:
+                callback(snapshot)
+            except Exception:
+                logger.exception("schedule snapshot listener failed")
+    elif current is not None and current.version > version:
+        return current
+    return snapshot
+
+
+async def get_snapshot() -> ScheduleSnapshot:
+    """Current snapshot; loads on first use and re-checks the DB after CACHE_TTL_SECONDS
+    (bounds staleness when another worker process edited the schedule).
+    Concurrent readers that find it missing share one load (single-flight)."""
+    snapshot = _snapshot
+    if snapshot is not None and time.time() - snapshot.loaded_at < CACHE_TTL_SECONDS:
+        return snapshot
+    try:
+        return await single_flight(f"schedule:snapshot:{_min_version}", _load)
+    except Exception:
+        logger.exception("schedule snapshot load failed")
+        return snapshot or _EMPTY
+
+
+async def refresh_schedule() -> ScheduleSnapshot:
+    """Rebuild the snapshot from the DB. Call after any write to the schedule table."""
+    _invalidate()
+    try:
+        return await _load()
+    except Exception:
+        logger.exception("schedule snapshot refresh failed")
+        # The next read retries instead of serving stale data
+        return _EMPTY
+
+
+def _on_remote_invalidate(tags: tuple) -> None:
+    # Another worker changed the schedule: reload on the next read
+    if "schedule" in tags or "*" in tags:
+        _invalidate()
+
+
+add_invalidation_listener(_on_remote_invalidate)
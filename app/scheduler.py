@@ -1,19 +1,39 @@
-import json
+"""Reminder scheduler: today's pushes planned once, each fired by an asyncio timer.
+
+The plan (lesson reminders NOTIFY_BEFORE_LESSON_MINUTES before each pair, the 08:00 exam
+reminder) is computed from the schedule snapshot at midnight Tashkent time and whenever
+the schedule changes. Edits made through another worker reach this process only when its
+snapshot is reloaded, so the plan re-reads it every CACHE_TTL_SECONDS, and each lesson is
+re-read from the DB just before its reminder goes out. Entries sit in a heap ordered by fire time; a single loop.call_at
+timer is armed for the earliest one, so the process only wakes when something is due.
+With several workers or instances only the elected leader runs the plan (app/leader.py).
+"""
+import asyncio
+import heapq
+import itertools
 import logging
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import Optional
 
 import pytz
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-from pywebpush import WebPushException, webpush
 
 from app.config import (
+    CACHE_TTL_SECONDS,
+    LEADER_ELECTION,
     NOTIFY_BEFORE_LESSON_MINUTES,
     SEMESTER_START,
-    VAPID_CLAIM_EMAIL,
     VAPID_PRIVATE_KEY,
 )
 from app.database import database
+from app.leader import LeaderElector
+from app.metrics import inc_scheduler_misfire, observe_scheduler_run, set_scheduler_plan_entries
+from app.push_audience import exam_reminder_audiences, resolve_audience
+from app.push_delivery import build_payload
+from app.push_jobs import queue
+from app.schedule_store import Lesson, ScheduleSnapshot, add_snapshot_listener, get_snapshot
+from utils.cache import add_invalidation_listener
 
 
 def _row_to_dict(row):
@@ -42,86 +62,47 @@ PAIR_START_TIMES = {
     6: "15:30"
 }
 
-scheduler = AsyncIOScheduler()
-
 DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday"]
 
+# Daily exam reminder ("Завтра экзамен"), Tashkent time
+EXAM_REMINDER_TIME = (8, 0)
+# An entry found more than this late (event loop blocked, host suspended) is skipped as a misfire
+MISFIRE_GRACE_SECONDS = 120
 
-async def check_upcoming_lessons():
-    """Send push if a lesson starts in NOTIFY_BEFORE_LESSON_MINUTES. Runs every minute."""
-    now = datetime.now(TZ)
-    target_time = now + timedelta(minutes=NOTIFY_BEFORE_LESSON_MINUTES)
-    target_hour = target_time.hour
-    target_minute = target_time.minute
-
-    upcoming_pair = None
-    for pair_num, start_time in PAIR_START_TIMES.items():
-        h, m = map(int, start_time.split(':'))
-        if h == target_hour and m == target_minute:
-            upcoming_pair = pair_num
-            break
-    if not upcoming_pair:
-        return
 
-    day_idx = now.weekday()
-    if day_idx >= 5:
-        return
-    day_name = DAY_NAMES[day_idx]
-    delta = now.date() - SEMESTER_START.date()
-    week_num = max(1, (delta.days // 7) + 1)
-
-    query = """
-        SELECT * FROM schedule
-        WHERE day_of_week = :day
-        AND pair_number = :pair
-        AND week_start <= :week AND week_end >= :week
-    """
-    lessons = await database.fetch_all(query, values={
-        "day": day_name,
-        "pair": upcoming_pair,
-        "week": week_num,
-    })
-    
-    if not lessons:
-        return
+def _at(day: date, hour: int, minute: int) -> float:
+    """Unix time of hour:minute on day in Tashkent."""
+    return TZ.localize(datetime(day.year, day.month, day.day, hour, minute)).timestamp()
 
-    logger.info(f"Found {len(lessons)} lessons starting soon.")
 
-    # Fetch all subscribers (convert to dict: Record has no .get(), only __getitem__)
-    rows = await database.fetch_all("SELECT * FROM push_subscriptions")
-    if not rows:
-        return
+def semester_week(day: date) -> int:
+    return max(1, (day - SEMESTER_START.date()).days // 7 + 1)
 
-    subs = [_row_to_dict(r) for r in rows]
 
-    for lesson in lessons:
-        lesson_dict = _row_to_dict(lesson)
-        message = f"Через {NOTIFY_BEFORE_LESSON_MINUTES} мин.: {lesson_dict.get('subject', '')} ({lesson_dict.get('lesson_type', '')}) в {lesson_dict.get('room', '')}."
-        
-        for sub in subs:
-            try:
-                subscription_info = json.loads(sub.get("subscription_data") or "{}")
-                payload = json.dumps({
-                    "title": "Напоминание ⏰",
-                    "body": message,
-                    "url": "/",
-                    "icon": "/static/icons/icon-192x192.png"
-                })
-                webpush(
-                    subscription_info=subscription_info,
-                    data=payload,
-                    vapid_private_key=VAPID_PRIVATE_KEY,
-                    vapid_claims={"sub": VAPID_CLAIM_EMAIL}
-                )
-            except WebPushException as ex:
-                if ex.response and ex.response.status_code in [404, 410]:
-                    await database.execute("DELETE FROM push_subscriptions WHERE id = :id", {"id": sub["id"]})
-            except Exception as e:
-                logger.error(f"Push error: {e}")
+async def remind_lesson(lesson, audience: tuple = ("all", None)):
+    """Queue 'lesson starts in N minutes' for the audience."""
+    # The plan may predate an edit made through another worker: remind only if the lesson
+    # is still there at this time, with its current subject and room
+    row = await database.fetch_one("SELECT * FROM schedule WHERE id = :id", {"id": lesson.id})
+    if row is None:
+        return
+    current = Lesson.from_row(row)
+    today = datetime.now(TZ).date()
+    if (current.day, current.pair) != (lesson.day, lesson.pair) or not current.is_active(semester_week(today)):
+        return
+    lesson = current
+    subscription_ids = await resolve_audience(*audience)
+    if not subscription_ids:
+        return
+    message = f"Через {NOTIFY_BEFORE_LESSON_MINUTES} мин.: {lesson.subject} ({lesson.type}) в {lesson.room}."
+    # Pointless once the lesson has started: retries stop at that point. Urgency lets the
+    # push service wake a device in power-saving mode for it
+    await queue("lesson_reminder", subscription_ids, build_payload("Напоминание ⏰", message, "/"),
+                audience=audience[0], ttl=NOTIFY_BEFORE_LESSON_MINUTES * 60, headers={"Urgency": "high"})
 
 
 async def check_exam_reminders():
-    """Send push 'Завтра экзамен: X' to users who subscribed. Runs daily at 08:00 Tashkent."""
+    """Send push 'Завтра экзамен: X' to users who subscribed. Planned daily at 08:00 Tashkent."""
     if not VAPID_PRIVATE_KEY:
         return
     now = datetime.now(TZ)
@@ -133,54 +114,214 @@ async def check_exam_reminders():
         )
         if not exams_tomorrow:
             return
+        # Subscribers of every exam in one JOIN, not a query per exam
+        audiences = await exam_reminder_audiences(tomorrow)
         for exam in exams_tomorrow:
             exam_dict = _row_to_dict(exam)
-            exam_id = exam_dict["id"]
+            subscription_ids = audiences.get(exam_dict["id"])
+            if not subscription_ids:
+                continue
             subject = exam_dict.get("subject", "Экзамен")
-            reminders = await database.fetch_all(
-                "SELECT student_id FROM exam_reminders WHERE exam_id = :eid",
-                {"eid": exam_id},
-            )
-            for rem in reminders:
-                sid = rem["student_id"]
-                sub_row = await database.fetch_one(
-                    "SELECT id, subscription_data FROM push_subscriptions WHERE student_id = :sid",
-                    {"sid": sid},
-                )
-                if not sub_row:
-                    continue
-                try:
-                    sub = _row_to_dict(sub_row)
-                    subscription_info = json.loads(sub.get("subscription_data") or "{}")
-                    payload = json.dumps({
-                        "title": "Завтра экзамен 📚",
-                        "body": f"{subject}. Не забудьте подготовиться!",
-                        "url": "/exams.html",
-                        "icon": "/static/icons/icon-192x192.png",
-                    })
-                    webpush(
-                        subscription_info=subscription_info,
-                        data=payload,
-                        vapid_private_key=VAPID_PRIVATE_KEY,
-                        vapid_claims={"sub": VAPID_CLAIM_EMAIL},
-                    )
-                except WebPushException as ex:
-                    if ex.response and ex.response.status_code in [404, 410]:
-                        await database.execute("DELETE FROM push_subscriptions WHERE id = :id", {"id": sub_row["id"]})
-                except Exception as e:
-                    logger.error("exam reminder push: %s", e)
+            data = build_payload("Завтра экзамен 📚", f"{subject}. Не забудьте подготовиться!", "/exams.html")
+            try:
+                await queue("exam_reminder", subscription_ids, data, audience="exam_reminder")
+            except Exception as e:
+                logger.error("exam reminder push: %s", e)
     except Exception as e:
         logger.exception("check_exam_reminders: %s", e)
 
 
-def start_scheduler():
-    scheduler.add_job(check_upcoming_lessons, CronTrigger(second="0"))
-    scheduler.add_job(
-        check_exam_reminders,
-        CronTrigger(hour=8, minute=0, timezone=TZ),
-    )
-    scheduler.start()
-    logger.info("Scheduler started!")
+def day_plan(day: date, snapshot: ScheduleSnapshot) -> list:
+    """[(fire_at, job, action)] for one day; action is a zero-argument coroutine function."""
+    entries = [(_at(day, *EXAM_REMINDER_TIME), "exam_reminders", check_exam_reminders)]
+    if day.weekday() < len(DAY_NAMES):
+        lead = NOTIFY_BEFORE_LESSON_MINUTES * 60
+        for lesson in snapshot.lessons_on(DAY_NAMES[day.weekday()], semester_week(day)):
+            start = PAIR_START_TIMES.get(lesson.pair)
+            if not start:
+                continue
+            hour, minute = map(int, start.split(":"))
+            entries.append((_at(day, hour, minute) - lead, "lesson_reminder", partial(remind_lesson, lesson)))
+    return entries
+
+
+class ReminderPlan:
+    """Today's entries in a heap of (fire_at, seq, job, action), fired by one loop.call_at timer."""
+
+    def __init__(self):
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._midnight: Optional[asyncio.TimerHandle] = None
+        self._refresh: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self._rebuilding: Optional[asyncio.Task] = None
+        self._stale = False
+        self.day: Optional[date] = None
+        self.version: Optional[int] = None
+        self.running = False
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, fire_at: float, job: str, action) -> None:
+        heapq.heappush(self._heap, (fire_at, next(self._seq), job, action))
+        if self.running:
+            self._arm()
+
+    def _call_at(self, fire_at: float, callback) -> asyncio.TimerHandle:
+        # call_at takes loop time (monotonic); convert from wall clock at arming time
+        loop = asyncio.get_running_loop()
+        return loop.call_at(loop.time() + max(0.0, fire_at - time.time()), callback)
+
+    def _arm(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._heap:
+            self._timer = self._call_at(self._heap[0][0], self._fire_due)
+        set_scheduler_plan_entries(len(self._heap))
+
+    def _fire_due(self) -> None:
+        self._timer = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, _, job, action = heapq.heappop(self._heap)
+            lag = now - fire_at
+            if lag > MISFIRE_GRACE_SECONDS:
+                inc_scheduler_misfire(job)
+                logger.warning("scheduler: %s misfired (%.0fs late), skipped", job, lag)
+                continue
+            self._spawn(self._run(job, action, lag))
+        self._arm()
+
+    async def _run(self, job: str, action, lag: float) -> None:
+        started = time.perf_counter()
+        try:
+            await action()
+        except Exception:
+            logger.exception("scheduler: %s failed", job)
+        finally:
+            observe_scheduler_run(job, lag, time.perf_counter() - started)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def rebuild(self, snapshot: Optional[ScheduleSnapshot] = None) -> None:
+        """Replan today from the schedule. Entries whose time already passed are dropped."""
+        if snapshot is None:
+            snapshot = await get_snapshot()
+        today = datetime.now(TZ).date()
+        now = time.time()
+        heap = []
+        for fire_at, job, action in day_plan(today, snapshot):
+            if fire_at > now:
+                heap.append((fire_at, next(self._seq), job, action))
+        heapq.heapify(heap)
+        self._heap = heap
+        self.day, self.version = today, snapshot.version
+        if self.running:
+            self._arm()
+            self._arm_midnight()
+        logger.info("scheduler: plan for %s rebuilt (%d entries, schedule v%s)", today, len(heap), snapshot.version)
+
+    def _arm_midnight(self) -> None:
+        if self._midnight is not None:
+            self._midnight.cancel()
+        tomorrow = datetime.now(TZ).date() + timedelta(days=1)
+        # A second past midnight, so "today" is already the new day when it fires
+        self._midnight = self._call_at(_at(tomorrow, 0, 0) + 1, self.request_rebuild)
+
+    def _arm_refresh(self) -> None:
+        if self._refresh is not None:
+            self._refresh.cancel()
+        self._refresh = self._call_at(time.time() + CACHE_TTL_SECONDS, self._refresh_snapshot)
+
+    def _refresh_snapshot(self) -> None:
+        # get_snapshot() reloads a snapshot older than CACHE_TTL_SECONDS; a newer one
+        # replans through the snapshot listener
+        self._refresh = None
+        self._spawn(get_snapshot())
+        self._arm_refresh()
+
+    def request_rebuild(self, snapshot: Optional[ScheduleSnapshot] = None) -> None:
+        """Rebuild soon (from sync callbacks); concurrent requests collapse into one more rebuild."""
+        if not self.running:
+            return
+        if snapshot is not None and snapshot.version == self.version and self.day == datetime.now(TZ).date():
+            return
+        if self._rebuilding is not None and not self._rebuilding.done():
+            self._stale = True
+            return
+        self._rebuilding = asyncio.ensure_future(self._rebuild_loop())
+
+    async def _rebuild_loop(self) -> None:
+        while True:
+            self._stale = False
+            try:
+                await self.rebuild()
+            except Exception:
+                logger.exception("scheduler: plan rebuild failed")
+            if not self._stale:
+                return
+
+    async def start(self) -> None:
+        await self.rebuild()
+        self.running = True
+        self._arm()
+        self._arm_midnight()
+        self._arm_refresh()
+
+    async def stop(self) -> None:
+        self.running = False
+        for handle in (self._timer, self._midnight, self._refresh):
+            if handle is not None:
+                handle.cancel()
+        self._timer = self._midnight = self._refresh = None
+        pending = [t for t in (*self._tasks, self._rebuilding) if t is not None and not t.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+plan = ReminderPlan()
+
+
+def _on_snapshot(snapshot: ScheduleSnapshot) -> None:
+    plan.request_rebuild(snapshot)
+
+
+def _on_remote_invalidate(tags: tuple) -> None:
+    # Another worker changed the schedule: reload it and replan
+    if "schedule" in tags or "*" in tags:
+        plan.request_rebuild()
+
+
+add_snapshot_listener(_on_snapshot)
+add_invalidation_listener(_on_remote_invalidate)
+
+
+_elector: Optional[LeaderElector] = None
+
+
+async def start_scheduler():
+    """Run the reminder plan in this process, or campaign for it when LEADER_ELECTION is on
+    (several workers / instances: only the elected leader plans and fires reminders)."""
+    global _elector
+    if not LEADER_ELECTION:
+        await plan.start()
+        logger.info("Scheduler started!")
+        return
+    _elector = LeaderElector("scheduler", on_elected=plan.start, on_demoted=plan.stop)
+    _elector.start()
+    logger.info("Scheduler started (leader election)")
+
 
 async def shutdown_scheduler():
-    scheduler.shutdown()
+    global _elector
+    elector, _elector = _elector, None
+    if elector is not None:
+        await elector.stop()
+    await plan.stop()
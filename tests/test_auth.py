@@ -55,3 +55,156 @@ async def test_me_unauthorized(client):
     # check dependencies.py: raises HTTPException(status_code=403, detail="Invalid token")
     # Actually wait, let's check dependencies.py
     assert response.status_code in [401, 403]
+
+
+@pytest.mark.asyncio
+async def test_plain_telegram_id_is_not_a_token(client):
+    # The pre-JWT format (a bare telegram_id) proves nothing and authenticates no one
+    response = await client.get("/api/me", headers={"Authorization": "Bearer 1214641616"})
+    assert response.status_code == 401
+    admin = await client.get("/api/admin/check", headers={"Authorization": "Bearer 1214641616"})
+    assert admin.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_password_hasher_sheds_load_and_rehashes():
+    import asyncio
+
+    from utils.auth import PasswordHasher, PasswordHasherBusy, hash_rounds
+
+    hasher = PasswordHasher(workers=1, max_pending=2, rounds=5)
+    try:
+        hashed = await hasher.hash("secret")
+        assert hash_rounds(hashed) == 5
+        assert await hasher.verify("secret", hashed) and not await hasher.verify("wrong", hashed)
+
+        # Two hashes occupy the pool: a third is refused at once instead of queueing
+        busy = [asyncio.ensure_future(hasher.hash("x")) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.verify("secret", hashed)
+        await asyncio.gather(*busy)
+
+        # Pinned cost: any other cost is redone on login; calibrated: only cheaper ones
+        assert not hasher.needs_rehash(hashed)
+        assert hasher.needs_rehash(await PasswordHasher(workers=1, rounds=4).hash("secret"))
+        assert hasher.needs_rehash("plain-text")
+        calibrated = PasswordHasher(workers=1, rounds=None)
+        assert 10 <= await calibrated.calibrate(target_ms=1) <= 15
+        # Only the cost field is read: a syntactically valid 15-round hash is enough
+        costly = "$2b$15$" + "a" * 53
+        assert calibrated.needs_rehash(hashed) and not calibrated.needs_rehash(costly)
+        calibrated.shutdown()
+    finally:
+        hasher.shutdown()
+
+
+
+@pytest.mark.asyncio
+async def test_login_updates_streak_and_achievements(client, monkeypatch):
+    import datetime
+
+    import app.database
+    import app.routers.auth as auth
+
+    db = app.database.database
+    monkeypatch.setattr(auth, "database", db)
+    tid = "1214641616"
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    await db.execute(
+        "UPDATE students SET visit_streak = 6, last_visit_date = :d WHERE telegram_id = :tid", {"d": yesterday, "tid": tid}
+    )
+    await db.execute("DELETE FROM user_achievements WHERE user_identifier = :tid", {"tid": tid})
+
+    credentials = {"telegram_id": tid, "password": "azamat2026"}
+    # Own client address: the login rate limit bucket is shared with the other tests
+    headers = {"X-Forwarded-For": "10.0.22.1"}
+    first = (await client.post("/api/login", json=credentials, headers=headers)).json()
+    assert first["success"] is True and first["streak"] == 7
+    # Same day again: the streak holds and the achievements are not granted twice
+    again = (await client.post("/api/login", json=credentials, headers=headers)).json()
+    assert again["success"] is True and again["streak"] == 7
+
+    rows = await db.fetch_all("SELECT achievement_key FROM user_achievements WHERE user_identifier = :tid", {"tid": tid})
+    assert sorted(r["achievement_key"] for r in rows) == ["first_login", "streak_7"]
+    student = await db.fetch_one("SELECT password, last_visit_date FROM students WHERE telegram_id = :tid", {"tid": tid})
+    assert student["password"].startswith("$2b$") and student["last_visit_date"] == datetime.date.today().isoformat()
+
+
+@pytest.mark.asyncio
+async def test_principal_from_claims_and_cache(monkeypatch):
+    from fastapi import HTTPException
+
+    import app.database
+    import app.dependencies as dependencies
+    import app.principal as principal
+    from app.dependencies import get_current_user, require_admin
+    from utils.jwt import create_access_token, verify_token
+
+    db = app.database.database
+    monkeypatch.setattr(principal, "database", db)
+    monkeypatch.setattr(principal, "_principals", principal.TTLCache(maxsize=16, ttl=60))
+    tid = "1214641616"
+    original = await db.fetch_one("SELECT name, is_admin FROM students WHERE telegram_id = :tid", {"tid": tid})
+    await db.execute("UPDATE students SET is_admin = FALSE, name = 'Azamat' WHERE telegram_id = :tid", {"tid": tid})
+    student = await db.fetch_one("SELECT telegram_id, name, is_admin FROM students WHERE telegram_id = :tid", {"tid": tid})
+    bearer = f"Bearer {create_access_token(principal.access_claims(student))}"
+    assert verify_token(bearer[7:])["name"] == "Azamat"
+
+    # Resolved from the token's claims: students is not read
+    assert (await get_current_user(bearer))["name"] == "Azamat"
+    assert principal.cached_principal(tid) is None
+
+    # Tiered mode (changes reach every worker): the admin flag is read once, then served
+    # from the cache until invalidated
+    monkeypatch.setattr(dependencies, "cross_worker_invalidation", lambda: True)
+    with pytest.raises(HTTPException) as denied:
+        await require_admin(bearer)
+    assert denied.value.status_code == 403
+    await db.execute("UPDATE students SET is_admin = TRUE, name = 'Azamat R.' WHERE telegram_id = :tid", {"tid": tid})
+    with pytest.raises(HTTPException):
+        await require_admin(bearer)
+    # Other modes: read from students every time, so a change made by another worker counts at once
+    monkeypatch.setattr(dependencies, "cross_worker_invalidation", lambda: False)
+    assert (await require_admin(bearer))["is_admin"] is True
+    monkeypatch.setattr(dependencies, "cross_worker_invalidation", lambda: True)
+    await principal.invalidate_principal(tid)
+    assert (await require_admin(bearer))["is_admin"] is True
+
+    # Claims issued before the change are no longer trusted: the fresh name comes from students
+    monkeypatch.setattr(principal, "_principals", principal.TTLCache(maxsize=16, ttl=60))
+    assert (await get_current_user(bearer))["name"] == "Azamat R."
+    await db.execute(
+        "UPDATE students SET name = :name, is_admin = :admin WHERE telegram_id = :tid",
+        {"name": original["name"], "admin": original["is_admin"], "tid": tid},
+    )
+    await principal.invalidate_principal(tid)
+
+
+@pytest.mark.asyncio
+async def test_bearer_token_decoded_once_per_request(client, monkeypatch):
+    import app.database
+    import app.rate_limit as rate_limit
+    import app.routers.extras as extras
+    import utils.jwt
+    from utils.jwt import create_access_token
+
+    monkeypatch.setattr(extras, "database", app.database.database)
+    monkeypatch.setattr(rate_limit, "_api_store", rate_limit.defaultdict(lambda: (0, 0.0)))
+    calls = []
+    verify_token = utils.jwt.verify_token
+    monkeypatch.setattr(utils.jwt, "verify_token", lambda *args: calls.append(args) or verify_token(*args))
+    tid = "1214641616"
+    token = create_access_token({"sub": tid, "name": "Azamat", "is_admin": False})
+    headers = {"Authorization": f"Bearer {token}", "X-Forwarded-For": "10.0.25.1"}
+
+    # The middleware decodes the token; the handler's dependency and the rate limiter reuse it
+    response = await client.get("/api/achievements/me", headers=headers)
+    assert [a["key"] for a in response.json()["achievements"]][0] == "streak_7"
+    assert len(calls) == 1
+    assert rate_limit._api_store[f"api:user:{tid}"][0] == 1 and "api:10.0.25.1" not in rate_limit._api_store
+
+    # An invalid token is anonymous and limited by address
+    response = await client.get("/api/achievements/me", headers={"Authorization": "Bearer a.b.c", "X-Forwarded-For": "10.0.25.1"})
+    assert response.json() == {"achievements": []}
+    assert rate_limit._api_store["api:10.0.25.1"][0] == 1
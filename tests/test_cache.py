@@ -0,0 +1,224 @@
+import pytest
+
+import utils.cache as cache_mod
+from utils.cache import cache_key, cached, invalidate
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(cache_mod, "schedule_cache", cache_mod._MemoryCache(ttl=60))
+
+
+@pytest.mark.asyncio
+async def test_cached_hits_until_tag_invalidated():
+    calls = []
+
+    @cached(tags=("exams",))
+    async def load(subject=None):
+        calls.append(subject)
+        return {"subject": subject, "n": len(calls)}
+
+    assert (await load(subject="a"))["n"] == 1
+    assert (await load(subject="a"))["n"] == 1
+    assert (await load(subject="b"))["n"] == 2
+
+    await invalidate("ratings")
+    assert (await load(subject="a"))["n"] == 1
+
+    await invalidate("exams")
+    assert (await load(subject="a"))["n"] == 3
+
+
+def test_cache_key_is_stable():
+    assert cache_key() == ""
+    assert cache_key(1, b=2, a="x") == cache_key(1, a="x", b=2)
+    assert cache_key("1") != cache_key(1)
+
+
+def test_unknown_tag_rejected():
+    with pytest.raises(ValueError):
+        cached(tags=("nope",))
+
+
+@pytest.mark.asyncio
+async def test_get_many_and_clear():
+    backend = cache_mod._get_cache()
+    gens = await backend.generations(("polls", "*"))
+    await backend.set("a", gens, 1, 60)
+    await backend.set("b", gens, 2, 60)
+
+    entries = await backend.get_many([("a", ("polls", "*")), ("b", ("polls", "*")), ("c", ("polls", "*"))])
+    assert [e and e[2] for e in entries] == [1, 2, None]
+
+    await cache_mod.clear_cache()
+    assert await backend.get_many([("a", ("polls", "*"))]) == [None]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_computation():
+    import asyncio
+
+    calls = []
+
+    @cached(tags=("polls",))
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    results = await asyncio.gather(*(slow() for _ in range(20)))
+    assert results == [1] * 20
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors():
+    import asyncio
+
+    from utils.cache import single_flight
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("db down")
+
+    results = await asyncio.gather(*(single_flight("k", boom) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_first_caller_cancelled():
+    import asyncio
+
+    from utils.cache import single_flight
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "rows"
+
+    first = asyncio.create_task(single_flight("cancelled", slow))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(single_flight("cancelled", slow))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await waiter == "rows"
+    assert first.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate():
+    import asyncio
+
+    calls = []
+
+    @cached(tags=("materials",), soft_ttl=0.05)
+    async def load():
+        calls.append(1)
+        return len(calls)
+
+    assert await load() == 1
+    await asyncio.sleep(0.1)
+    assert await load() == 1  # stale value served, refresh scheduled
+    await asyncio.sleep(0.01)
+    assert await load() == 2
+
+
+class _FakeRedis:
+    """Just enough of redis.asyncio for _RedisCache: strings, the bump script, locks."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    async def set(self, key, value, ex=None, nx=False, px=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    async def eval(self, script, numkeys, *args):
+        keys, argv = args[:numkeys], args[numkeys:]
+        if script == cache_mod._BUMP_LUA:
+            for key in keys:
+                self.data[key] = str(max(int(self.data.get(key) or 0) + 1, argv[0]))
+        elif self.data.get(keys[0]) == argv[0]:
+            del self.data[keys[0]]
+
+    async def publish(self, channel, message):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_tiered(monkeypatch):
+    import asyncio
+    import json
+
+    tiered = cache_mod._TieredCache("redis://localhost:6379/0", ttl=60)
+    tiered.l2._client = _FakeRedis()
+    monkeypatch.setattr(cache_mod, "schedule_cache", tiered)
+    calls = []
+
+    @cached(tags=("materials",), soft_ttl=0.05)
+    async def load():
+        calls.append(1)
+        return len(calls)
+
+    assert await load() == 1
+    await asyncio.sleep(0.1)
+    assert await load() == 1  # stale L1 hit, refreshed in the background
+    await asyncio.sleep(0.01)
+    stored = [json.loads(v) for k, v in tiered.l2._client.data.items() if k.startswith(tiered.l2._prefix)]
+    assert [(entry["v"], entry["g"] is not None) for entry in stored] == [(2, True)]
+
+    # Another worker (empty L1) is served the refreshed value from L2
+    tiered.l1 = cache_mod._MemoryCache(ttl=60)
+    assert await load() == 2 and len(calls) == 2
+    # Malformed L2 entries are misses, not errors
+    for key in [k for k in tiered.l2._client.data if k.startswith(tiered.l2._prefix)]:
+        tiered.l2._client.data[key] = json.dumps({"g": None, "t": 0, "v": 0, "ttl": 60})
+    tiered.l1 = cache_mod._MemoryCache(ttl=60)
+    assert await load() == 3
+
+
+@pytest.mark.asyncio
+async def test_invalidate_rewarms_recent_entries():
+    import asyncio
+
+    calls = []
+
+    @cached(tags=("announcements",), soft_ttl=0)
+    async def load():
+        calls.append(1)
+        return len(calls)
+
+    assert await load() == 1
+    await invalidate("announcements")
+    await asyncio.sleep(0.01)
+    assert len(calls) == 2  # recomputed without waiting for a reader
+    assert await load() == 2
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_db_error_fallback_not_cached(client, monkeypatch):
+    import app.database
+    import app.routers.api as api
+
+    class Down:
+        async def fetch_all(self, *args, **kwargs):
+            raise RuntimeError("db down")
+
+    await invalidate("ratings")
+    monkeypatch.setattr(api, "database", Down())
+    fallback = await client.get("/api/ratings")
+    assert fallback.status_code == 200 and fallback.json() == []
+    assert fallback.headers["cache-control"] == "no-store"
+
+    # The next request after recovery reads the data instead of the stored stand-in
+    monkeypatch.setattr(api, "database", app.database.database)
+    seen = []
+    fetch_all = app.database.database.fetch_all
+    monkeypatch.setattr(app.database.database, "fetch_all", lambda *a, **kw: seen.append(a) or fetch_all(*a, **kw))
+    assert (await client.get("/api/ratings")).status_code == 200
+    assert seen
@@ -0,0 +1,78 @@
+import os
+import time
+import timeit
+
+import pytest
+from jose import jwt as jose_jwt
+
+import utils.jwt as tokens
+
+
+def _forge(payload: dict, key: str = tokens.SECRET_KEY, algorithm: str = "HS256") -> str:
+    return jose_jwt.encode(payload, key, algorithm=algorithm)
+
+
+@pytest.mark.parametrize("name", sorted(tokens.VERIFIERS))
+def test_verifiers_agree(name):
+    verify = tokens.VERIFIERS[name]
+    now = int(time.time())
+    good = tokens.create_access_token({"sub": "42", "name": "N", "is_admin": False})
+    assert verify(good)["sub"] == "42"
+
+    tampered = good[:-2] + ("AA" if not good.endswith("AA") else "BB")
+    rejected = [
+        tampered,
+        _forge({"sub": "42", "type": "access", "exp": now + 60}, key="other-secret"),
+        _forge({"sub": "42", "type": "access", "exp": now - 1}),
+        _forge({"sub": "42", "type": "access", "exp": now + 60, "nbf": now + 60}),
+        _forge({"sub": "42", "type": "access", "exp": now + 60}, algorithm="HS512"),
+        "not.a.token",
+        "",
+    ]
+    for token in rejected:
+        assert verify(token) is None, token
+
+
+def test_verified_tokens_are_cached_until_exp(monkeypatch):
+    clock = [time.time()]
+    monkeypatch.setattr(tokens, "_verified", tokens.TLRUCache(maxsize=4, ttu=tokens._token_ttu, timer=lambda: clock[0]))
+    calls = []
+
+    def counting(token):
+        calls.append(token)
+        return tokens.jose_verify(token)
+
+    monkeypatch.setattr(tokens, "_verify", counting)
+    token = tokens.create_access_token({"sub": "42"})
+    for _ in range(5):
+        assert tokens.verify_token(token, "access")["sub"] == "42"
+    assert len(calls) == 1
+    # Type is checked on every call, cached or not
+    assert tokens.verify_token(token, "refresh") is None
+    # Invalid tokens are verified each time and never cached
+    assert tokens.verify_token("a.b.c") is None and tokens.verify_token("a.b.c") is None
+    assert len(tokens._verified) == 1
+
+    # Past the token's exp the entry is gone and the token is verified again
+    short = _forge({"sub": "42", "type": "access", "exp": int(clock[0]) + 30})
+    assert tokens.verify_token(short) and tokens.verify_token(short)
+    assert len(calls) == 4
+    clock[0] += 31
+    tokens.verify_token(short)
+    assert len(calls) == 5
+
+
+def _best(fn, number: int = 2000) -> float:
+    """Best per-call time of a few runs, in microseconds."""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+@pytest.mark.skipif(not os.getenv("BENCHMARK"), reason="microbenchmark: BENCHMARK=1 pytest -s tests/test_jwt.py")
+def test_benchmark_verification_paths(monkeypatch):
+    """Microbenchmark, report only: cached hit vs. each verifier (timings are not asserted)."""
+    monkeypatch.setattr(tokens, "_verified", tokens.TLRUCache(maxsize=16, ttu=tokens._token_ttu, timer=time.time))
+    token = tokens.create_access_token({"sub": "42", "name": "N", "is_admin": False})
+    timings = {name: _best(lambda verify=verify: verify(token)) for name, verify in tokens.VERIFIERS.items()}
+    tokens.verify_token(token)
+    timings["cached"] = _best(lambda: tokens.verify_token(token))
+    print("\nJWT verify, µs/call: " + ", ".join(f"{name} {us:.1f}" for name, us in sorted(timings.items())))
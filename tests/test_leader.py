@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def leader_module(monkeypatch):
+    """app.leader bound to the test database, lease path (SQLite)."""
+    import app.database
+    import app.leader as leader
+
+    monkeypatch.setattr(leader, "database", app.database.database)
+    return leader
+
+
+def _elector(leader, events: list, name: str):
+    async def elected():
+        events.append("elected")
+
+    async def demoted():
+        events.append("demoted")
+
+    return leader.LeaderElector(name, on_elected=elected, on_demoted=demoted)
+
+
+@pytest.mark.asyncio
+async def test_single_leader_and_failover(leader_module, monkeypatch):
+    name = f"test-{uuid.uuid4().hex}"
+    first_events, second_events = [], []
+    first = _elector(leader_module, first_events, name)
+    second = _elector(leader_module, second_events, name)
+
+    assert await first.try_acquire()
+    assert await first.try_acquire()  # renewal
+    assert not await second.try_acquire()
+
+    # The leader stops renewing: once the lease runs out the other candidate takes over
+    monkeypatch.setattr(leader_module, "LEADER_LEASE_SECONDS", -1)
+    assert await first.try_acquire()
+    monkeypatch.setattr(leader_module, "LEADER_LEASE_SECONDS", 15)
+    assert await second.try_acquire()
+    assert not await first.try_acquire()
+
+
+@pytest.mark.asyncio
+async def test_stop_hands_over_at_once(leader_module):
+    name = f"test-{uuid.uuid4().hex}"
+    first_events, second_events = [], []
+    first = _elector(leader_module, first_events, name)
+    second = _elector(leader_module, second_events, name)
+
+    await first._set_leader(await first.try_acquire())
+    assert first.is_leader and first_events == ["elected"]
+    await first.stop()
+    assert not first.is_leader and first_events == ["elected", "demoted"]
+    assert await second.try_acquire()
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from app.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_roundtrip():
+    cursor = encode_cursor(["2026-02-09 10:00:00", 42])
+    assert decode_cursor(cursor, 2) == ["2026-02-09 10:00:00", 42]
+
+
+@pytest.mark.asyncio
+async def test_comments_keyset_pages(client, monkeypatch):
+    import app.database
+    import app.routers.extras as extras
+
+    # The router bound the app database before the test one was swapped in
+    monkeypatch.setattr(extras, "database", app.database.database)
+    monkeypatch.setattr("app.pagination.database", app.database.database)
+    announcement_id = int(time.time() * 1000) % 10**9  # fresh thread on every run
+    for i in range(5):
+        response = await client.post(
+            "/api/announcement/comments", json={"announcement_id": announcement_id, "body": f"comment {i}"}
+        )
+        assert response.json()["success"] is True
+
+    legacy = (await client.get(f"/api/announcement/{announcement_id}/comments")).json()
+    assert [c["body"] for c in legacy] == [f"comment {i}" for i in range(5)]
+
+    # Comments inserted within one second share created_at: the id tie-breaker keeps pages disjoint
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "with_total": "true"}
+        if cursor:
+            params["cursor"] = cursor
+        page = (await client.get(f"/api/announcement/{announcement_id}/comments", params=params)).json()
+        assert page["total"] == 5
+        seen.extend(c["body"] for c in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [c["body"] for c in legacy]
+
+    bad = await client.get(f"/api/announcement/{announcement_id}/comments", params={"cursor": "garbage"})
+    assert bad.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_schedule_history_limit_keeps_array(monkeypatch):
+    import app.database
+    from app.routers.admin import get_schedule_history
+
+    monkeypatch.setattr("app.pagination.database", app.database.database)
+    legacy = await get_schedule_history(user={}, limit=5, offset=0, cursor=None, with_total=False)
+    assert isinstance(legacy, list)
+    page = await get_schedule_history(user={}, limit=5, offset=0, cursor=None, with_total=True)
+    assert set(page) == {"items", "next_cursor", "total"}
@@ -0,0 +1,421 @@
+import asyncio
+import base64
+import json
+import time
+import uuid
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from py_vapid import Vapid
+
+import app.push_delivery as delivery
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+_KEYS: dict = {}
+
+
+def _subscription(endpoint: str) -> dict:
+    """A browser-like subscription with real keys, so encryption runs for real."""
+    key = _KEYS[endpoint] = ec.generate_private_key(ec.SECP256R1())
+    p256dh = key.public_key().public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return {"endpoint": endpoint, "keys": {"p256dh": _b64(p256dh), "auth": _b64(b"0123456789abcdef")}}
+
+
+@pytest.fixture
+def push_env(monkeypatch):
+    vapid = Vapid()
+    vapid.generate_keys()
+    pem = vapid.private_pem().decode()
+    monkeypatch.setattr(delivery, "VAPID_PRIVATE_KEY", pem)
+    monkeypatch.setattr(delivery, "_vapid", delivery._load_vapid(pem))
+    monkeypatch.setattr(delivery, "_semaphores", {})
+    monkeypatch.setattr(delivery, "_vapid_headers_cache", {})
+
+    def use_transport(handler):
+        monkeypatch.setattr(delivery, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    return use_transport
+
+
+@pytest.mark.asyncio
+async def test_send_statuses(push_env):
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["content-encoding"] == "aes128gcm"
+        assert request.headers["authorization"].startswith("vapid ")
+        code = int(request.url.path.rsplit("/", 1)[-1])
+        return httpx.Response(code, headers={"Retry-After": "30"} if code == 429 else {})
+
+    push_env(handler)
+    data = delivery.build_payload("t", "b")
+    ok = await delivery.send(_subscription("https://push.example/201"), data)
+    gone = await delivery.send(_subscription("https://push.example/410"), data)
+    throttled = await delivery.send(_subscription("https://push.example/429"), data)
+    broken = await delivery.send({"endpoint": "https://push.example/201", "keys": {"p256dh": "x", "auth": "y"}}, data)
+
+    assert ok.ok and not ok.gone
+    assert gone.gone
+    assert not throttled.ok and throttled.retry_after == 30
+    assert broken.status_code is None and broken.error
+
+
+@pytest.mark.asyncio
+async def test_concurrency_capped_per_origin(push_env, monkeypatch):
+    monkeypatch.setattr(delivery, "PUSH_CONCURRENCY_PER_ORIGIN", 3)
+    active = {"now": 0, "max": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        return httpx.Response(201)
+
+    push_env(handler)
+    targets = [(i, _subscription(f"https://push.example/s/{i}")) for i in range(12)]
+    stats = await delivery.broadcast(targets, delivery.build_payload("t", "b"))
+
+    assert stats == {"sent": 12, "failed": 0, "removed": 0}
+    assert active["max"] == 3
+
+
+@pytest.mark.asyncio
+async def test_vapid_signed_once_per_audience(push_env, monkeypatch):
+    push_env(lambda request: httpx.Response(201))
+    signed = []
+    sign = delivery._vapid.sign
+    monkeypatch.setattr(delivery._vapid, "sign", lambda claims: signed.append(claims["aud"]) or sign(claims))
+
+    targets = [(i, _subscription(f"https://{host}/s/{i}")) for i, host in enumerate(["a.push", "b.push"] * 5)]
+    stats = await delivery.broadcast(targets, delivery.build_payload("t", "b"))
+
+    assert stats["sent"] == 10
+    assert sorted(signed) == ["https://a.push", "https://b.push"]
+
+
+def test_invalid_vapid_key_parsed_once(monkeypatch):
+    monkeypatch.setattr(delivery, "VAPID_PRIVATE_KEY", "not-a-key")
+    monkeypatch.setattr(delivery, "_vapid", None)
+    monkeypatch.setattr(delivery, "_vapid_loaded", False)
+    monkeypatch.setattr(delivery, "_vapid_headers_cache", {})
+    load = delivery._load_vapid
+    calls = []
+    monkeypatch.setattr(delivery, "_load_vapid", lambda key: calls.append(key) or load(key))
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            delivery._vapid_headers("https://push.example")
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_large_broadcast_encrypts_in_process_pool(push_env, monkeypatch):
+    import http_ece
+
+    monkeypatch.setattr(delivery, "PUSH_ENCRYPT_WORKERS", 1)
+    monkeypatch.setattr(delivery, "PUSH_ENCRYPT_POOL_MIN", 5)
+    monkeypatch.setattr(delivery, "PUSH_ENCRYPT_CHUNK", 3)
+    data = delivery.build_payload("t", "pool")
+    received = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        key = _KEYS[str(request.url)]
+        received.append(http_ece.decrypt(request.content, private_key=key, auth_secret=b"0123456789abcdef", version="aes128gcm"))
+        return httpx.Response(201)
+
+    push_env(handler)
+    targets = [(i, _subscription(f"https://push.example/p/{i}")) for i in range(7)]
+    try:
+        stats = await delivery.broadcast(targets, data)
+    finally:
+        delivery._shutdown_pool()
+
+    assert stats == {"sent": 7, "failed": 0, "removed": 0}
+    assert received == [data] * 7
+
+
+@pytest.mark.asyncio
+async def test_failed_pool_chunk_falls_back_alone(push_env, monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(delivery, "PUSH_ENCRYPT_WORKERS", 1)
+    monkeypatch.setattr(delivery, "PUSH_ENCRYPT_POOL_MIN", 5)
+    monkeypatch.setattr(delivery, "PUSH_ENCRYPT_CHUNK", 2)
+    # One worker thread: the chunks after the failing one are still queued when it fails
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(delivery, "_pool", pool)
+    encrypt_chunk = delivery.encrypt_chunk
+    failed = threading.Event()
+
+    def flaky(subscriptions, data):
+        if not failed.is_set():
+            failed.set()
+            raise RuntimeError("worker died")
+        return encrypt_chunk(subscriptions, data)
+
+    monkeypatch.setattr(delivery, "encrypt_chunk", flaky)
+    push_env(lambda request: httpx.Response(201))
+    targets = [(i, _subscription(f"https://push.example/f/{i}")) for i in range(7)]
+    try:
+        stats = await delivery.broadcast(targets, delivery.build_payload("t", "flaky"))
+    finally:
+        pool.shutdown(wait=True)
+
+    assert failed.is_set()
+    assert stats == {"sent": 7, "failed": 0, "removed": 0}
+
+
+@pytest.fixture
+def outbox(push_env, monkeypatch):
+    """push_outbox bound to the test database (routers imported it before the DB was swapped)."""
+    import app.database
+    import app.push_audience as audience
+    import app.push_jobs as jobs
+    import app.push_outbox as outbox
+    import app.push_registry as registry
+
+    for module in (outbox, registry, audience, jobs):
+        monkeypatch.setattr(module, "database", app.database.database)
+    monkeypatch.setattr(registry, "_registry", None)
+    for module in (outbox, jobs):
+        monkeypatch.setattr(module, "VAPID_PRIVATE_KEY", delivery.VAPID_PRIVATE_KEY)
+    monkeypatch.setattr(outbox, "_paused_until", {})
+    return outbox
+
+
+async def _subscribe(endpoint: str, student_id: str = "") -> int:
+    from app.push_registry import subscribe
+
+    return await subscribe(student_id or f"student-{uuid.uuid4().hex}", _subscription(endpoint))
+
+
+async def _outbox_row(db, subscription_id: int):
+    return await db.fetch_one(
+        "SELECT * FROM push_outbox WHERE subscription_id = :sid ORDER BY id DESC", {"sid": subscription_id}
+    )
+
+
+@pytest.mark.asyncio
+async def test_outbox_retries_and_survives_restart(outbox, push_env):
+    db = outbox.database
+    codes = {"/ok": [201], "/gone": [410], "/busy": [429, 201]}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        queue = codes[request.url.path]
+        code = queue.pop(0) if len(queue) > 1 else queue[0]
+        return httpx.Response(code, headers={"Retry-After": "30"} if code == 429 else {})
+
+    push_env(handler)
+    ok = await _subscribe("https://a.push/ok")
+    gone = await _subscribe("https://a.push/gone")
+    busy = await _subscribe("https://b.push/busy")
+    assert await outbox.enqueue([ok, gone, busy], delivery.build_payload("t", "outbox")) == 3
+
+    assert await outbox.drain_once() == 3
+    assert (await _outbox_row(db, ok))["status"] == "sent"
+    assert (await _outbox_row(db, gone))["status"] == "gone"
+    assert await db.fetch_one("SELECT id FROM push_subscriptions WHERE id = :id", {"id": gone}) is None
+    retry = await _outbox_row(db, busy)
+    assert retry["status"] == "pending" and retry["attempts"] == 1 and retry["last_status"] == 429
+    assert retry["next_attempt_at"] >= time.time() + 29
+    assert await outbox.drain_once() == 0
+
+    # Due again, but the push service's Retry-After pause still holds: no attempt is spent
+    await db.execute("UPDATE push_outbox SET next_attempt_at = 0 WHERE id = :id", {"id": retry["id"]})
+    assert await outbox.drain_once() == 1
+    assert (await _outbox_row(db, busy))["attempts"] == 1
+
+    # A worker that died mid-send: its lease expires and the row is claimed again
+    outbox._paused_until.clear()
+    await db.execute(
+        "UPDATE push_outbox SET status = 'sending', locked_until = 0, next_attempt_at = 0 WHERE id = :id",
+        {"id": retry["id"]},
+    )
+    assert await outbox.drain_once() == 1
+    done = await _outbox_row(db, busy)
+    assert done["status"] == "sent" and done["attempts"] == 2
+
+
+@pytest.mark.asyncio
+async def test_outbox_renews_lease_per_chunk_and_fences_outcomes(outbox, push_env, monkeypatch):
+    db = outbox.database
+    push_env(lambda request: httpx.Response(201))
+    first, second = [await _subscribe(f"https://a.push/lease/{uuid.uuid4().hex}") for _ in range(2)]
+    await outbox.enqueue([first, second], delivery.build_payload("t", "lease"))
+    monkeypatch.setattr(outbox, "CHUNK_SIZE", 1)
+    renew = outbox._renew
+    renewals = []
+
+    async def slow_renew(token):
+        renewals.append(token)
+        if len(renewals) == 2:
+            # The first chunk outlived the lease: another worker claimed the second row
+            await db.execute(
+                "UPDATE push_outbox SET claim_token = 'other-worker' WHERE id = :id",
+                {"id": (await _outbox_row(db, second))["id"]},
+            )
+        return await renew(token)
+
+    monkeypatch.setattr(outbox, "_renew", slow_renew)
+    assert await outbox.drain_once() == 2
+
+    assert len(renewals) == 2
+    assert (await _outbox_row(db, first))["status"] == "sent"
+    taken = await _outbox_row(db, second)
+    assert taken["status"] == "sending" and taken["claim_token"] == "other-worker" and taken["attempts"] == 0
+    # A late outcome from the worker that lost the lease does not overwrite the new holder's
+    await outbox._finish([outbox._update(taken, "failed", attempts=5)], "stale-token")
+    assert (await _outbox_row(db, second))["status"] == "sending"
+
+
+@pytest.mark.asyncio
+async def test_registry_devices_per_student(outbox):
+    from app.push_registry import get_registry, unsubscribe
+
+    student = f"student-{uuid.uuid4().hex}"
+    other = f"student-{uuid.uuid4().hex}"
+    phone = await _subscribe(f"https://a.push/{student}/phone", student)
+    laptop = await _subscribe(f"https://a.push/{student}/laptop", student)
+    registry = await get_registry()
+    assert sorted(registry.for_students([student])) == sorted([phone, laptop])
+    assert registry.by_id[phone].origin == "https://a.push"
+
+    # Same endpoint again (another account on the device): one row, moved to the new student
+    assert await _subscribe(f"https://a.push/{student}/laptop", other) == laptop
+    assert registry.for_students([student]) == [phone]
+    assert registry.for_students([other]) == [laptop]
+
+    assert await unsubscribe(f"https://a.push/{student}/phone")
+    assert registry.for_students([student]) == []
+    row = await outbox.database.fetch_one("SELECT COUNT(*) AS n FROM push_subscriptions WHERE student_id = :s", {"s": student})
+    assert row["n"] == 0
+
+
+@pytest.mark.asyncio
+async def test_audiences_resolve_in_one_query(outbox, monkeypatch):
+    import app.push_audience as push_audience
+    from app.push_audience import exam_reminder_audiences, parse_audience, resolve_audience
+
+    db = outbox.database
+    tag = uuid.uuid4().hex
+    fan, admin, crammer = (f"{name}-{tag}" for name in ("fan", "admin", "crammer"))
+    fan_ids = [await _subscribe(f"https://a.push/{fan}/{n}", fan) for n in range(2)]
+    admin_id = await _subscribe(f"https://a.push/{admin}", admin)
+    crammer_id = await _subscribe(f"https://a.push/{crammer}", crammer)
+    subject = f"Предмет {tag}"
+    await db.execute(
+        "INSERT INTO user_favorites (student_id, subject_name) VALUES (:sid, :name)", {"sid": fan, "name": subject}
+    )
+    await db.execute(
+        "INSERT INTO students (telegram_id, password, name, is_admin) VALUES (:tid, 'x', 'Admin', TRUE)", {"tid": admin}
+    )
+    exam_id = await db.execute(
+        "INSERT INTO exams (subject, exam_date) VALUES (:subject, '2031-01-15')", {"subject": subject}
+    )
+    await db.execute(
+        "INSERT INTO exam_reminders (student_id, exam_id) VALUES (:sid, :eid)", {"sid": crammer, "eid": exam_id}
+    )
+
+    queries = []
+    fetch_all = db.fetch_all
+    monkeypatch.setattr(db, "fetch_all", lambda *args, **kwargs: queries.append(args[0]) or fetch_all(*args, **kwargs))
+    assert push_audience.database is db
+
+    assert sorted(await resolve_audience(*parse_audience("favorite_subject", subject))) == sorted(fan_ids)
+    assert await resolve_audience(*parse_audience("exam_reminder", str(exam_id))) == [crammer_id]
+    assert admin_id in await resolve_audience(*parse_audience("admins"))
+    assert set(fan_ids + [admin_id, crammer_id]) <= set(await resolve_audience(*parse_audience(None)))
+    assert (await exam_reminder_audiences("2031-01-15"))[exam_id] == [crammer_id]
+    # One query per audience, however many students or devices it covers
+    assert len(queries) == 5
+    with pytest.raises(ValueError):
+        parse_audience("favorite_subject", " ")
+
+
+@pytest.mark.asyncio
+async def test_schedule_changes_debounced_into_one_push(outbox, monkeypatch):
+    import app.routers.push as push_router
+
+    db = outbox.database
+    monkeypatch.setattr(push_router, "VAPID_PRIVATE_KEY", delivery.VAPID_PRIVATE_KEY)
+    monkeypatch.setattr(push_router, "SCHEDULE_PUSH_DEBOUNCE_SECONDS", 0.05)
+    device = await _subscribe(f"https://a.push/schedule/{uuid.uuid4().hex}")
+
+    for action, subject in (("add", "Физика"), ("delete", "Химия"), ("add", "Физика")):
+        await push_router.notify_schedule_changed(action, subject)
+    assert await db.fetch_val("SELECT COUNT(*) FROM push_outbox WHERE subscription_id = :s", {"s": device}) == 0
+    await asyncio.sleep(0.1)
+    await asyncio.gather(*push_router._schedule_tasks)
+
+    rows = await db.fetch_all("SELECT * FROM push_outbox WHERE subscription_id = :s", {"s": device})
+    assert len(rows) == 1
+    assert json.loads(rows[0]["payload"])["body"] == "Расписание обновилось"
+    assert rows[0]["topic"] == "schedule-changed" and rows[0]["ttl"] == push_router.SCHEDULE_PUSH_TTL_SECONDS
+    assert '"Topic": "schedule-changed"' in rows[0]["headers_json"]
+
+    # A later one replaces the one still waiting in the outbox: the body lists no edits, so
+    # nothing is lost with it
+    await push_router.notify_schedule_changed("delete", "Физика")
+    await push_router.flush_schedule_changes()
+    statuses = await db.fetch_all(
+        "SELECT status FROM push_outbox WHERE subscription_id = :s ORDER BY id", {"s": device}
+    )
+    assert [r["status"] for r in statuses] == ["superseded", "pending"]
+    survivor = await _outbox_row(db, device)
+    assert json.loads(survivor["payload"])["body"] == "Расписание обновилось"
+
+
+@pytest.mark.asyncio
+async def test_push_job_report_and_metrics(outbox, push_env):
+    from app.metrics import get_prometheus_export
+    from app.push_jobs import queue, report
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "slow.push":
+            return httpx.Response(429, headers={"Retry-After": "60"})
+        return httpx.Response(201)
+
+    push_env(handler)
+    tag = uuid.uuid4().hex
+    fast = [await _subscribe(f"https://fast.push/{tag}/{n}") for n in range(3)]
+    slow = await _subscribe(f"https://slow.push/{tag}")
+    job_id, queued = await queue("admin", [*fast, slow], delivery.build_payload("t", "job"), audience="all")
+    assert queued == 4
+
+    running = await report(job_id)
+    assert running["state"] == "sending" and running["counts"] == {"pending": 4}
+    await outbox.drain_once()
+
+    job = await report(job_id)
+    assert job["counts"] == {"sent": 3, "pending": 1} and job["attempts"] == 4
+    assert job["encrypt_seconds"] > 0
+    fast_stats = job["origins"]["https://fast.push"]
+    assert fast_stats["pushes"] == 3 and fast_stats["errors"] == {}
+    assert 0 <= fast_stats["latency_p50"] <= fast_stats["latency_p95"] <= fast_stats["latency_max"]
+    assert job["origins"]["https://slow.push"]["errors"] == {"throttled": 1}
+    assert await report("no-such-job") is None
+
+    export = get_prometheus_export()
+    assert 'push_send_duration_seconds_count{origin="https://fast.push"}' in export
+    assert 'push_results_total{origin="https://slow.push",class="throttled"}' in export
+    assert 'push_jobs_total{kind="admin"}' in export
+
+
+@pytest.mark.asyncio
+async def test_push_job_not_recorded_when_enqueue_fails(outbox, monkeypatch):
+    import app.database
+    import app.push_jobs as jobs
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("outbox down")
+
+    monkeypatch.setattr(jobs, "enqueue", broken)
+    before = await app.database.database.fetch_val("SELECT COUNT(*) FROM push_jobs")
+    with pytest.raises(RuntimeError):
+        await jobs.queue("admin", [await _subscribe("https://push.example/orphan")], delivery.build_payload("t", "b"))
+    assert await app.database.database.fetch_val("SELECT COUNT(*) FROM push_jobs") == before
@@ -1,3 +1,6 @@
+import asyncio
+import uuid
+
 import pytest
 
 
@@ -28,3 +31,125 @@ async def test_schedule_filter(client):
     valid_days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday"]
     for item in data:
         assert item["day"] in valid_days
+
+@pytest.mark.asyncio
+async def test_schedule_week_day_filter(client):
+    full = (await client.get("/api/schedule")).json()
+    expected = [i["id"] for i in full if i["day"] == "monday" and i["weeks"][0] <= 5 <= i["weeks"][1]]
+
+    response = await client.get("/api/schedule", params={"week": 5, "day": "monday"})
+    assert response.status_code == 200
+    assert [i["id"] for i in response.json()] == expected
+
+    # 2026-02-09 is the Monday of week 5 (SEMESTER_START = 2026-01-12)
+    by_date = await client.get("/api/schedule", params={"date": "2026-02-09"})
+    assert [i["id"] for i in by_date.json()] == expected
+
+    assert (await client.get("/api/schedule", params={"day": "someday"})).status_code == 422
+    assert (await client.get("/api/schedule", params={"date": "2025-01-01"})).json() == []
+
+@pytest.mark.asyncio
+async def test_subjects_match_schedule(client):
+    schedule = (await client.get("/api/schedule")).json()
+    subjects = (await client.get("/api/subjects")).json()
+
+    assert {s["name"] for s in subjects} == {item["subject"] for item in schedule}
+    for s in subjects:
+        assert s["types"]
+
+@pytest.mark.asyncio
+async def test_schedule_conditional_get(client, monkeypatch):
+    from utils.cache import invalidate
+
+    await invalidate("schedule")
+    first = await client.get("/api/schedule")
+    etag = first.headers["etag"]
+    # Last-Modified is the invalidation time (omitted while none is known)
+    assert first.headers["last-modified"]
+    # Responses vary by query string, and so does the ETag
+    assert (await client.get("/api/schedule", params={"day": "monday"})).headers["etag"] != etag
+
+    cached_copy = await client.get("/api/schedule", headers={"If-None-Match": etag})
+    assert cached_copy.status_code == 304
+    assert cached_copy.content == b""
+
+    await invalidate("schedule")
+    changed = await client.get("/api/schedule", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+    # A stand-in body (schedule unreadable) carries no validators and must not be stored
+    import app.routers.schedule as schedule_router
+    from app.schedule_store import ScheduleSnapshot
+
+    monkeypatch.setattr(schedule_router, "get_snapshot", lambda: asyncio.sleep(0, ScheduleSnapshot(0, ())))
+    fallback = await client.get("/api/schedule")
+    assert fallback.status_code == 200 and fallback.json() == []
+    assert "etag" not in fallback.headers and "last-modified" not in fallback.headers
+    assert fallback.headers["cache-control"] == "no-store"
+
+@pytest.mark.asyncio
+async def test_calendar_feeds(client):
+    feed = await client.get("/api/calendar.ics")
+    assert feed.status_code == 200
+    assert feed.text.startswith("BEGIN:VCALENDAR") and "BEGIN:VEVENT" in feed.text
+    assert (await client.get("/api/calendar.ics", headers={"If-None-Match": feed.headers["etag"]})).status_code == 304
+
+    login = await client.post("/api/login", json={"telegram_id": "1214641616", "password": "azamat2026"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    subject = (await client.get("/api/subjects")).json()[0]["name"]
+    await client.put("/api/favorites", json={"subjects": [subject]}, headers=headers)
+
+    link = (await client.get("/api/calendar/link", headers=headers)).json()["url"]
+    personal = await client.get(link)
+    assert personal.status_code == 200
+    summaries = [line for line in personal.text.splitlines() if line.startswith("SUMMARY:") and "Экзамен" not in line]
+    assert summaries and all(line.startswith(f"SUMMARY:{subject} (") for line in summaries)
+
+    assert (await client.get("/api/calendar/not-a-token.ics")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_personal_feeds_are_versioned_per_user(client):
+    from utils.jwt import create_calendar_token
+
+    other = f"/api/calendar/{create_calendar_token('999000111')}.ics"
+    etag = (await client.get(other)).headers["etag"]
+    login = await client.post("/api/login", json={"telegram_id": "1214641616", "password": "azamat2026"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    await client.put("/api/favorites", json={"subjects": []}, headers=headers)
+    # Someone else's favorites do not touch this feed
+    assert (await client.get(other, headers={"If-None-Match": etag})).status_code == 304
+
+
+def test_late_exam_ends_next_day():
+    from app.calendar_feed import _exam_events
+
+    exam = {"id": 1, "exam_date": "2026-01-15", "exam_time": "23:00", "exam_type": None,
+            "subject": "Физика", "teacher": None, "room": None}
+    lines = _exam_events(exam).splitlines()
+    assert "DTSTART:20260115T230000" in lines and "DTEND:20260116T010000" in lines
+
+
+@pytest.mark.asyncio
+async def test_schedule_edit_swaps_snapshot_before_etag(client, monkeypatch):
+    import app.routers.admin as admin
+    from app.models import ScheduleItemCreate
+
+    subject = f"Тест {uuid.uuid4().hex[:8]}"
+    invalidate = admin.invalidate
+    seen = []
+
+    async def invalidate_then_read(*tags):
+        await invalidate(*tags)
+        # A read right after the tag moved: its new ETag must come with the new body
+        response = await client.get("/api/schedule")
+        seen.append(any(item["subject"] == subject for item in response.json()))
+
+    monkeypatch.setattr(admin, "invalidate", invalidate_then_read)
+    item = ScheduleItemCreate(day="monday", pair=1, subject=subject, type="Лекция", teacher="T", room="1",
+                              week_start=1, week_end=1)
+    assert (await admin.add_schedule_item(item, user={"telegram_id": "test"}))["success"]
+    lesson = next(i for i in (await client.get("/api/schedule")).json() if i["subject"] == subject)
+    assert (await admin.delete_schedule_item(lesson["id"], user={"telegram_id": "test"}))["success"]
+    assert seen == [True, False]
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+from datetime import date, datetime
+
+import pytest
+
+from app.metrics import get_scheduler_stats
+from app.schedule_store import Lesson, ScheduleSnapshot
+from app.scheduler import TZ, ReminderPlan, day_plan
+
+
+def test_day_plan_fires_before_each_pair():
+    lessons = (
+        Lesson(1, "monday", 2, "Физика", "Лекция", "Иванов", "101", 1, 20),
+        Lesson(2, "monday", 3, "Химия", "Практика", "Петров", "202", 5, 20),
+        Lesson(3, "tuesday", 1, "История", "Лекция", "Сидоров", "303", 1, 20),
+    )
+    monday_week_2 = date(2026, 1, 19)
+    plan = day_plan(monday_week_2, ScheduleSnapshot(1, lessons))
+
+    times = sorted(
+        (datetime.fromtimestamp(fire_at, TZ).strftime("%H:%M"), job) for fire_at, job, _ in plan
+    )
+    # Физика at 09:30 minus 10 minutes; Химия starts in week 5; История is on Tuesday
+    assert times == [("08:00", "exam_reminders"), ("09:20", "lesson_reminder")]
+    assert [job for _, job, _ in day_plan(date(2026, 1, 24), ScheduleSnapshot(1, lessons))] == ["exam_reminders"]
+
+
+@pytest.mark.asyncio
+async def test_plan_fires_on_timer_and_skips_misfires():
+    plan = ReminderPlan()
+    plan.running = True
+    fired = []
+
+    async def action():
+        fired.append(time.time())
+
+    before = get_scheduler_stats()["jobs"].get("test_misfire", {}).get("misfires", 0)
+    due = time.time() + 0.05
+    plan.push(due, "test_job", action)
+    plan.push(time.time() - 3600, "test_misfire", action)
+    await asyncio.sleep(0.2)
+    await plan.stop()
+
+    assert len(fired) == 1 and 0 <= fired[0] - due < 0.15
+    stats = get_scheduler_stats()["jobs"]
+    assert stats["test_job"]["runs"] >= 1
+    assert stats["test_misfire"]["misfires"] == before + 1
+    assert len(plan) == 0
+
+
+@pytest.mark.asyncio
+async def test_lesson_reminder_rereads_the_lesson(monkeypatch):
+    import app.database
+    import app.scheduler as scheduler
+
+    db = app.database.database
+    monkeypatch.setattr(scheduler, "database", db)
+    monkeypatch.setattr(scheduler, "resolve_audience", lambda *audience: asyncio.sleep(0, [1]))
+    queued = []
+    monkeypatch.setattr(scheduler, "queue", lambda kind, ids, data, **options: asyncio.sleep(0, queued.append(data)))
+    lesson_id = await db.execute(
+        """INSERT INTO schedule (day_of_week, pair_number, subject, lesson_type, teacher, room, week_start, week_end)
+           VALUES ('monday', 2, 'Физика', 'Лекция', 'Иванов', '101', 1, 1000)"""
+    )
+    planned = Lesson(lesson_id, "monday", 2, "Физика", "Лекция", "Иванов", "101", 1, 1000)
+
+    # Room changed on another worker after the plan was built: the reminder has the new one
+    await db.execute("UPDATE schedule SET room = '404' WHERE id = :id", {"id": lesson_id})
+    await scheduler.remind_lesson(planned)
+    assert len(queued) == 1 and "404" in json.loads(queued[0])["body"]
+
+    # Deleted there: no reminder
+    await db.execute("DELETE FROM schedule WHERE id = :id", {"id": lesson_id})
+    await scheduler.remind_lesson(planned)
+    assert len(queued) == 1
@@ -1,53 +1,164 @@
 """
 Authentication utilities for password hashing and verification
+
+bcrypt costs a few hundred milliseconds of CPU per call, so request handlers go through
+password_hasher: it runs bcrypt in a small thread pool (bcrypt releases the GIL while
+hashing) and sheds load with PasswordHasherBusy once PASSWORD_HASH_MAX_PENDING hashes are
+running or waiting, instead of letting a login burst queue up for seconds.
+hash_password / verify_password stay synchronous for scripts.
 """
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 from passlib.context import CryptContext
 
 # Configure password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_bcrypt = pwd_context.handler("bcrypt")
+
+# Cost (log2 of bcrypt rounds) of new hashes: BCRYPT_ROUNDS if set, else calibrated at startup
+# so one hash takes about BCRYPT_TARGET_MS on this machine
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "0")) or None
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_DEFAULT_ROUNDS = 12
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 15
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+# Rounds timed during calibration: cheap, and each extra round doubles the cost from there
+_CALIBRATION_ROUNDS = 8
+
+
+def _hash(password: str, rounds: int) -> str:
+    # Truncate to 72 bytes to avoid bcrypt limitation
+    return _bcrypt.using(rounds=rounds).hash(password[:72])
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return pwd_context.verify(plain_password[:72], hashed_password)
+    except Exception:
+        return False
+
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """Cost a bcrypt hash was made with (None if it is not one)."""
+    try:
+        return _bcrypt.from_string(hashed_password).rounds
+    except Exception:
+        return None
+
+
+class PasswordHasherBusy(Exception):
+    """Too many hashes running or waiting: answer 503 instead of queueing."""
+
+
+class PasswordHasher:
+    """bcrypt on a bounded thread pool, with a cap on in-flight work."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING,
+                 rounds: Optional[int] = BCRYPT_ROUNDS):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        # Pinned (BCRYPT_ROUNDS): hashes of any other cost are redone on login.
+        # Calibrated: only cheaper ones are, so instances on different hardware do not undo each other
+        self.pinned = rounds is not None
+        self.rounds = rounds or BCRYPT_DEFAULT_ROUNDS
+        self.pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordHasherBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        rounds = hash_rounds(hashed_password)
+        if rounds is None:
+            return True
+        return rounds != self.rounds if self.pinned else rounds < self.rounds
+
+    async def calibrate(self, target_ms: float = BCRYPT_TARGET_MS) -> int:
+        """Pick the cost whose hash takes about target_ms here (unless pinned). Returns it."""
+        if self.pinned:
+            return self.rounds
+
+        def timed() -> float:
+            started = time.perf_counter()
+            _hash("calibration", _CALIBRATION_ROUNDS)
+            return time.perf_counter() - started
+
+        # Fastest of three: the other two may have been slowed by startup work
+        loop = asyncio.get_running_loop()
+        seconds = min([await loop.run_in_executor(self._get_executor(), timed) for _ in range(3)])
+        extra = round(math.log2(max(target_ms / 1000 / max(seconds, 1e-6), 1.0)))
+        self.rounds = max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, _CALIBRATION_ROUNDS + extra))
+        return self.rounds
+
+    def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher()
 
 
 def hash_password(password: str) -> str:
     """
-    Hash a plain text password using bcrypt
-    
+    Hash a plain text password using bcrypt (blocking; handlers use password_hasher.hash)
+
     Args:
         password: Plain text password
-        
+
     Returns:
         Hashed password string
     """
-    # Truncate to 72 bytes to avoid bcrypt limitation
-    return pwd_context.hash(password[:72])
+    return _hash(password, password_hasher.rounds)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Verify a plain text password against a hashed password
-    
+    Verify a plain text password against a hashed password (blocking; handlers use password_hasher.verify)
+
     Args:
         plain_password: Plain text password to verify
         hashed_password: Hashed password from database
-        
+
     Returns:
         True if password matches, False otherwise
     """
-    try:
-        # Truncate to 72 chars to avoid bcrypt limitation before verifying
-        # Standard bcrypt behavior is to reject > 72 bytes, so we handle safely
-        return pwd_context.verify(plain_password[:72], hashed_password)
-    except Exception:
-        # If verification still fails internally for some reason
-        return False
+    # Truncated to 72 chars: standard bcrypt rejects longer input
+    return _verify(plain_password, hashed_password)
 
 
 def is_password_hashed(password: str) -> bool:
     """
     Check if a password is already hashed (bcrypt format)
-    
+
     Args:
         password: Password string to check
-        
+
     Returns:
         True if password is hashed, False if plain text
     """
@@ -1,100 +1,534 @@
 """
 Caching utilities for API endpoints. TTL from app.config.CACHE_TTL_SECONDS.
-Optional: if REDIS_URL is set, use Redis for cache; else in-memory TTLCache.
+Optional: if REDIS_URL is set, use Redis (redis.asyncio, pooled) for cache; else in-memory TLRUCache.
+CACHE_MODE=tiered keeps an in-process L1 in front of Redis, kept coherent over pub/sub.
+
+Entries are grouped by tags (see TAGS). Every tag has a generation counter; an entry
+remembers the generations it was computed at and is treated as a miss once any of them
+moved. invalidate("exams") is therefore one write, not a SCAN + DELETE.
+A bump sets the generation to max(previous + 1, now in ms), so generations double as
+"last modified" stamps of the tagged data (see data_version, used for ETags).
 """
-import hashlib
+import asyncio
 import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from collections.abc import Awaitable
 from functools import wraps
-from typing import Any, Callable
+from typing import Any, Callable, Optional
+
+from cachetools import LRUCache, TLRUCache
 
-from cachetools import TTLCache
+logger = logging.getLogger("app")
+
+TAGS = (
+    "schedule", "exams", "ratings", "announcements", "polls", "materials", "favorites", "reminders",
+    "subscriptions", "principals",
+)
+MAX_ENTRIES = 512
+# Pseudo-tag every entry depends on: bumping it is clear_cache()
+_ALL = "*"
+# Cross-worker recompute lock (Redis): lease length and how long other workers wait for the result
+LOCK_TTL_MS = 10_000
+LOCK_WAIT_SECONDS = 5.0
+LOCK_POLL_SECONDS = 0.05
+_RELEASE_LOCK_LUA = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# Generation bump: max(previous + 1, now_ms) for every key, atomically
+_BUMP_LUA = """
+local now = tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+    local v = tonumber(redis.call("get", key) or "0") + 1
+    if v < now then v = now end
+    redis.call("set", key, v)
+end
+return 0
+"""
+# Generations below this are plain counters (never bumped since the stamp scheme), not times
+_STAMP_MIN = 10**12
 
 # Lazy init
 schedule_cache: Any = None
 
 
-def _get_cache() -> Any:
-    global schedule_cache
-    if schedule_cache is not None:
-        return schedule_cache
-    from app.config import CACHE_TTL_SECONDS, REDIS_URL
-    if REDIS_URL:
-        try:
-            schedule_cache = _RedisCache(REDIS_URL, ttl=CACHE_TTL_SECONDS)
-        except Exception:
-            schedule_cache = TTLCache(maxsize=100, ttl=CACHE_TTL_SECONDS)
-    else:
-        schedule_cache = TTLCache(maxsize=100, ttl=CACHE_TTL_SECONDS)
-    return schedule_cache
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _ttu(_key, value, now):
+    # value is (gens, stored_at, payload, ttl): each entry expires after its own TTL
+    return now + value[3]
+
+
+class _MemoryCache:
+    """Per-process backend; tag generations live in a plain dict."""
+    shared = False
+
+    def __init__(self, ttl: int = 300):
+        self._data = TLRUCache(maxsize=MAX_ENTRIES, ttu=_ttu)
+        self._generations: dict[str, int] = defaultdict(int)
+        self.maxsize = MAX_ENTRIES
+        self.ttl = ttl
+
+    @property
+    def currsize(self) -> int:
+        return len(self._data)
+
+    async def generations(self, tags: tuple) -> tuple:
+        return tuple(self._generations[t] for t in tags)
+
+    async def get(self, key: str, tags: tuple) -> tuple:
+        """Return (entry or None, current generations of tags)."""
+        gens = await self.generations(tags)
+        entry = self._data.get(key)
+        if entry is not None and tuple(entry[0]) != gens:
+            entry = None
+        return entry, gens
+
+    async def get_many(self, items: list) -> list:
+        """items: [(key, tags)]. Returns entries (or None) in the same order."""
+        return [(await self.get(key, tags))[0] for key, tags in items]
+
+    async def set(self, key: str, gens: tuple, value: Any, ttl: int, stored_at: Optional[float] = None) -> None:
+        self._data[key] = (gens, stored_at or time.time(), value, ttl)
+
+    async def bump(self, tags: tuple) -> None:
+        now = _now_ms()
+        for tag in tags:
+            self._generations[tag] = max(self._generations[tag] + 1, now)
+
+    async def clear(self) -> None:
+        self._data.clear()
+        await self.bump((_ALL,))
+
+    async def versions(self, tags: tuple) -> tuple:
+        return await self.generations(tags)
+
+    async def acquire_lock(self, key: str) -> Optional[str]:
+        # One process: in-process single-flight already coalesces misses
+        return "local"
+
+    async def release_lock(self, key: str, token: str) -> None:
+        pass
 
 
 class _RedisCache:
-    """In-memory–like cache backed by Redis (sync interface for use inside async cached wrapper)."""
+    """
+    Backend on redis.asyncio with a shared connection pool.
+    A hit is one MGET (entry + its tag generations); no EXISTS round trip.
+    """
     _prefix = "mxt223:cache:"
+    _gen_prefix = "mxt223:gen:"
+    _lock_prefix = "mxt223:lock:"
+    shared = True
 
-    def __init__(self, url: str, ttl: int = 300):
-        import redis
-        self._client = redis.from_url(url, decode_responses=True)
-        self.maxsize = 100
+    def __init__(self, url: str, ttl: int = 300, max_connections: int = 20):
+        import redis.asyncio as redis_async
+        pool = redis_async.ConnectionPool.from_url(
+            url, max_connections=max_connections, decode_responses=True
+        )
+        self._client = redis_async.Redis(connection_pool=pool)
+        self.maxsize = MAX_ENTRIES
         self.ttl = ttl
         self.currsize = 0  # Not tracked for Redis
 
-    def __contains__(self, key: str) -> bool:
-        return self._client.exists(self._prefix + key) > 0
+    def _gen_keys(self, tags: tuple) -> list:
+        return [self._gen_prefix + t for t in tags]
+
+    async def generations(self, tags: tuple) -> tuple:
+        if not tags:
+            return ()
+        raw = await self._client.mget(self._gen_keys(tags))
+        return tuple(int(v or 0) for v in raw)
 
-    def __getitem__(self, key: str) -> Any:
-        import json as _json
-        raw = self._client.get(self._prefix + key)
+    def _decode(self, raw: Optional[str], gens: tuple) -> Optional[tuple]:
         if raw is None:
-            raise KeyError(key)
-        return _json.loads(raw)
+            return None
+        try:
+            entry = json.loads(raw)
+            if tuple(entry["g"]) != gens:
+                return None
+            return (gens, entry["t"], entry["v"], entry["ttl"])
+        except (TypeError, ValueError, KeyError):
+            # Malformed entry (e.g. written by an older version): a miss, overwritten on refresh
+            return None
+
+    async def get(self, key: str, tags: tuple) -> tuple:
+        raw = await self._client.mget([self._prefix + key, *self._gen_keys(tags)])
+        gens = tuple(int(v or 0) for v in raw[1:])
+        return self._decode(raw[0], gens), gens
+
+    async def get_many(self, items: list) -> list:
+        """items: [(key, tags)]. One MGET for all entries and all generations involved."""
+        if not items:
+            return []
+        all_tags = sorted({t for _, tags in items for t in tags})
+        keys = [self._prefix + key for key, _ in items]
+        raw = await self._client.mget(keys + self._gen_keys(tuple(all_tags)))
+        current = dict(zip(all_tags, (int(v or 0) for v in raw[len(keys):])))
+        return [
+            self._decode(raw[i], tuple(current[t] for t in tags))
+            for i, (_, tags) in enumerate(items)
+        ]
+
+    async def set(self, key: str, gens: tuple, value: Any, ttl: int) -> None:
+        payload = json.dumps({"g": gens, "t": time.time(), "v": value, "ttl": ttl}, default=str)
+        await self._client.set(self._prefix + key, payload, ex=int(ttl))
+
+    async def bump(self, tags: tuple) -> None:
+        keys = self._gen_keys(tags)
+        await self._client.eval(_BUMP_LUA, len(keys), *keys, _now_ms())
+
+    async def clear(self) -> None:
+        await self.bump((_ALL,))
+
+    async def versions(self, tags: tuple) -> tuple:
+        return await self.generations(tags)
+
+    async def acquire_lock(self, key: str) -> Optional[str]:
+        """SET NX PX: returns a token if this worker should compute the value, else None."""
+        token = uuid.uuid4().hex
+        ok = await self._client.set(self._lock_prefix + key, token, nx=True, px=LOCK_TTL_MS)
+        return token if ok else None
+
+    async def release_lock(self, key: str, token: str) -> None:
+        # Delete only if still ours (the lock may have expired and been taken over)
+        await self._client.eval(_RELEASE_LOCK_LUA, 1, self._lock_prefix + key, token)
+
+
+class _TieredCache:
+    """
+    L1 in-process cache in front of Redis L2. A read served by L1 costs no network hop.
+    Invalidations bump the L2 generations and are published on CHANNEL; every worker's
+    listener (start_invalidation_listener) bumps its L1 generations on receipt.
+    """
+    CHANNEL = "mxt223:cache:invalidate"
+    shared = True
+
+    def __init__(self, url: str, ttl: int = 300, max_connections: int = 20, l1_ttl: Optional[int] = None):
+        self.l1 = _MemoryCache(ttl=l1_ttl or ttl)
+        self.l2 = _RedisCache(url, ttl=ttl, max_connections=max_connections)
+        self.maxsize = self.l1.maxsize
+        self.ttl = ttl
+
+    @property
+    def currsize(self) -> int:
+        return self.l1.currsize
+
+    async def generations(self, tags: tuple) -> tuple:
+        return (await self.l1.generations(tags), await self.l2.generations(tags))
+
+    async def get(self, key: str, tags: tuple) -> tuple:
+        entry, l1_gens = await self.l1.get(key, tags)
+        if entry is not None:
+            return entry, (l1_gens, None)
+        entry, l2_gens = await self.l2.get(key, tags)
+        if entry is not None:
+            # Keep L2's age so soft/hard TTLs are measured from the original computation
+            remaining = entry[3] - (time.time() - entry[1])
+            if remaining > 0:
+                await self.l1.set(key, l1_gens, entry[2], remaining, stored_at=entry[1])
+        return entry, (l1_gens, l2_gens)
+
+    async def get_many(self, items: list) -> list:
+        entries = await self.l1.get_many(items)
+        missing = [i for i, e in enumerate(entries) if e is None]
+        if missing:
+            fetched = await self.l2.get_many([items[i] for i in missing])
+            for i, entry in zip(missing, fetched):
+                entries[i] = entry
+        return entries
+
+    async def set(self, key: str, gens: tuple, value: Any, ttl: int) -> None:
+        l1_gens, l2_gens = gens
+        await self.l1.set(key, l1_gens, value, ttl)
+        # None: gens of an L1 hit (see get), which say nothing about what L2 holds
+        if l2_gens is not None:
+            await self.l2.set(key, l2_gens, value, ttl)
+
+    async def with_l2_generations(self, gens: tuple, tags: tuple) -> tuple:
+        """gens from get() with the current L2 generations filled in if it was an L1 hit."""
+        l1_gens, l2_gens = gens
+        if l2_gens is None:
+            l2_gens = await self.l2.generations(tags)
+        return l1_gens, l2_gens
+
+    async def bump(self, tags: tuple) -> None:
+        await self.l1.bump(tags)
+        await self.l2.bump(tags)
+        message = json.dumps({"origin": _WORKER_ID, "tags": list(tags)})
+        await self.l2._client.publish(self.CHANNEL, message)
+
+    async def clear(self) -> None:
+        await self.l1.clear()
+        await self.bump((_ALL,))
+
+    async def versions(self, tags: tuple) -> tuple:
+        # L1 generations are per process; L2 ones are the same on every worker
+        return await self.l2.generations(tags)
+
+    async def acquire_lock(self, key: str) -> Optional[str]:
+        return await self.l2.acquire_lock(key)
+
+    async def release_lock(self, key: str, token: str) -> None:
+        await self.l2.release_lock(key, token)
+
+    async def listen(self) -> None:
+        """Apply invalidations published by other workers. Runs until cancelled."""
+        while True:
+            pubsub = self.l2._client.pubsub()
+            try:
+                await pubsub.subscribe(self.CHANNEL)
+                # Messages may have been missed while (re)connecting
+                await self.l1.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data.get("origin") == _WORKER_ID:
+                        continue
+                    tags = tuple(data.get("tags") or ())
+                    await self.l1.bump(tags)
+                    _notify_listeners(tags)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("cache invalidation listener error: %s; reconnecting", e)
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def _get_cache() -> Any:
+    global schedule_cache
+    if schedule_cache is not None:
+        return schedule_cache
+    from app.config import (
+        CACHE_L1_TTL_SECONDS,
+        CACHE_MODE,
+        CACHE_TTL_SECONDS,
+        REDIS_MAX_CONNECTIONS,
+        REDIS_URL,
+    )
+    mode = CACHE_MODE or ("redis" if REDIS_URL else "memory")
+    try:
+        if mode == "tiered" and REDIS_URL:
+            schedule_cache = _TieredCache(
+                REDIS_URL, ttl=CACHE_TTL_SECONDS, max_connections=REDIS_MAX_CONNECTIONS, l1_ttl=CACHE_L1_TTL_SECONDS
+            )
+        elif mode == "redis" and REDIS_URL:
+            schedule_cache = _RedisCache(REDIS_URL, ttl=CACHE_TTL_SECONDS, max_connections=REDIS_MAX_CONNECTIONS)
+        else:
+            schedule_cache = _MemoryCache(ttl=CACHE_TTL_SECONDS)
+    except Exception:
+        schedule_cache = _MemoryCache(ttl=CACHE_TTL_SECONDS)
+    return schedule_cache
+
+
+# ----- Invalidation listeners (e.g. the schedule snapshot) -----
+_WORKER_ID = uuid.uuid4().hex
+_listeners: list = []
+_listener_task: Optional[asyncio.Task] = None
+
+
+def add_invalidation_listener(callback: Callable[[tuple], None]) -> None:
+    """callback(tags) is called when another worker invalidated tags (tiered mode)."""
+    _listeners.append(callback)
 
-    def __setitem__(self, key: str, value: Any) -> None:
-        import json as _json
-        k = self._prefix + key
-        self._client.setex(k, self.ttl, _json.dumps(value, default=str))
 
-    def clear(self) -> None:
-        for k in self._client.scan_iter(match=self._prefix + "*"):
-            self._client.delete(k)
+def cross_worker_invalidation() -> bool:
+    """True if invalidate() reaches the listeners of the other workers (tiered mode)."""
+    return isinstance(_get_cache(), _TieredCache)
+
+
+def _notify_listeners(tags: tuple) -> None:
+    for callback in _listeners:
+        try:
+            callback(tags)
+        except Exception:
+            logger.exception("cache invalidation listener failed")
+
+
+def start_invalidation_listener() -> None:
+    """Start the pub/sub listener if the tiered backend is configured. Call from lifespan."""
+    global _listener_task
+    cache = _get_cache()
+    if isinstance(cache, _TieredCache) and _listener_task is None:
+        _listener_task = asyncio.create_task(cache.listen())
+
+
+async def stop_invalidation_listener() -> None:
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        _listener_task = None
 
 
 def cache_key(*args, **kwargs) -> str:
     """
-    Generate a cache key from function arguments
-    
-    Args:
-        *args: Positional arguments
-        **kwargs: Keyword arguments
-        
-    Returns:
-        MD5 hash of serialized arguments
+    Generate a cache key from function arguments.
+
+    Endpoint arguments are scalars (ids, subject names), so their repr is already a
+    stable, unique key; no JSON serialization or hashing on the hot path.
     """
-    key_data = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True, default=str)
-    return hashlib.md5(key_data.encode()).hexdigest()
+    if not args and not kwargs:
+        return ""
+    parts = [repr(a) for a in args]
+    if kwargs:
+        parts.extend(f"{k}={v!r}" for k, v in sorted(kwargs.items()))
+    return ",".join(parts)
+
+
+# ----- Single-flight -----
+_inflight: dict[str, asyncio.Future] = {}
 
 
-def cached(ttl: int = None):
+def _flight_done(key: str, task: asyncio.Future) -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # mark retrieved: no "never retrieved" warning without waiters
+
+
+async def single_flight(key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
     """
-    Decorator for caching async function results. Uses CACHE_TTL_SECONDS if ttl not given.
+    Run fn() once per key at a time in this process: concurrent callers with the same
+    key wait for the first one and share its result (or exception). fn() runs in its own
+    task, so the first caller being cancelled (its client went away) does not fail the others.
     """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fn())
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _flight_done(key, done))
+    return await asyncio.shield(task)
+
+
+class _Filled:
+    """Another worker filled the entry while we waited for its lock."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+async def _acquire_or_wait(cache, key: str, tags: tuple):
+    """
+    Take the cross-worker recompute lock for key. If another worker holds it, poll the
+    cache for its result (returns _Filled) and give up waiting after LOCK_WAIT_SECONDS
+    (returns None: compute without the lock rather than stall the request).
+    """
+    try:
+        token = await cache.acquire_lock(key)
+        if token:
+            return token
+        deadline = time.monotonic() + LOCK_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+            entry, _ = await cache.get(key, tags)
+            if entry is not None:
+                return _Filled(entry[2])
+    except Exception as e:
+        logger.warning("cache lock for %s failed: %s", key, e)
+    return None
+
+
+def cached(ttl: Optional[int] = None, tags: tuple = (), soft_ttl: Optional[int] = None):
+    """
+    Decorator for caching async function results.
+    ttl: hard TTL, entry is gone after it (CACHE_TTL_SECONDS if not given).
+    soft_ttl: after it a hit still returns the cached value immediately and the value is
+    recomputed in the background (stale-while-revalidate). CACHE_SOFT_TTL_SECONDS if not
+    given; 0 disables. Entries of an invalidated tag are never served stale.
+    tags: data the result depends on; invalidate(tag) drops it after a write and re-warms it.
+    """
+    for tag in tags:
+        if tag not in TAGS:
+            raise ValueError(f"Unknown cache tag: {tag}")
+    entry_tags = (*tags, _ALL)
+
     def decorator(func: Callable):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        async def refresh(cache, key: str, gens: tuple, args: tuple, kwargs: dict):
+            token = await _acquire_or_wait(cache, key, entry_tags)
+            if isinstance(token, _Filled):
+                return token.value
+            try:
+                if isinstance(cache, _TieredCache):
+                    # A stale L1 hit being refreshed: read L2's generations before computing,
+                    # so the new value reaches L2 too (only L1 is written if that fails)
+                    try:
+                        gens = await cache.with_l2_generations(gens, entry_tags)
+                    except Exception as e:
+                        logger.warning("cache generations read failed for %s: %s", name, e)
+                result = await func(*args, **kwargs)
+                # Stored with the generations seen before computing: a write that
+                # happened meanwhile makes this entry stale rather than hiding itself
+                try:
+                    await cache.set(key, gens, result, hard_ttl(cache))
+                except Exception as e:
+                    logger.warning("cache set failed for %s: %s", name, e)
+                return result
+            finally:
+                if token:
+                    try:
+                        await cache.release_lock(key, token)
+                    except Exception:
+                        pass
+
+        def hard_ttl(cache) -> int:
+            return ttl or cache.ttl
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
             cache = _get_cache()
-            key = f"{func.__name__}:{cache_key(*args, **kwargs)}"
-            if key in cache:
-                return cache[key]
-            result = await func(*args, **kwargs)
-            cache[key] = result
-            return result
+            key = f"{name}|{cache_key(*args, **kwargs)}"
+            _remember(tags, key, wrapper, args, kwargs)
+            try:
+                entry, gens = await cache.get(key, entry_tags)
+            except Exception as e:
+                # Cache backend down: serve uncached rather than failing the request
+                logger.warning("cache get failed for %s: %s", name, e)
+                return await func(*args, **kwargs)
+            # Generations in the flight key: callers arriving after an invalidation
+            # must not join a computation that started before it
+            flight_key = f"{key}|{gens}"
+            if entry is not None:
+                soft = _soft_ttl() if soft_ttl is None else soft_ttl
+                if soft and time.time() - entry[1] > soft and flight_key not in _inflight:
+                    _spawn(single_flight(flight_key, lambda: refresh(cache, key, gens, args, kwargs)))
+                return entry[2]
+            return await single_flight(flight_key, lambda: refresh(cache, key, gens, args, kwargs))
 
-        def clear_cache_fn():
-            _get_cache().clear()
+        async def clear_cache_fn():
+            if tags:
+                await invalidate(*tags)
+            else:
+                await clear_cache()
 
         def cache_info_fn():
             c = _get_cache()
-            return {"size": len(c), "maxsize": c.maxsize, "ttl": c.ttl}
+            return {
+                "size": c.currsize,
+                "maxsize": c.maxsize,
+                "ttl": hard_ttl(c),
+                "soft_ttl": _soft_ttl() if soft_ttl is None else soft_ttl,
+                "tags": list(tags),
+            }
 
         wrapper.clear_cache = clear_cache_fn
         wrapper.cache_info = cache_info_fn
@@ -102,16 +536,96 @@ def cached(ttl: int = None):
     return decorator
 
 
-def clear_cache():
+def _soft_ttl() -> int:
+    from app.config import CACHE_SOFT_TTL_SECONDS
+    return CACHE_SOFT_TTL_SECONDS
+
+
+# ----- Re-warming after invalidation -----
+# Per tag: recently requested calls (key -> (wrapper, args, kwargs)), re-run after invalidate()
+REWARM_PER_TAG = 32
+_recent: dict[str, LRUCache] = {}
+_background: set = set()
+
+
+def _remember(tags: tuple, key: str, wrapper: Callable, args: tuple, kwargs: dict) -> None:
+    for tag in tags:
+        calls = _recent.get(tag)
+        if calls is None:
+            calls = _recent[tag] = LRUCache(maxsize=REWARM_PER_TAG)
+        calls[key] = (wrapper, args, kwargs)
+
+
+def _spawn(coro) -> None:
+    """Fire-and-forget task; keeps a reference until done and logs failures."""
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+
+    def _done(t: asyncio.Task) -> None:
+        _background.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.warning("cache background refresh failed: %s", t.exception())
+
+    task.add_done_callback(_done)
+
+
+async def _rewarm(tags: tuple) -> None:
+    calls = {}
+    for tag in tags:
+        calls.update(_recent.get(tag, {}))
+    for wrapper, args, kwargs in calls.values():
+        try:
+            await wrapper(*args, **kwargs)
+        except Exception as e:
+            logger.warning("cache re-warm failed: %s", e)
+
+
+def user_tag(tag: str, user_id) -> str:
+    """Per-user variant of tag ("favorites:42") for data only that user's responses depend on."""
+    if tag not in TAGS:
+        raise ValueError(f"Unknown cache tag: {tag}")
+    return f"{tag}:{user_id}"
+
+
+async def invalidate(*tags: str) -> None:
+    """
+    Drop all cached entries depending on any of the given tags. Call after writes.
+    Recently requested entries of these tags are recomputed in the background, so the
+    first reader after an edit does not pay for it.
+    """
+    try:
+        await _get_cache().bump(tags)
+    except Exception as e:
+        logger.warning("cache invalidate %s failed: %s", tags, e)
+        return
+    _spawn(_rewarm(tags))
+
+
+async def data_version(tags: tuple) -> tuple:
+    """
+    (version, last_modified) of the data behind tags, without reading it.
+
+    version changes whenever any of the tags (or everything, via clear_cache) is
+    invalidated. Generations are invalidation times in milliseconds, so they compare
+    across workers even with the in-memory backend (where a worker only knows about
+    its own invalidations). last_modified is the Unix time of the latest invalidation,
+    None if none is known (e.g. right after a restart).
+    """
+    stamps = await _get_cache().versions(tuple(tags) + (_ALL,))
+    latest = max(stamps)
+    return ",".join(map(str, stamps)), latest / 1000 if latest >= _STAMP_MIN else None
+
+
+async def clear_cache():
     """Clear all cached data."""
-    _get_cache().clear()
+    await _get_cache().clear()
 
 
 def get_cache_stats() -> dict:
     """Return cache statistics."""
     c = _get_cache()
     return {
-        "size": len(c),
+        "size": c.currsize,
         "maxsize": c.maxsize,
         "ttl": c.ttl,
         "currsize": c.currsize,
@@ -1,10 +1,21 @@
 """
 JWT token utilities for authentication
+
+verify_token keeps recently verified tokens in a bounded LRU keyed by a digest of the
+token, until the token's exp: a client presents the same access token on every request,
+so the decode and HMAC run once per token instead of once per request. The verifier on a
+miss is pluggable (JWT_VERIFIER): python-jose, or a lean stdlib HS256 check.
 """
+import base64
+import hashlib
+import hmac
+import json
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 
+from cachetools import TLRUCache
 from jose import JWTError, jwt
 
 # JWT Configuration (overridable via env)
@@ -12,6 +23,10 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_EXPIRE_MINUTES", "15"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("JWT_REFRESH_EXPIRE_DAYS", "7"))
+CALENDAR_TOKEN_EXPIRE_DAYS = 365
+# "jose" (python-jose) or "hs256" (stdlib HMAC, HS256 only)
+JWT_VERIFIER = os.getenv("JWT_VERIFIER", "jose").strip().lower()
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_TOKEN_CACHE_SIZE", "4096"))
 
 
 def create_access_token(data: dict) -> str:
@@ -49,6 +64,81 @@ def create_refresh_token(data: dict, days: Optional[int] = None) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def create_calendar_token(user_id: str) -> str:
+    """
+    Long-lived token for a personal calendar subscription URL (calendar apps cannot send headers).
+    Only accepted by the calendar feed (type "calendar").
+    """
+    to_encode = {
+        "sub": user_id,
+        "type": "calendar",
+        "iat": datetime.utcnow(),
+        "exp": datetime.utcnow() + timedelta(days=CALENDAR_TOKEN_EXPIRE_DAYS),
+    }
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def jose_verify(token: str) -> Optional[dict]:
+    """Signature and registered claims checked by python-jose; None if invalid."""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+
+def hs256_verify(token: str) -> Optional[dict]:
+    """
+    The same checks for HS256 tokens with the standard library only: alg header, HMAC
+    (constant-time compare), exp and nbf. None if invalid.
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        if header.get("alg") != ALGORITHM:
+            return None
+        expected = hmac.new(SECRET_KEY.encode(), f"{header_b64}.{payload_b64}".encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature_b64)):
+            return None
+        payload = json.loads(_b64decode(payload_b64))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    now = time.time()
+    try:
+        if "exp" in payload and float(payload["exp"]) <= now:
+            return None
+        if "nbf" in payload and float(payload["nbf"]) > now:
+            return None
+    except (TypeError, ValueError):
+        return None
+    return payload
+
+
+VERIFIERS = {"jose": jose_verify, "hs256": hs256_verify}
+_verify = VERIFIERS.get(JWT_VERIFIER, jose_verify)
+
+
+def _token_ttu(_key, payload: dict, now: float) -> float:
+    # Evicted at exp; tokens without exp are not cached (see verify_token)
+    return float(payload["exp"])
+
+
+# digest -> verified payload
+_verified: TLRUCache = TLRUCache(maxsize=TOKEN_CACHE_SIZE, ttu=_token_ttu, timer=time.time)
+
+
+def set_verifier(name: str) -> None:
+    """Switch the verifier backend ("jose" / "hs256"), e.g. for benchmarks. Clears the cache."""
+    global _verify
+    _verify = VERIFIERS[name]
+    _verified.clear()
+
+
 def verify_token(token: str, token_type: str = "access") -> Optional[dict]:
     """
     Verify and decode a JWT token
@@ -60,17 +150,22 @@ def verify_token(token: str, token_type: str = "access") -> Optional[dict]:
     Returns:
         Decoded payload if valid, None otherwise
     """
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        # Check token type
-        if payload.get("type") != token_type:
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    payload = _verified.get(key)
+    if payload is None:
+        payload = _verify(token)
+        if payload is None:
+            # Invalid tokens are not remembered: garbage cannot push valid ones out
             return None
-            
-        return payload
-    except JWTError:
+        if isinstance(payload.get("exp"), (int, float)):
+            _verified[key] = payload
+
+    # Check token type
+    if payload.get("type") != token_type:
         return None
 
+    return dict(payload)
+
 
 def is_jwt_token(token: str) -> bool:
     """
@@ -197,10 +197,23 @@ window.deleteTeacher = async function (id) {
     }
 }
 
+function updatePushAudience() {
+    const audience = document.getElementById('push-audience').value;
+    const group = document.getElementById('push-audience-value-group');
+    const label = document.getElementById('push-audience-value-label');
+    const input = document.getElementById('push-audience-value');
+    const needsValue = audience === 'favorite_subject' || audience === 'exam_reminder';
+    group.classList.toggle('hidden', !needsValue);
+    label.textContent = audience === 'exam_reminder' ? 'ID экзамена' : 'Предмет';
+    input.placeholder = audience === 'exam_reminder' ? '12' : 'Название предмета';
+}
+
 async function sendPushNotification() {
     const title = document.getElementById('push-title').value;
     const message = document.getElementById('push-message').value;
     const url = document.getElementById('push-url').value;
+    const audience = document.getElementById('push-audience').value;
+    const value = document.getElementById('push-audience-value').value.trim();
     const resultDiv = document.getElementById('push-result');
 
     if (!message) {
@@ -208,18 +221,35 @@ async function sendPushNotification() {
         return;
     }
 
-    if (!confirm('Отправить это уведомление всем подписчикам?')) return;
+    const audienceLabel = document.getElementById('push-audience').selectedOptions[0].textContent;
+    if (!confirm(`Отправить это уведомление? Получатели: ${audienceLabel.toLowerCase()}${value ? ' — ' + value : ''}`)) return;
 
-    const result = await apiCall('/api/admin/push', 'POST', { title, message, url });
+    const result = await apiCall('/api/admin/push', 'POST', { title, message, url, audience, value });
 
     if (result && result.success) {
-        showAdminMessage(resultDiv, `Отправлено: ${result.sent}, Ошибок: ${result.failed}`, false);
+        showAdminMessage(resultDiv, `В очереди на отправку: ${result.queued}`, false);
         document.getElementById('push-message').value = '';
+        if (result.job_id) trackPushJob(result.job_id, resultDiv);
     } else {
         showAdminMessage(resultDiv, result?.error || 'Ошибка отправки', true);
     }
 }
 
+// Progress of a queued broadcast, polled until the outbox has finished it (at most ~2 min)
+async function trackPushJob(jobId, resultDiv) {
+    for (let i = 0; i < 60; i++) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const job = await apiCall(`/api/admin/push/${jobId}`);
+        if (!job || !job.counts) return;
+        const sent = job.counts.sent || 0;
+        const failed = (job.counts.failed || 0) + (job.counts.expired || 0);
+        let text = `Доставлено: ${sent} из ${job.total}`;
+        if (failed) text += `, не доставлено: ${failed}`;
+        showAdminMessage(resultDiv, job.state === 'done' ? text : text + '…', false);
+        if (job.state === 'done') return;
+    }
+}
+
 // --- Announcements ---
 async function loadAnnouncement() {
     const data = await apiCall('/api/announcement');
@@ -259,6 +289,10 @@ async function loadAnnouncement() {
     }
 }
 
+// admin.js is a module: inline on* handlers cannot see its functions
+document.getElementById('push-audience').addEventListener('change', updatePushAudience);
+document.getElementById('send-push-btn').addEventListener('click', sendPushNotification);
+
 document.getElementById('save-announcement-btn').addEventListener('click', async () => {
     const message = document.getElementById('announcement-input').value;
     const weekNum = document.getElementById('announcement-week')?.value;
@@ -4,10 +4,16 @@
 import { apiRequest } from '../api.js';
 
 /**
+ * @param {{ week?: number, day?: string, date?: string }} [filter] - only lessons active in that window (server-side)
  * @returns {Promise<Array<{ id: number, day: number, pair: number, subject: string, type: string, teacher: string, room: string, weeks: number[] }>>}
  */
-export async function getSchedule() {
-    const response = await apiRequest('/api/schedule');
+export async function getSchedule(filter = {}) {
+    const params = new URLSearchParams();
+    for (const [key, value] of Object.entries(filter)) {
+        if (value !== undefined && value !== null && value !== '') params.set(key, String(value));
+    }
+    const query = params.toString();
+    const response = await apiRequest(query ? `/api/schedule?${query}` : '/api/schedule');
     if (!response.ok) {
         throw new Error(response.status === 401 ? 'Требуется вход' : `Ошибка ${response.status}`);
     }
@@ -392,8 +392,14 @@ async function toggleNotifications() {
                 // Unsubscribe from browser
                 await subscription.unsubscribe();
 
-                // Optional: Tell backend to remove (not strictly required if we handle 410 errors, but good practice)
-                // await fetch('/api/unsubscribe', ...); 
+                // Tell backend to forget this device (other devices stay subscribed)
+                try {
+                    await fetch('/api/unsubscribe', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ endpoint: subscription.endpoint })
+                    });
+                } catch (_) { }
             }
 
             btn.classList.remove('subscribed');
@@ -742,8 +748,19 @@ loadAndRenderAchievements();
 // --- Google Calendar (один тап) ---
 const googleBtn = document.getElementById('google-calendar-btn');
 if (googleBtn) {
-    const icsUrl = window.location.origin + '/api/calendar.ics';
-    googleBtn.href = 'https://calendar.google.com/calendar/render?cid=' + encodeURIComponent(icsUrl);
+    const setCalendarUrl = (path) => {
+        googleBtn.href = 'https://calendar.google.com/calendar/render?cid=' + encodeURIComponent(window.location.origin + path);
+    };
+    setCalendarUrl('/api/calendar.ics');
+    // With favorites: personal feed (favorite subjects + my exams)
+    const token = localStorage.getItem('access_token');
+    const favorites = JSON.parse(localStorage.getItem('favorite_subjects') || '[]');
+    if (token && favorites.length) {
+        fetch('/api/calendar/link', { headers: { Authorization: `Bearer ${token}` } })
+            .then((r) => (r.ok ? r.json() : null))
+            .then((data) => { if (data && data.url) setCalendarUrl(data.url); })
+            .catch(() => { });
+    }
 }
 
 // Global function for password toggle